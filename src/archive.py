@@ -0,0 +1,319 @@
+"""
+Index of a sweep archive in SQLite: start time, frequency span, number of points, detected peak and the
+fit results of every .dat and binary sweep file. Scans are incremental, only new and changed files are read.
+    python archive.py scan /data/forks --db sweeps.sqlite --jobs 4
+    python archive.py query --db sweeps.sqlite --since 2021-03-01 --until 2021-03-02 --freq 31900 32100
+    python batch.py wide.swp --index sweeps.sqlite --since 2021-03-01 --freq 31900 32100 --warm
+"""
+import argparse
+import datetime
+import os
+import sqlite3
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple, Union
+import numpy as np
+
+from logger import log_settings
+from loader import load_sweep, date_convert
+import sweepfile
+
+#logger
+app_log = log_settings()
+
+default_db = "sweeps.sqlite"
+
+schema = """
+CREATE TABLE IF NOT EXISTS sweeps (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sweep_group TEXT NOT NULL,
+    start REAL NOT NULL,
+    count INTEGER NOT NULL,
+    f_min REAL NOT NULL,
+    f_max REAL NOT NULL,
+    peak REAL,
+    f0 REAL,
+    q REAL,
+    k REAL
+);
+CREATE INDEX IF NOT EXISTS sweeps_start ON sweeps (start);
+CREATE INDEX IF NOT EXISTS sweeps_f_min ON sweeps (f_min);
+CREATE INDEX IF NOT EXISTS sweeps_peak ON sweeps (peak);
+"""
+
+
+class SweepEntry(NamedTuple):
+    """
+    Row of the index
+    Attributes:
+        :param path: absolute path of the file
+        :param size: size of the file, a changed file is read again
+        :param mtime_ns: modification time of the file
+        :param group: "wide", "short" or "" if unknown
+        :param start: UTC timestamp of the first point, Labview time divided by `date_convert`
+        :param points: number of points
+        :param f_min: minimum frequency
+        :param f_max: maximum frequency
+        :param peak: frequency of the maximum of X above the line between the ends of the sweep
+        :param f0: fitted resonant frequency, None if the sweep is not fitted
+        :param q: fitted Q
+        :param k: K of the fit
+    """
+    path: str
+    size: int
+    mtime_ns: int
+    group: str
+    start: float
+    points: int
+    f_min: float
+    f_max: float
+    peak: Optional[float]
+    f0: Optional[float] = None
+    q: Optional[float] = None
+    k: Optional[float] = None
+
+    @property
+    def date(self) -> datetime.datetime:
+        return datetime.datetime.utcfromtimestamp(self.start)
+
+
+def detect_peak(freq: np.ndarray, x: np.ndarray, ends: int = 10) -> Optional[float]:
+    """
+    Frequency of the maximum of X above the straight line through the means of the `ends` first and
+    last points, a rough resonance without the fit of the wide sweep
+    """
+    if len(freq) < 2 * ends:
+        return None
+    freq = np.asarray(freq, dtype=float)
+    x = np.asarray(x, dtype=float)
+    f1, f2 = np.mean(freq[:ends]), np.mean(freq[-ends:])
+    x1, x2 = np.mean(x[:ends]), np.mean(x[-ends:])
+    if f2 == f1:
+        return None
+    line = x1 + (x2 - x1) * (freq - f1) / (f2 - f1)
+    return float(freq[int(np.argmax(x - line))])
+
+
+def describe(path: str, group: str = "") -> SweepEntry:
+    """
+    Entry of a .dat file or a binary sweep, the fit values are empty
+    :param group: group of a .dat file, a binary sweep has its own
+    :raise: OSError, ValueError
+    """
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    if sweepfile.is_sweep_file(path):
+        sweep = sweepfile.read_columns(path)
+        header = sweep.header
+        return SweepEntry(path, stat.st_size, stat.st_mtime_ns, header.group or group, header.start, header.points,
+                          header.f_min, header.f_max, detect_peak(sweep["frequency"], sweep["X"]))
+    data = load_sweep(path)
+    return SweepEntry(path, stat.st_size, stat.st_mtime_ns, group, float(data["uni_time"][0]) / date_convert,
+                      len(data), float(np.min(data["frequency"])), float(np.max(data["frequency"])),
+                      detect_peak(data["frequency"], data["X"]))
+
+
+def describe_or_error(path: str, group: str = "") -> Union[SweepEntry, str]:
+    """
+    `describe` for a pool of processes, a broken file gives the error text
+    """
+    try:
+        return describe(path, group)
+    except (OSError, ValueError) as ex:
+        return str(ex)
+
+
+def find_files(folder: str) -> List[str]:
+    """
+    Absolute paths of the .dat files and binary sweeps in the folder and its subfolders
+    """
+    files = []
+    for root, _, names in os.walk(folder):
+        for name in names:
+            if name.lower().endswith(".dat") or sweepfile.is_sweep_file(name):
+                files.append(os.path.abspath(os.path.join(root, name)))
+    return sorted(files)
+
+
+def parse_date(text: str) -> float:
+    """
+    UTC timestamp of an ISO date or date and time, e.g. "2021-03-01" or "2021-03-01T12:30"
+    """
+    return datetime.datetime.fromisoformat(text).replace(tzinfo=datetime.timezone.utc).timestamp()
+
+
+class SweepIndex(object):
+    """
+    SQLite index of the sweeps. Queries by time, frequency span and peak use the indices of the table.
+    :param path: database file, created if missing
+    """
+    def __init__(self, path: str = default_db) -> None:
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.executescript(schema)
+
+    def __enter__(self) -> "SweepIndex":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.db.close()
+
+    def add(self, entries: Iterable[SweepEntry]) -> None:
+        """
+        Inserts or replaces the entries, the fit values of a changed file are dropped with it
+        """
+        with self.db:
+            self.db.executemany(f"INSERT OR REPLACE INTO sweeps VALUES ({', '.join('?' * len(SweepEntry._fields))})",
+                                [tuple(entry) for entry in entries])
+
+    def scan(self, folder: str, group: str = "", jobs: int = 1) -> Tuple[int, int, int]:
+        """
+        Adds the new and changed files of the folder and removes the entries of deleted files
+        :param group: group of the .dat files, it is also set to the unchanged files of an other group;
+            if it is empty, a changed file keeps its group
+        :param jobs: number of processes to read the files
+        :return: numbers of added, unchanged and removed files
+        """
+        known: Dict[str, Tuple[int, int, str]] = {row[0]: row[1:] for row in self.db.execute(
+            "SELECT path, size, mtime_ns, sweep_group FROM sweeps")}
+        files = find_files(folder)
+        todo = []
+        regroup = []
+        for path in files:
+            stat = os.stat(path)
+            if known.get(path, ())[:2] != (stat.st_size, stat.st_mtime_ns):
+                todo.append(path)
+            elif group and known[path][2] != group and not sweepfile.is_sweep_file(path):
+                regroup.append((group, path))
+        with self.db:
+            self.db.executemany("UPDATE sweeps SET sweep_group = ? WHERE path = ?", regroup)
+        groups = [group or known.get(path, (0, 0, ""))[2] for path in todo]
+        if jobs > 1 and len(todo) > 1:
+            with ProcessPoolExecutor(max_workers=jobs) as pool:
+                results = list(pool.map(describe_or_error, todo, groups, chunksize=max(1, len(todo) // (4 * jobs))))
+        else:
+            results = [describe_or_error(path, grp) for path, grp in zip(todo, groups)]
+        entries = []
+        for path, res in zip(todo, results):
+            if isinstance(res, str):
+                app_log.warning(f"{path} is not indexed: {res}")
+            else:
+                entries.append(res)
+        self.add(entries)
+        root = os.path.join(os.path.abspath(folder), "")
+        present = set(files)
+        removed = [path for path in known if path.startswith(root) and path not in present]
+        with self.db:
+            self.db.executemany("DELETE FROM sweeps WHERE path = ?", [(path,) for path in removed])
+        app_log.info(f"Scan of {folder}: {len(entries)} sweeps added, {len(files) - len(todo)} unchanged, "
+                     f"{len(removed)} removed")
+        return len(entries), len(files) - len(todo), len(removed)
+
+    def select(self, since: Optional[float] = None, until: Optional[float] = None,
+               freq: Optional[Sequence[float]] = None, peak: Optional[Sequence[float]] = None,
+               group: Optional[str] = None, limit: Optional[int] = None) -> List[SweepEntry]:
+        """
+        Sweeps in the order of their start and path
+        :param since: UTC timestamp of the earliest start
+        :param until: UTC timestamp of the latest start
+        :param freq: (f_min, f_max), the frequency span of a sweep overlaps it
+        :param peak: (f_min, f_max), the detected peak is inside
+        :param group: "wide", "short" or "" for the sweeps of an unknown group, all the groups if None
+        """
+        where: List[str] = []
+        params: List = []
+        if since is not None:
+            where.append("start >= ?")
+            params.append(since)
+        if until is not None:
+            where.append("start <= ?")
+            params.append(until)
+        if freq is not None:
+            where.append("f_min <= ? AND f_max >= ?")
+            params.extend((freq[1], freq[0]))
+        if peak is not None:
+            where.append("peak BETWEEN ? AND ?")
+            params.extend((peak[0], peak[1]))
+        if group is not None:
+            where.append("sweep_group = ?")
+            params.append(group)
+        query = "SELECT * FROM sweeps" + (" WHERE " + " AND ".join(where) if where else "") + " ORDER BY start, path"
+        if limit is not None:
+            query += f" LIMIT {int(limit)}"
+        return [SweepEntry(*row) for row in self.db.execute(query, params)]
+
+    def store_fits(self, rows: Iterable[Dict]) -> int:
+        """
+        Stores f0, Q and K of the successful rows of `batch.process_files`, files out of the index are skipped
+        :return: number of updated entries
+        """
+        values = []
+        for row in rows:
+            if "error" in row or not row.get("success"):
+                continue
+            fit = [None if val is None or not np.isfinite(val) else float(val)
+                   for val in (row.get("f0"), row.get("Q"), row.get("K"))]
+            values.append((*fit, os.path.abspath(row["file"])))
+        with self.db:
+            cursor = self.db.executemany("UPDATE sweeps SET f0 = ?, q = ?, k = ? WHERE path = ?", values)
+        return cursor.rowcount
+
+
+def add_filters(parser: argparse.ArgumentParser) -> None:
+    """
+    Options of `SweepIndex.select`, shared with batch.py
+    """
+    parser.add_argument("--since", type=parse_date, help="earliest start, ISO date or date and time in UTC")
+    parser.add_argument("--until", type=parse_date, help="latest start, ISO date or date and time in UTC")
+    parser.add_argument("--freq", nargs=2, type=float, metavar=("FMIN", "FMAX"),
+                        help="frequency window which the sweeps overlap")
+    parser.add_argument("--peak", nargs=2, type=float, metavar=("FMIN", "FMAX"), help="window of the detected peak")
+
+
+def parse_args(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Index of a sweep archive")
+    parser.add_argument("--db", default=default_db, help="index file")
+    commands = parser.add_subparsers(dest="command")
+    scan = commands.add_parser("scan", help="add new and changed files of folders")
+    scan.add_argument("folders", nargs="+")
+    scan.add_argument("--group", choices=("wide", "short"), default="", help="group of the .dat files")
+    scan.add_argument("-j", "--jobs", type=int, default=1, help="number of processes, 0 for all cores")
+    query = commands.add_parser("query", help="print the sweeps of a time and frequency window")
+    add_filters(query)
+    query.add_argument("--group", choices=("wide", "short", ""), help="group of the sweeps, \"\" for unknown")
+    query.add_argument("--limit", type=int)
+    query.add_argument("--paths", action="store_true", help="print the paths only")
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.error("a command is required: scan or query")
+    return args
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    args = parse_args(argv)
+    with SweepIndex(args.db) as index:
+        if args.command == "scan":
+            jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+            for folder in args.folders:
+                added, unchanged, removed = index.scan(folder, args.group, jobs)
+                print(f"{folder}: {added} added, {unchanged} unchanged, {removed} removed")
+            return 0
+        entries = index.select(args.since, args.until, args.freq, args.peak, args.group, args.limit)
+        for entry in entries:
+            if args.paths:
+                print(entry.path)
+                continue
+            fit = "" if entry.f0 is None else f"\tf0 = {entry.f0:.3f}\tQ = {entry.q}\tK = {entry.k}"
+            peak = "-" if entry.peak is None else f"{entry.peak:.1f}"
+            print(f"{entry.date.isoformat(timespec='seconds')}\t{entry.path}\t{entry.group or '-'}\t{entry.points}"
+                  f"\t{entry.f_min:.1f}..{entry.f_max:.1f}\tpeak {peak}{fit}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,190 @@
+"""
+Cache of the wide sweep backgrounds. The polynomials are stored by the identity of the wide sweep file
+and the mask of the fit, in memory and on disk, so they survive a restart. Baselines evaluated on
+the frequency grid of a short sweep are kept in memory with an LRU bound of their total size.
+"""
+import glob
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+import numpy as np
+
+from logger import log_settings
+
+#logger
+app_log = log_settings()
+
+default_dir = os.path.join(os.environ.get("FORKS_FT_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".forks_ft_cache")),
+                           "backgrounds")
+# memory budget of the evaluated baselines in bytes
+default_baseline_budget = int(os.environ.get("FORKS_FT_BASELINE_BUDGET", 256 * 1024 * 1024))
+
+
+def grid_key(freq: np.ndarray) -> str:
+    """
+    Identity of a frequency grid
+    """
+    freq = np.ascontiguousarray(freq)
+    return f"{len(freq)}-{freq.dtype.str}-{hashlib.sha1(freq.tobytes()).hexdigest()}"
+
+
+class BackgroundCache(object):
+    """
+    Polynomials of the wide sweeps and their baselines.
+    The corrections of a short sweep (Slope X, Intersect X, Intersect Y) change only the linear and the
+    constant terms, so a baseline is cached without them and they are added on every evaluation.
+    :param directory: folder for the .npz files of the polynomials, None to keep them in memory only
+    :param max_coefs: number of polynomials in memory
+    :param max_baselines: number of evaluated baselines in memory
+    :param baseline_budget: total bytes of the evaluated baselines in memory, a larger baseline is not kept
+    """
+    def __init__(self, directory: Optional[str] = default_dir, max_coefs: int = 256, max_baselines: int = 64,
+                 baseline_budget: int = default_baseline_budget) -> None:
+        self.directory = directory
+        self.max_coefs = max_coefs
+        self.max_baselines = max_baselines
+        self.baseline_budget = baseline_budget
+        self.baseline_bytes = 0
+        self.coefs: "OrderedDict[str, Tuple[np.ndarray, np.ndarray]]" = OrderedDict()
+        self.baselines: "OrderedDict[Tuple[bytes, str], np.ndarray]" = OrderedDict()
+        self.stats: Dict[str, int] = {"hits": 0, "misses": 0}
+        # sessions of the fit service use the cache from several threads
+        self.lock = threading.RLock()
+
+    @staticmethod
+    def key(path: str, mask: Optional[np.ndarray], deg_x: int, deg_y: int, method: str = "polyfit") -> str:
+        """
+        Key of the fit of the wide sweep file `path` with the points `mask`. A changed file gets a new key.
+        :param method: "polyfit" or the robust method
+        """
+        stat = os.stat(path)
+        ident = hashlib.sha1(os.path.abspath(path).encode("utf-8")).hexdigest()
+        points = "all" if mask is None or np.all(mask) else hashlib.sha1(np.packbits(mask).tobytes()).hexdigest()
+        return f"{ident}-{stat.st_size}-{stat.st_mtime_ns}-{points}-{deg_x}-{deg_y}-{method}"
+
+    def get(self, key: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Polynomials of X and Y from memory or disk, None if the fit is not cached
+        """
+        with self.lock:
+            if key in self.coefs:
+                self.coefs.move_to_end(key)
+                return self.coefs[key]
+        if self.directory is not None:
+            entry = os.path.join(self.directory, key + ".npz")
+            if os.path.exists(entry):
+                try:
+                    with np.load(entry) as data:
+                        coefs = (data["fitx"], data["fity"])
+                except Exception as ex:
+                    app_log.warning(f"Background {entry} is broken and will be fitted again: {ex}")
+                else:
+                    self.remember(key, coefs)
+                    return coefs
+        return None
+
+    def get_mask(self, key: str, size: int) -> Optional[np.ndarray]:
+        """
+        Mask of a robust fit from disk, None if it is not cached. The masks are not kept in memory.
+        :param size: number of points of the wide sweep
+        """
+        if self.directory is None:
+            return None
+        entry = os.path.join(self.directory, key + ".npz")
+        try:
+            with np.load(entry) as data:
+                if "mask" not in data.files:
+                    return None
+                mask = np.unpackbits(data["mask"], count=size).astype(bool)
+        except FileNotFoundError:
+            return None
+        except Exception as ex:
+            app_log.warning(f"Mask of background {entry} is broken and will be fitted again: {ex}")
+            return None
+        return mask
+
+    def put(self, key: str, fitx: np.ndarray, fity: np.ndarray, mask: Optional[np.ndarray] = None) -> None:
+        """
+        Stores the polynomials in memory and on disk. Old fits of the same file are removed from disk.
+        :param mask: points of a robust fit, saved on disk only
+        """
+        coefs = (np.array(fitx, dtype=float), np.array(fity, dtype=float))
+        self.remember(key, coefs)
+        if self.directory is None:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            ident, size, mtime = key.split("-")[:3]
+            for old in glob.glob(os.path.join(self.directory, f"{ident}-*.npz")):
+                if not os.path.basename(old).startswith(f"{ident}-{size}-{mtime}-"):
+                    os.remove(old)
+            # own temporary file of every writer, two processes may save the same fit
+            tmp = os.path.join(self.directory, f"{key}.{os.getpid()}.{threading.get_ident()}.tmp.npz")
+            if mask is None:
+                np.savez(tmp, fitx=coefs[0], fity=coefs[1])
+            else:
+                np.savez(tmp, fitx=coefs[0], fity=coefs[1], mask=np.packbits(mask))
+            os.replace(tmp, os.path.join(self.directory, key + ".npz"))
+        except OSError as ex:
+            app_log.warning(f"Background {key} can NOT be saved: {ex}")
+
+    def remember(self, key: str, coefs: Tuple[np.ndarray, np.ndarray]) -> None:
+        with self.lock:
+            self.coefs[key] = coefs
+            self.coefs.move_to_end(key)
+            while len(self.coefs) > self.max_coefs:
+                self.coefs.popitem(last=False)
+
+    def evaluate(self, coef: np.ndarray, freq: np.ndarray, grid: Optional[str] = None) -> np.ndarray:
+        """
+        Polynomial `coef` on the frequencies `freq` as np.polyval, a new array.
+        The terms of power 2 and higher are taken from the LRU of baselines.
+        :param grid: `grid_key` of `freq`, computed if None
+        """
+        coef = np.asarray(coef, dtype=float)
+        if len(coef) < 3:
+            return np.polyval(coef, freq)
+        high = coef.copy()
+        high[-2:] = 0.0
+        key = (high.tobytes(), grid_key(freq) if grid is None else grid)
+        with self.lock:
+            base = self.baselines.get(key)
+            if base is not None:
+                self.stats["hits"] += 1
+                self.baselines.move_to_end(key)
+        if base is None:
+            base = np.polyval(high, freq)
+            with self.lock:
+                self.stats["misses"] += 1
+                if base.nbytes <= self.baseline_budget:
+                    old = self.baselines.pop(key, None)
+                    if old is not None:
+                        self.baseline_bytes -= old.nbytes
+                    self.baselines[key] = base
+                    self.baseline_bytes += base.nbytes
+                    while len(self.baselines) > self.max_baselines or self.baseline_bytes > self.baseline_budget:
+                        self.baseline_bytes -= self.baselines.popitem(last=False)[1].nbytes
+        res = np.multiply(freq, coef[-2], dtype=float)
+        res += base
+        res += coef[-1]
+        return res
+
+    def clear(self) -> None:
+        """
+        Drops the memory and the disk entries
+        """
+        with self.lock:
+            self.coefs.clear()
+            self.baselines.clear()
+            self.baseline_bytes = 0
+        if self.directory is not None:
+            for name in glob.glob(os.path.join(self.directory, "*.npz")):
+                try:
+                    os.remove(name)
+                except OSError as ex:
+                    app_log.debug(f"{name} can NOT be removed: {ex}")
+
+
+background_cache = BackgroundCache()
@@ -0,0 +1,240 @@
+"""
+Headless processing of a wide sweep and many short sweeps. Example:
+    python batch.py wide.dat short_dir/ other_short.dat --exclude 32000 32100 -o params.csv --jobs 8
+    python batch.py wide.dat --index sweeps.sqlite --since 2021-03-01 --until 2021-03-02 --warm
+"""
+import argparse
+import csv
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+from logger import log_settings
+from misc import FitParams
+import archive
+import pipeline
+import sweepfile
+from session import Session
+
+#logger
+app_log = log_settings()
+
+# background of the wide sweep in a worker process, sent once by `init_worker`
+_background: Optional[FitParams] = None
+_fix_tail: bool = False
+
+
+def collect_files(paths: Iterable[str]) -> List[str]:
+    """
+    Expands directories into the sorted list of their .dat files and binary sweeps.
+    A binary sweep is taken instead of the .dat file with the same name.
+    """
+    files: List[str] = []
+    for path in paths:
+        if os.path.isdir(path):
+            names = {os.path.splitext(name)[0]: name for name in sorted(glob.glob(os.path.join(path, "*.dat")))}
+            names.update({os.path.splitext(name)[0]: name
+                          for name in glob.glob(os.path.join(path, "*" + sweepfile.extension))})
+            files.extend(names[stem] for stem in sorted(names))
+        else:
+            files.append(path)
+    return files
+
+
+def fit_background(wide_path: str, exclude: Optional[Sequence[float]] = None,
+                   chunk_rows: Optional[int] = None, robust: Optional[str] = None) -> FitParams:
+    """
+    Opens and fits the wide sweep
+    :param wide_path: .dat file of the wide sweep
+    :param exclude: frequency region (f_min, f_max) excluded from the fit
+    :param chunk_rows: read the file by chunks of this size instead of the whole file
+    :param robust: "clip" or "huber" to exclude the resonance automatically
+    """
+    fits = FitParams()
+    if chunk_rows:
+        pipeline.fit_wide_stream(wide_path, fits, exclude, chunk_rows)
+    else:
+        session = Session(wide_path)
+        session.open_wide(wide_path)
+        session.fit_wide(exclude, robust)
+        fits.fitx, fits.fity = session.background
+    app_log.info(f"Fit of wide sweep {wide_path} was done")
+    return fits
+
+
+def process_file(path: str, background: FitParams, fix_tail: bool = False,
+                 p0: Optional[Sequence[float]] = None) -> Dict:
+    """
+    Runs all the short sweep steps for one file.
+    :param p0: (f0, Q, A) of the previous sweep to warm start the fit
+    :return row: file name, time, convergence, start and the fit parameters or the error
+    """
+    start = time.perf_counter()
+    try:
+        session = Session.from_background(background.fitx, background.fity, path)
+        session.open_short(path)
+        res = session.process_short(fix_tail, p0)
+    except Exception as ex:
+        app_log.error(f"Short sweep {path} fails: {ex}")
+        return {"file": path, "seconds": time.perf_counter() - start, "error": str(ex)}
+    else:
+        row = {"file": path, "seconds": time.perf_counter() - start, "success": res.success, "nfev": res.nfev,
+               "start": "warm" if res.warm else "cold"}
+        row.update(session.table())
+        row["A"] = res.a
+        return row
+
+
+def process_chain(files: Sequence[str], background: FitParams, fix_tail: bool = False) -> List[Dict]:
+    """
+    Processes the files in their order, every fit starts from the result of the previous sweep
+    """
+    rows: List[Dict] = []
+    p0: Optional[Sequence[float]] = None
+    for path in files:
+        row = process_file(path, background, fix_tail, p0)
+        if "error" not in row and row["success"]:
+            p0 = (row["f0"], row["Q"], row["A"])
+        rows.append(row)
+    return rows
+
+
+def init_worker(fitx: np.ndarray, fity: np.ndarray, fix_tail: bool) -> None:
+    """
+    Stores the wide sweep polynomials in the worker process once for all its tasks
+    """
+    global _background, _fix_tail
+    _background = FitParams()
+    _background.fitx = fitx
+    _background.fity = fity
+    _fix_tail = fix_tail
+
+
+def process_in_worker(path: str) -> Dict:
+    return process_file(path, _background, _fix_tail)
+
+
+def chain_in_worker(files: List[str]) -> List[Dict]:
+    return process_chain(files, _background, _fix_tail)
+
+
+def process_files(files: List[str], background: FitParams, fix_tail: bool = False, jobs: int = 1,
+                  warm: bool = False) -> List[Dict]:
+    """
+    Processes the short sweeps in the current process or in a pool of `jobs` processes.
+    The rows are returned in the order of `files`.
+    :param warm: warm start every fit from the previous file; in the pool every process gets
+                 a contiguous part of `files` and warm starts within it
+    """
+    if jobs <= 1 or len(files) < 2:
+        if warm:
+            return process_chain(files, background, fix_tail)
+        return [process_file(path, background, fix_tail) for path in files]
+    jobs = min(jobs, len(files))
+    with ProcessPoolExecutor(max_workers=jobs, initializer=init_worker,
+                             initargs=(background.fitx, background.fity, fix_tail)) as pool:
+        if warm:
+            bounds = np.linspace(0, len(files), jobs + 1).astype(int)
+            parts = [files[bounds[idx]:bounds[idx + 1]] for idx in range(jobs)]
+            return [row for rows in pool.map(chain_in_worker, parts) for row in rows]
+        chunk = max(1, len(files) // (4 * jobs))
+        return list(pool.map(process_in_worker, files, chunksize=chunk))
+
+
+def write_rows(rows: List[Dict], fmt: str, output: Optional[str]) -> None:
+    """
+    Writes the table of parameters as csv or json into `output` or stdout
+    """
+    stream = open(output, "w", newline="") if output else sys.stdout
+    try:
+        if fmt == "json":
+            json.dump(rows, stream, indent=2)
+            stream.write("\n")
+        else:
+            fields: List[str] = []
+            for row in rows:
+                fields.extend(key for key in row if key not in fields)
+            writer = csv.DictWriter(stream, fieldnames=fields)
+            writer.writeheader()
+            writer.writerows(rows)
+    finally:
+        if output:
+            stream.close()
+
+
+def select_short(path: str, args: argparse.Namespace) -> List[str]:
+    """
+    Short sweeps of the archive index selected by the filters of the arguments. Only the sweeps scanned
+    as "short" are taken, the wide sweep of the batch is never fitted as a short one.
+    """
+    wide = os.path.abspath(args.wide)
+    filters = (args.since, args.until, args.freq, args.peak)
+    with archive.SweepIndex(path) as index:
+        entries = index.select(*filters, group="short")
+        unknown = [entry for entry in index.select(*filters, group="") if entry.path != wide]
+    if unknown:
+        app_log.warning(f"{len(unknown)} selected sweeps of {path} have no group and are skipped, "
+                        f"scan their folder with `archive.py scan --group short`")
+    return [entry.path for entry in entries if entry.path != wide]
+
+
+def parse_args(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Fork feedthrough calculation without GUI")
+    parser.add_argument("wide", help="wide sweep .dat file")
+    parser.add_argument("short", nargs="*", help="short sweep .dat files or directories")
+    parser.add_argument("--exclude", nargs=2, type=float, metavar=("FMIN", "FMAX"),
+                        help="frequency region excluded from the wide sweep fit")
+    parser.add_argument("--chunk-rows", type=int,
+                        help="fit the wide sweep by chunks of this number of rows, for files larger than memory")
+    parser.add_argument("--robust", choices=("clip", "huber"),
+                        help="exclude the resonance from the wide sweep fit automatically")
+    parser.add_argument("--warm", action="store_true",
+                        help="start every fit from the result of the previous file, e.g. for a temperature ramp")
+    parser.add_argument("--fix-tail", action="store_true", help="fix the jump of the Y channel")
+    parser.add_argument("--format", choices=("csv", "json"), default="csv")
+    parser.add_argument("-o", "--output", help="output file, stdout by default")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="number of worker processes, 0 for all cores")
+    parser.add_argument("--index", help="archive index: the short sweeps selected by the filters below are added "
+                                        "in the order of their start, the fit results are stored into it")
+    archive.add_filters(parser)
+    args = parser.parse_args(argv)
+    filters = (args.since, args.until, args.freq, args.peak)
+    if any(value is not None for value in filters) and not args.index:
+        parser.error("--since, --until, --freq and --peak select the sweeps of an --index")
+    if not args.short and not args.index:
+        parser.error("short sweeps or an --index are required")
+    if args.robust and args.chunk_rows:
+        parser.error("--robust needs the whole wide sweep and can not be used with --chunk-rows")
+    return args
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    args = parse_args(argv)
+    background = fit_background(args.wide, args.exclude, args.chunk_rows, args.robust)
+    jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+    start = time.perf_counter()
+    files = collect_files(args.short)
+    if args.index:
+        files.extend(select_short(args.index, args))
+    rows = process_files(files, background, args.fix_tail, jobs, args.warm)
+    elapsed = time.perf_counter() - start
+    if args.index:
+        with archive.SweepIndex(args.index) as index:
+            app_log.info(f"Fit results of {index.store_fits(rows)} sweeps are stored into {args.index}")
+    write_rows(rows, args.format, args.output)
+    failed = sum("error" in row for row in rows)
+    nfev = sum(row.get("nfev", 0) for row in rows)
+    app_log.info(f"Batch is finished: {len(rows) - failed} sweeps fitted, {failed} failed, "
+                 f"{nfev} model evaluations, {elapsed:.2f} s with {jobs} processes")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
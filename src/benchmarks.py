@@ -0,0 +1,555 @@
+"""
+Benchmarks of the data processing stages. Run without GUI:
+    python benchmarks.py loader 10000 100000 1000000 10000000
+    python benchmarks.py suite 1000 100000 --json before.json
+    python benchmarks.py compare before.json after.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from loader import load_sweep, kerneldt
+import models
+from fitting import fit_resonance
+
+default_sizes = (10_000, 100_000, 1_000_000, 10_000_000)
+suite_sizes = (1_000, 10_000, 100_000, 1_000_000)
+# modules of the headless path and the budget of their import in ms
+import_budget_ms = {"pipeline": 400, "batch": 500}
+# heavy packages which must be loaded on first use only
+deferred_modules = ("matplotlib", "tkinter", "scipy")
+# synthetic sweeps: resonance (f0, q, a), polynomials of X and Y in u = (f - f0) / 1000, noise, jump of Y
+synthetic_resonance = (32000.0, 30.0, 10000.0)
+synthetic_background = ((1e-5, -2e-5, 3e-5, 1e-4), (-2e-6, 5e-6, 1e-5, -2e-5, 2e-4))
+synthetic_noise = 1e-6
+synthetic_jump = 2e-5
+
+
+def synthetic_sweep(num: int, group: str = "short", seed: int = 0) -> np.ndarray:
+    """
+    Sweep of the `chan_x`/`chan_y` resonance on the polynomial background with the gaussian noise.
+    The short sweep has a jump of Y before the resonance as the lockin does.
+    :param num: number of points
+    :param group: "wide" for 28..36 kHz, "short" for 30.5..33.5 kHz
+    :return data: structured `kerneldt` array
+    """
+    rng = np.random.RandomState(seed)
+    f0 = synthetic_resonance[0]
+    span = 4000.0 if group == "wide" else 1500.0
+    freq = np.linspace(f0 - span, f0 + span, num)
+    u = (freq - f0) / 1000
+    data = np.zeros(num, dtype=kerneldt)
+    data["uni_time"] = 3.7e9 + np.arange(num)
+    data["frequency"] = freq
+    data["X"] = models.chan_x(freq, *synthetic_resonance) + np.polyval(synthetic_background[0], u) \
+        + rng.normal(scale=synthetic_noise, size=num)
+    data["Y"] = models.chan_y(freq, *synthetic_resonance) + np.polyval(synthetic_background[1], u) \
+        + rng.normal(scale=synthetic_noise, size=num)
+    if group != "wide":
+        data["Y"][:num // 4] -= synthetic_jump
+    data["amplitude"] = data["X"] * data["X"] + data["Y"] * data["Y"]
+    data["id"] = np.arange(num)
+    return data
+
+
+def write_dat(path: str, data: np.ndarray) -> None:
+    """
+    Writes the `kerneldt` array as the .dat file in the lockin layout with a short header
+    """
+    with open(path, "w") as f:
+        f.write("# uni_time\tfrequency\tX\tY\tamplitude\tid\n")
+        table = np.column_stack([data[name] for name in kerneldt.names])
+        np.savetxt(f, table, fmt=["%d", "%.6f", "%.8e", "%.8e", "%.8e", "%d"], delimiter="\t")
+
+
+def write_synthetic_dat(path: str, num: int) -> None:
+    """
+    Writes the .dat file of a synthetic short sweep with `num` points
+    :param path: output file
+    :param num: number of rows
+    """
+    write_dat(path, synthetic_sweep(num))
+
+
+def timeit(func: Callable, repeat: int = 3, setup: Optional[Callable] = None) -> float:
+    """
+    Best wall time of `repeat` calls
+    :param setup: called before every call and not timed, e.g. to restore the data changed in place
+    """
+    best = np.inf
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_loader(sizes: Sequence[int] = default_sizes) -> List[Dict]:
+    """
+    Time of `load_sweep` vs number of rows. Time per row should stay constant.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for num in sizes:
+            path = os.path.join(tmp, f"sweep_{num}.dat")
+            write_synthetic_dat(path, num)
+            elapsed = timeit(lambda: load_sweep(path), repeat=1 if num >= 1_000_000 else 3)
+            results.append({"stage": "load", "points": num, "seconds": elapsed,
+                            "us_per_point": 1e6 * elapsed / num})
+            os.remove(path)
+    return results
+
+
+def scalar_chan_x(f: float, f0: float, q: float, a: float) -> float:
+    """
+    Former per-point X-channel formula, kept as reference for `bench_model`
+    """
+    top = a*f*f0/q
+    bot1 = (f**2 - f0**2)**2
+    bot2 = f**2 * f0**2/q**2
+    return top/(bot1+bot2)
+
+
+def bench_model(sizes: Sequence[int] = (1_000, 10_000, 100_000)) -> List[Dict]:
+    """
+    Vectorized `models.chan_x` against the former list comprehension over points.
+    """
+    results = []
+    f0, q, a = 32000.0, 30.0, 10000.0
+    for num in sizes:
+        freq = np.linspace(31000, 33000, num)
+        out = np.empty_like(freq)
+        work = np.empty_like(freq)
+        ref = np.array([scalar_chan_x(ii, f0, q, a) for ii in freq])
+        if not np.allclose(models.chan_x(freq, f0, q, a), ref, rtol=1e-12, atol=0):
+            raise AssertionError("Vectorized X-channel differs from the scalar formula")
+        old = timeit(lambda: np.array([scalar_chan_x(ii, f0, q, a) for ii in freq]))
+        new = timeit(lambda: models.chan_x(freq, f0, q, a, out=out, work=work))
+        results.append({"stage": "model_old", "points": num, "seconds": old, "us_per_point": 1e6 * old / num})
+        results.append({"stage": "model_new", "points": num, "seconds": new, "us_per_point": 1e6 * new / num})
+    return results
+
+
+def bench_fit(sizes: Sequence[int] = (1_000, 10_000, 100_000)) -> List[Dict]:
+    """
+    X-only curve_fit with finite differences against the joint X+Y fit with the analytic Jacobian.
+    """
+    from scipy.optimize import curve_fit
+    results = []
+    p_true = (32010.0, 25.0, 9000.0)
+    p0 = [32000.0, 30.0, 10000.0]
+    for num in sizes:
+        freq = np.linspace(31800, 32200, num)
+        dx = models.chan_x(freq, *p_true) + np.random.normal(scale=1e-6, size=num)
+        dy = models.chan_y(freq, *p_true) + np.random.normal(scale=1e-6, size=num)
+        old = timeit(lambda: curve_fit(lambda f, f0, q, a: models.chan_x(f, f0, q, a), freq, dx, p0,
+                                       maxfev=10000, ftol=0.00005, xtol=0.00005))
+        new = timeit(lambda: fit_resonance(freq, dx, dy, p0))
+        results.append({"stage": "fit_x", "points": num, "seconds": old, "us_per_point": 1e6 * old / num})
+        results.append({"stage": "fit_xy", "points": num, "seconds": new, "us_per_point": 1e6 * new / num})
+    return results
+
+
+def bench_warm(sizes: Sequence[int] = (100, 300), points: int = 1000) -> List[Dict]:
+    """
+    Total fit time of a ramp of `sizes` sweeps with a slowly drifting resonance: cold start of
+    every sweep as `pipeline.initial_guess` against the warm start from the previous sweep.
+    "points" of the results is the number of sweeps.
+    """
+    results = []
+    freq = np.linspace(31500, 32500, points)
+    for num in sizes:
+        ramp = []
+        for idx in range(num):
+            p_true = (31900.0 + 200.0 * idx / num, 25.0 + 5.0 * idx / num, 9000.0)
+            ramp.append((models.chan_x(freq, *p_true) + np.random.normal(scale=1e-6, size=points),
+                         models.chan_y(freq, *p_true) + np.random.normal(scale=1e-6, size=points)))
+        nfev = {"cold": 0, "warm": 0}
+
+        def cold() -> None:
+            nfev["cold"] = 0
+            for dx, dy in ramp:
+                nfev["cold"] += fit_resonance(freq, dx, dy, (float(freq[np.argmax(dx)]), 30.0, 10000.0)).nfev
+
+        def warm() -> None:
+            nfev["warm"] = 0
+            p0 = (float(freq[np.argmax(ramp[0][0])]), 30.0, 10000.0)
+            for dx, dy in ramp:
+                res = fit_resonance(freq, dx, dy, p0)
+                nfev["warm"] += res.nfev
+                p0 = (res.f0, res.q, res.a)
+
+        for name, func in (("cold", cold), ("warm", warm)):
+            elapsed = timeit(func)
+            results.append({"stage": f"ramp_{name}", "points": num, "seconds": elapsed,
+                            "us_per_point": 1e6 * elapsed / num, "nfev": nfev[name]})
+    return results
+
+
+def bench_memory(sizes: Sequence[int] = (100_000, 1_000_000)) -> List[Dict]:
+    """
+    Memory of an open sweep with all curves (dX, dY and the fits) for float64 and float32 channels.
+    "seconds" of the results is the time of `create_data`, "bytes_per_point" the memory.
+    """
+    from misc import SweepData
+    results = []
+    for num in sizes:
+        data = np.zeros(num, dtype=kerneldt)
+        data["frequency"] = np.linspace(31000, 33000, num)
+        for dtype in (np.float64, np.float32):
+            sweep = SweepData(dtype)
+            elapsed = timeit(lambda: sweep.create_data(data))
+            sweep.create_mask()
+            sweep.update_deltax(sweep.X)
+            sweep.update_deltay(sweep.Y)
+            sweep.gen_fit_x(32000.0, 30.0, 10000.0)
+            sweep.gen_fit_y(32000.0, 30.0, 10000.0)
+            results.append({"stage": f"sweep_{np.dtype(dtype).name}", "points": num, "seconds": elapsed,
+                            "us_per_point": 1e6 * elapsed / num, "bytes_per_point": sweep.nbytes / num})
+    return results
+
+
+def bench_suite(sizes: Sequence[int] = suite_sizes) -> List[Dict]:
+    """
+    All the stages of an analysis on the synthetic sweeps of `sizes` points, in the order of the GUI:
+    parsing of the .dat file, `create_data`, polyfit of the wide sweep, subtraction, the corrections
+    (Y tail, Slope X, Intersect X, Intersect Y), the joint fit and the redraw of dX on the Agg canvas
+    with its decimation pyramid as `plot_subtr` does.
+    The cache of baselines is dropped before every subtraction, so the first evaluation is timed.
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    import pipeline
+    from background import background_cache
+    from lod import LodScatter
+    from misc import SweepData, FitParams
+    results: List[Dict] = []
+
+    def record(stage: str, num: int, elapsed: float, **extra) -> None:
+        results.append(dict(stage=stage, points=num, seconds=elapsed, us_per_point=1e6 * elapsed / num, **extra))
+
+    f0 = synthetic_resonance[0]
+    with tempfile.TemporaryDirectory() as tmp:
+        for num in sizes:
+            repeat = 1 if num >= 1_000_000 else 3
+            wide_data = synthetic_sweep(num, "wide")
+            short_data = synthetic_sweep(num, "short", seed=1)
+            path = os.path.join(tmp, f"short_{num}.dat")
+            write_dat(path, short_data)
+            record("load", num, timeit(lambda: load_sweep(path), repeat))
+            os.remove(path)
+
+            wide = SweepData()
+            record("create_data", num, timeit(lambda: wide.create_data(wide_data), repeat))
+            wide.create_mask()
+            pipeline.exclude_range(wide, f0 - 2000, f0 + 2000)
+            background = FitParams()
+            record("fit_wide", num, timeit(lambda: pipeline.fit_wide(wide, background), repeat))
+
+            short = SweepData()
+            state: Dict = dict()
+
+            def reset() -> None:
+                short.create_data(short_data)
+                short.create_mask()
+                state["fits"] = pipeline.copy_background(background)
+                background_cache.baselines.clear()
+
+            record("subtract", num, timeit(lambda: pipeline.subtract(short, state["fits"]), repeat, reset))
+            record("correct", num, timeit(lambda: pipeline.correct(short, state["fits"], True), repeat, reset))
+            fit = timeit(lambda: state.update(res=pipeline.fit_short(short, state["fits"])), repeat)
+            record("fit_short", num, fit, nfev=state["res"].nfev)
+
+            figure = Figure(figsize=(3, 3), dpi=100)
+            canvas = FigureCanvasAgg(figure)
+            axes = figure.add_subplot(111)
+            axes.set_xlim(np.min(short.Frequency), np.max(short.Frequency))
+            axes.set_ylim(np.min(short.dx), np.max(short.dx))
+            axes.grid()
+            artists: List = []
+
+            def drop() -> None:
+                short.lod.pop("dx", None)
+                while artists:
+                    lod = artists.pop()
+                    lod.disconnect()
+                    lod.scat.remove()
+
+            def redraw() -> None:
+                scat = axes.scatter([], [], s=5, c="green")
+                artists.append(LodScatter(axes, scat, short.Frequency, short.dx, short.get_lod("dx")))
+                artists[-1].refresh()
+                canvas.draw()
+
+            record("redraw", num, timeit(redraw, repeat, drop))
+    return results
+
+
+def bench_binary(sizes: Sequence[int] = (100_000, 1_000_000)) -> List[Dict]:
+    """
+    Opening of a sweep into SweepData from the .dat text and from the binary sweep (.swp),
+    and the conversion. "bytes_per_point" is the size of the file.
+    """
+    from misc import SweepData
+    import sweepfile
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for num in sizes:
+            repeat = 1 if num >= 1_000_000 else 3
+            data = synthetic_sweep(num)
+            dat = os.path.join(tmp, f"sweep_{num}.dat")
+            swp = os.path.join(tmp, f"sweep_{num}.swp")
+            write_dat(dat, data)
+            sweep = SweepData()
+            text = timeit(lambda: sweep.create_data(load_sweep(dat)), repeat)
+            write = timeit(lambda: sweepfile.write_sweep(swp, data, "short"), repeat)
+            binary = timeit(lambda: sweep.create_data(sweepfile.read_columns(swp)), repeat)
+            for stage, elapsed, path in (("dat_open", text, dat), ("swp_write", write, swp), ("swp_open", binary, swp)):
+                results.append({"stage": stage, "points": num, "seconds": elapsed, "us_per_point": 1e6 * elapsed / num,
+                                "bytes_per_point": os.path.getsize(path) / num})
+            os.remove(dat)
+            os.remove(swp)
+    return results
+
+
+def bench_archive(sizes: Sequence[int] = (10_000, 100_000), repeat: int = 20) -> List[Dict]:
+    """
+    Queries of the archive index with `sizes` synthetic sweeps over a year: the sweeps of one day,
+    the sweeps overlapping a frequency window of 100 Hz in that day and the sweeps with a peak in a window
+    of 10 Hz. "found" is the number of selected sweeps.
+    """
+    import archive
+    results = []
+    rng = np.random.default_rng(3)
+    with tempfile.TemporaryDirectory() as tmp:
+        for num in sizes:
+            start = 1.6e9 + np.sort(rng.uniform(0, 365 * 86400, num))
+            center = rng.uniform(31000, 33000, num)
+            span = rng.choice([1000.0, 8000.0], num)
+            entries = [archive.SweepEntry(f"/archive/s{i:07d}.swp", 0, 0, "short", float(start[i]), 1000,
+                                          float(center[i] - span[i] / 2), float(center[i] + span[i] / 2),
+                                          float(center[i])) for i in range(num)]
+            with archive.SweepIndex(os.path.join(tmp, f"index_{num}.sqlite")) as index:
+                insert = timeit(lambda: index.add(entries), 1)
+                results.append({"stage": "archive_insert", "points": num, "seconds": insert,
+                                "us_per_point": 1e6 * insert / num})
+                day = (1.6e9 + 180 * 86400, 1.6e9 + 181 * 86400)
+                queries = (("archive_day", dict(since=day[0], until=day[1])),
+                           ("archive_day_freq", dict(since=day[0], until=day[1], freq=(32000, 32100))),
+                           ("archive_peak", dict(peak=(32000, 32010))))
+                for stage, kwargs in queries:
+                    elapsed = timeit(lambda: index.select(**kwargs), repeat)
+                    results.append({"stage": stage, "points": num, "seconds": elapsed,
+                                    "us_per_point": 1e6 * elapsed / num, "found": len(index.select(**kwargs))})
+    return results
+
+
+def bench_logging(sizes: Sequence[int] = (2_000,), points: int = 100_000, gap: float = 0.001) -> List[Dict]:
+    """
+    Cost of a log line in the slider callback: the mask update of `redraw_slider_tab1` on a sweep of `points`
+    points and one INFO line into a rotating file, without logging, with the former synchronous
+    RotatingFileHandler, through the queue of `logger` and through the queue with `sampled`.
+    The callbacks are `gap` seconds apart as the frames of a slider move, only the callbacks are timed.
+    "points" of the results is the number of callbacks.
+    """
+    import logging
+    from logging.handlers import QueueListener, RotatingFileHandler
+    import queue
+    from logger import ThreadQueueHandler, log_format, sampled
+    results = []
+    mask = np.ones(points, dtype=bool)
+    with tempfile.TemporaryDirectory() as tmp:
+        for num in sizes:
+            base = 0.0
+            for name in ("none", "sync", "queue", "sampled"):
+                handler = RotatingFileHandler(os.path.join(tmp, f"{name}.log"), maxBytes=2*1024*1024, backupCount=2)
+                handler.setFormatter(logging.Formatter(log_format))
+                log = logging.getLogger(f"ForksFT.bench.{name}")
+                log.propagate = False
+                log.setLevel(logging.INFO)
+                listener = None
+                if name == "sync":
+                    log.addHandler(handler)
+                elif name != "none":
+                    records = queue.SimpleQueue()
+                    log.addHandler(ThreadQueueHandler(records))
+                    listener = QueueListener(records, handler)
+                    listener.start()
+
+                def callback(idx: int) -> None:
+                    var1, var2 = idx % (points // 2), points // 2 + idx % (points // 2)
+                    mask[0:var1] = True
+                    mask[var2:-1] = True
+                    mask[var1:var2] = False
+                    if name == "sampled":
+                        count = sampled("bench")
+                        if count:
+                            log.info(f"Mask of wide sweep: {var1}..{var2} ({count} calls)")
+                    elif name != "none":
+                        log.info(f"Mask of wide sweep: {var1}..{var2}")
+
+                elapsed = 0.0
+                for idx in range(num):
+                    start = time.perf_counter()
+                    callback(idx)
+                    elapsed += time.perf_counter() - start
+                    time.sleep(gap)
+                if listener is not None:
+                    listener.stop()
+                for old in list(log.handlers):
+                    log.removeHandler(old)
+                handler.close()
+                if name == "none":
+                    base = elapsed
+                results.append({"stage": f"log_{name}", "points": num, "seconds": elapsed,
+                                "us_per_point": 1e6 * elapsed / num, "overhead_us": 1e6 * (elapsed - base) / num})
+    return results
+
+
+def import_time(module: str) -> Dict:
+    """
+    Cumulative import time of `module` in a fresh interpreter by `python -X importtime`
+    and the deferred packages which were loaded by the import
+    """
+    code = f"import sys, {module}; print(','.join(m for m in {deferred_modules!r} if m in sys.modules))"
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    cumulative = 0
+    for line in proc.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        parts = line.split("|")
+        if len(parts) == 3 and parts[2].strip() == module:
+            cumulative = int(parts[1])
+    loaded = [name for name in proc.stdout.strip().split(",") if name]
+    return {"module": module, "ms": cumulative / 1000, "loaded": loaded}
+
+
+def bench_importtime(modules: Sequence[str] = tuple(import_budget_ms)) -> List[Dict]:
+    """
+    Import time of the headless modules against `import_budget_ms`, best of 3 runs
+    """
+    results = []
+    for module in modules:
+        runs = [import_time(module) for _ in range(3)]
+        best = min(runs, key=lambda run: run["ms"])
+        best["budget_ms"] = import_budget_ms.get(module, 0)
+        best["ok"] = best["ms"] <= best["budget_ms"] and not best["loaded"]
+        results.append(best)
+    return results
+
+
+def git_commit() -> str:
+    """
+    Commit of the working tree, empty if git is not available
+    """
+    try:
+        proc = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+    return proc.stdout.strip()
+
+
+def save_results(path: str, stage: str, results: List[Dict]) -> None:
+    """
+    Writes the results with the versions of the environment as JSON for `compare`
+    """
+    report = {"stage": stage, "created": datetime.datetime.now().isoformat(timespec="seconds"),
+              "commit": git_commit(), "python": platform.python_version(), "numpy": np.__version__,
+              "platform": platform.platform(), "results": results}
+    with open(path, "w") as f:
+        json.dump(report, f, indent=1)
+
+
+def compare(old_path: str, new_path: str, threshold: float = 1.25, min_seconds: float = 0.001) -> List[Dict]:
+    """
+    Ratios of the times of the same stage and size of two JSON reports
+    :param threshold: a ratio new/old above it is a regression
+    :param min_seconds: shorter stages are not checked, their time is mostly noise
+    :return rows: stage, points, old, new, ratio and regression flag
+    """
+    reports = []
+    for path in (old_path, new_path):
+        with open(path) as f:
+            reports.append({(res["stage"], res["points"]): res["seconds"]
+                            for res in json.load(f)["results"] if "seconds" in res})
+    rows = []
+    for key, old in reports[0].items():
+        if key not in reports[1]:
+            continue
+        new = reports[1][key]
+        ratio = new / old if old > 0 else np.inf
+        rows.append({"stage": key[0], "points": key[1], "old": old, "new": new, "ratio": ratio,
+                     "regression": ratio > threshold and max(old, new) >= min_seconds})
+    return rows
+
+
+def print_results(results: List[Dict]) -> None:
+    for res in results:
+        print(f"{res['stage']:>12} {res['points']:>10d} points: {res['seconds']:.4f} s "
+              f"({res['us_per_point']:.3f} us/point)" + (f", nfev {res['nfev']}" if "nfev" in res else "")
+              + (f", {res['bytes_per_point']:.0f} bytes/point" if "bytes_per_point" in res else "")
+              + (f", log overhead {res['overhead_us']:.2f} us" if "overhead_us" in res else "")
+              + (f", {res['found']} found" if "found" in res else ""))
+
+
+def parse_args(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmarks of the fork feedthrough processing")
+    parser.add_argument("stage", nargs="?", default="loader",
+                        choices=("loader", "model", "fit", "warm", "memory", "suite", "logging", "binary", "archive",
+                                 "importtime", "compare"))
+    parser.add_argument("args", nargs="*",
+                        help="sizes; module names for importtime; old and new JSON reports for compare")
+    parser.add_argument("--json", help="save the results to this JSON file")
+    parser.add_argument("--threshold", type=float, default=1.25,
+                        help="compare: ratio of the times new/old which is a regression")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    args = parse_args(argv)
+    if args.stage == "importtime":
+        # exit code 1 if the import is over budget or loads a deferred package, used by CI
+        checks = bench_importtime(args.args or tuple(import_budget_ms))
+        for check in checks:
+            print(f"{check['module']:>10}: {check['ms']:.1f} ms (budget {check['budget_ms']} ms), "
+                  f"deferred loaded: {check['loaded'] or 'none'}")
+        if args.json:
+            save_results(args.json, args.stage, checks)
+        return 0 if all(check["ok"] for check in checks) else 1
+    if args.stage == "compare":
+        if len(args.args) != 2:
+            print("compare needs the old and the new JSON reports")
+            return 2
+        rows = compare(args.args[0], args.args[1], args.threshold)
+        for row in rows:
+            print(f"{row['stage']:>12} {row['points']:>10d} points: {row['old']:.4f} s -> {row['new']:.4f} s "
+                  f"(x{row['ratio']:.2f})" + (" REGRESSION" if row["regression"] else ""))
+        return 1 if any(row["regression"] for row in rows) else 0
+    sizes = [int(x) for x in args.args]
+    stages = {"loader": (bench_loader, default_sizes), "model": (bench_model, (1_000, 10_000, 100_000)),
+              "fit": (bench_fit, (1_000, 10_000, 100_000)), "warm": (bench_warm, (100, 300)),
+              "memory": (bench_memory, (100_000, 1_000_000)), "suite": (bench_suite, suite_sizes),
+              "logging": (bench_logging, (2_000,)), "binary": (bench_binary, (100_000, 1_000_000)),
+              "archive": (bench_archive, (10_000, 100_000))}
+    func, defaults = stages[args.stage]
+    results = func(sizes or defaults)
+    print_results(results)
+    if args.json:
+        save_results(args.json, args.stage, results)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
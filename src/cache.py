@@ -0,0 +1,141 @@
+"""
+Binary cache of the parsed sweep files. The `kerneldt` array of a .dat file is saved as .npy
+and the next open is a memory map of it instead of the text parsing.
+"""
+import glob
+import hashlib
+import os
+import threading
+from typing import Callable, Optional, Union
+import numpy as np
+
+from logger import log_settings
+from loader import load_sweep
+from sweepfile import SweepColumns, is_sweep_file, read_columns
+from timing import stage
+
+#logger
+app_log = log_settings()
+
+# folder and disk budget in bytes can be changed by environment variables
+default_dir = os.environ.get("FORKS_FT_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".forks_ft_cache"))
+default_budget = int(os.environ.get("FORKS_FT_CACHE_BUDGET", 1024 * 1024 * 1024))
+
+
+class SweepCache(object):
+    """
+    Cache of parsed sweeps on disk.
+    An entry is named by the hash of the source path and the size and mtime of the source,
+    so a changed .dat file never hits an old entry. Least recently used entries are removed
+    when the cache is larger than `budget`.
+    :param directory: folder for the .npy files
+    :param budget: disk budget in bytes
+    """
+    def __init__(self, directory: str = default_dir, budget: int = default_budget) -> None:
+        self.directory = directory
+        self.budget = budget
+
+    @staticmethod
+    def path_hash(path: str) -> str:
+        return hashlib.sha1(os.path.abspath(path).encode("utf-8")).hexdigest()
+
+    def entry(self, path: str) -> str:
+        """
+        Cache file of the current version of `path`
+        """
+        stat = os.stat(path)
+        return os.path.join(self.directory, f"{self.path_hash(path)}-{stat.st_size}-{stat.st_mtime_ns}.npy")
+
+    def load(self, path: str, progress: Optional[Callable[[float, str], None]] = None) -> np.ndarray:
+        """
+        Parsed sweep from the cache (read-only memory map) or from the text file.
+        :param path: .dat file
+        :param progress: optional callback of the text parsing
+        :return data: structured `kerneldt` array
+        :raise: ValueError
+        """
+        entry = self.entry(path)
+        if os.path.exists(entry):
+            try:
+                data = np.load(entry, mmap_mode="r")
+                os.utime(entry)
+                app_log.debug(f"{path} is loaded from cache")
+                return data
+            except Exception as ex:
+                app_log.warning(f"Cache entry of {path} is broken and will be rebuilt: {ex}")
+        data = load_sweep(path, progress)
+        try:
+            self.store(path, entry, data)
+        except OSError as ex:
+            app_log.warning(f"{path} can NOT be cached: {ex}")
+        return data
+
+    def store(self, path: str, entry: str, data: np.ndarray) -> None:
+        """
+        Saves `data` as `entry`, removes old versions of the same file and keeps the budget.
+        Every writer has its own temporary file, so threads or processes caching the same sweep
+        publish one complete entry.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        for old in glob.glob(os.path.join(self.directory, f"{self.path_hash(path)}-*.npy")):
+            self.remove(old)
+        # own temporary file of every writer, two processes may parse the same sweep
+        tmp = f"{entry}.{os.getpid()}.{threading.get_ident()}.tmp"
+        f = open(tmp, "xb")
+        try:
+            with f:
+                np.save(f, data)
+            os.replace(tmp, entry)
+        except BaseException:
+            self.remove(tmp)
+            raise
+        self.evict()
+
+    def evict(self, budget: Optional[int] = None) -> None:
+        """
+        Removes the least recently used entries until the cache fits into the budget
+        """
+        budget = self.budget if budget is None else budget
+        entries = []
+        for name in glob.glob(os.path.join(self.directory, "*.npy")):
+            try:
+                stat = os.stat(name)
+            except OSError:
+                # removed by an other writer meanwhile
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= budget:
+                break
+            if self.remove(name):
+                total -= size
+                app_log.debug(f"{name} is evicted from cache")
+
+    @staticmethod
+    def remove(name: str) -> bool:
+        """
+        Removes a cache file. A file still mapped by an open sweep can not be removed on Windows.
+        """
+        try:
+            os.remove(name)
+        except OSError as ex:
+            app_log.debug(f"{name} can NOT be removed: {ex}")
+            return False
+        return True
+
+    def clear(self) -> None:
+        self.evict(0)
+
+
+sweep_cache = SweepCache()
+
+
+def load_cached(path: str, progress: Optional[Callable[[float, str], None]] = None) -> Union[np.ndarray, SweepColumns]:
+    """
+    Opens the sweep through the default cache. A binary sweep (.swp) is mapped directly.
+    """
+    with stage("open_file") as record:
+        data = read_columns(path) if is_sweep_file(path) else sweep_cache.load(path, progress)
+        record["points"] = len(data)
+    return data
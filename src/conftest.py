@@ -0,0 +1,14 @@
+import os
+import shutil
+import tempfile
+
+# the caches of the parsed sweeps and of the wide fits go to a temporary folder, not to the home of the user;
+# set before the modules of the app are imported, they read it once
+cache_dir = None
+if "FORKS_FT_CACHE_DIR" not in os.environ:
+    cache_dir = os.environ["FORKS_FT_CACHE_DIR"] = tempfile.mkdtemp(prefix="forks_ft_cache_")
+
+
+def pytest_sessionfinish(session, exitstatus):
+    if cache_dir is not None:
+        shutil.rmtree(cache_dir, ignore_errors=True)
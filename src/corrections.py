@@ -0,0 +1,152 @@
+"""
+Corrections of the short sweep after the subtraction of the wide sweep: Y tail, Slope X, Intersect X
+and Intersect Y. The functions take arrays and return new arrays and parameter increments, they do
+not change SweepData or FitParams, so the whole chain runs in one pass for the GUI and for the batch.
+"""
+from typing import NamedTuple, Optional, Tuple
+import numpy as np
+
+# window sizes of the GUI buttons were chosen for sweeps of this length
+reference_points = 2000
+mean_points = 100
+tail_cut = 10
+savgol_window = 21
+savgol_poly = 1
+
+
+class Windows(NamedTuple):
+    """
+    Window sizes of the corrections
+    Attributes:
+        :param mean: number of points averaged at the ends of dX (Slope X, Intersect X)
+        :param cut: number of points skipped around the jump of Y
+        :param savgol: odd window of the Savitzky-Golay derivative of Y
+    """
+    mean: int
+    cut: int
+    savgol: int
+
+
+class Corrections(NamedTuple):
+    """
+    Result of `correct_short`
+    Attributes:
+        :param y: Y with the fixed tail (the input Y if the tail is not fixed)
+        :param dx: X - fitX after all corrections
+        :param dy: Y - fitY after all corrections
+        :param ind_max: index of the maximum of dX
+        :param tail: index and value of the jump of Y, None if the tail is not fixed
+        :param slope_x: increment of the linear term of fitX
+        :param intersect_x: increment of the constant term of fitX
+        :param intersect_y: increment of the constant term of fitY
+    """
+    y: np.ndarray
+    dx: np.ndarray
+    dy: np.ndarray
+    ind_max: int
+    tail: Optional[Tuple[int, float]]
+    slope_x: float
+    intersect_x: float
+    intersect_y: float
+
+
+def scaled_windows(num: int) -> Windows:
+    """
+    Window sizes proportional to the number of points of the sweep, equal to the GUI values for
+    `reference_points`
+    """
+    ratio = num / reference_points
+    mean = max(5, int(round(mean_points * ratio)))
+    cut = max(2, int(round(tail_cut * ratio)))
+    savgol = max(5, int(round(savgol_window * ratio)))
+    return Windows(mean, cut, savgol if savgol % 2 else savgol + 1)
+
+
+def slope(freq: np.ndarray, dx: np.ndarray, nums: int) -> Tuple[float, int]:
+    """
+    Slope of dX between both sides of the resonance
+    :param nums: number of points for the mean
+    :return slope, index of the maximum of dX:
+    """
+    id0 = int(np.argmax(dx))
+    shift = min(id0, len(dx) - id0)
+    p1 = np.mean(dx[id0 - shift:id0 - shift + nums])
+    p2 = np.mean(dx[id0 + shift - nums:id0 + shift])
+    x1 = np.mean(freq[id0 - shift:id0 - shift + nums])
+    x2 = np.mean(freq[id0 + shift - nums:id0 + shift])
+    return float((p2 - p1) / (x2 - x1)), id0
+
+
+def intersect_x(dx: np.ndarray, num: int) -> float:
+    """
+    Shift of dX to move the whole graph under the X-axis
+    :param num: number of points from the begin and the end to analyze
+    """
+    part1 = dx[0:num]
+    part2 = dx[-num:-1]
+    return float(min(np.mean(part1), np.mean(part2)) - max(np.std(part1), np.std(part2)))
+
+
+def intersect_y(dy: np.ndarray) -> float:
+    """
+    Shift of dY to center it between its maximum and minimum
+    """
+    return float((np.max(dy) + np.min(dy)) / 2)
+
+
+def tail_jump(y: np.ndarray, num: int, wind: int, poly: int = savgol_poly) -> Tuple[int, float]:
+    """
+    Jump of Y before its maximum found by the Savitzky-Golay derivative
+    :param num: number of points to skip around the jump
+    :param wind: odd window of the filter
+    :return: index and value of the jump
+    :raise: ValueError
+    """
+    import scipy.signal as sci  # loaded on the first use, not at the start of the app
+    part1 = y[0:int(np.argmax(y))]
+    if len(part1) < max(wind, 4 * num):
+        raise ValueError(f"Not enough points before the maximum of Y: {len(part1)}")
+    dif_y = sci.savgol_filter(part1, wind, poly, deriv=1)
+    prob = int(np.argmax(np.abs(dif_y)))
+    y1 = np.mean(part1[prob - 2 * num: prob - num])
+    y2 = np.mean(part1[prob + num: prob + 2 * num])
+    return prob, float(y2 - y1)
+
+
+def apply_tail(y: np.ndarray, idm: int, delta: float) -> np.ndarray:
+    """
+    New Y with `delta` added before the jump
+    """
+    fixed = np.array(y, dtype=float)
+    fixed[:idm] += delta
+    return fixed
+
+
+def correct_short(freq: np.ndarray, x: np.ndarray, y: np.ndarray, fitx: np.ndarray, fity: np.ndarray,
+                  fix_tail: bool = False, windows: Optional[Windows] = None,
+                  base_x: Optional[np.ndarray] = None, base_y: Optional[np.ndarray] = None) -> Corrections:
+    """
+    All corrections in the order of the GUI buttons. The polynomials are evaluated once, every
+    correction changes a linear or a constant term, so it is subtracted from dX or dY directly.
+    :param fitx: polynomial of X from the wide sweep, not changed
+    :param fity: polynomial of Y from the wide sweep, not changed
+    :param fix_tail: fix the jump of the Y channel
+    :param windows: window sizes, proportional to the sweep length by default
+    :param base_x: fitX evaluated on `freq`, e.g. from the cache of baselines
+    :param base_y: fitY evaluated on `freq`
+    """
+    freq = np.asarray(freq, dtype=float)
+    win = scaled_windows(len(freq)) if windows is None else windows
+    tail: Optional[Tuple[int, float]] = None
+    if fix_tail:
+        tail = tail_jump(y, win.cut, win.savgol)
+        y = apply_tail(y, tail[0], tail[1])
+    dx = np.subtract(x, np.polyval(fitx, freq) if base_x is None else base_x)
+    dy = np.subtract(y, np.polyval(fity, freq) if base_y is None else base_y)
+    d_slope, ind_max = slope(freq, dx, win.mean)
+    dx -= d_slope * freq
+    d_x = intersect_x(dx, win.mean)
+    dx -= d_x
+    d_y = intersect_y(dy)
+    dy -= d_y
+    return Corrections(y, dx, dy, ind_max, tail, d_slope, d_x, d_y)
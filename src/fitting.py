@@ -0,0 +1,116 @@
+"""
+Fit of the resonance curve of the short sweep. dX and dY are fitted together as one complex
+residual  Z = X + iY = a / (f*f0/q + i*(f^2 - f0^2))  with the analytic Jacobian.
+"""
+from typing import Callable, NamedTuple, Optional, Sequence, Tuple
+import numpy as np
+
+from logger import log_settings
+from timing import stage
+
+#logger
+app_log = log_settings()
+
+
+class FitResult(NamedTuple):
+    """
+    Result of the resonance fit
+    Attributes:
+        :param f0: resonant frequency
+        :param q: q-factor of the resonance curve
+        :param a: amplitude
+        :param nfev: number of model evaluations
+        :param success: True if the optimizer converged
+        :param cost: half of the sum of squared residuals
+        :param warm: True if the fit started from the result of the previous sweep
+    """
+    f0: float
+    q: float
+    a: float
+    nfev: int
+    success: bool
+    cost: float
+    warm: bool = False
+
+
+class ResonanceModel(object):
+    """
+    Complex resonance model with the analytic Jacobian.
+    The complex denominator is cached, so the Jacobian at the same point costs no extra evaluation.
+    :param freq: frequency array
+    :param dx: measured X after subtraction of the wide sweep
+    :param dy: measured Y after subtraction of the wide sweep
+    :param check: called before every evaluation of the residuals, raises to stop the fit, e.g. on cancel
+    """
+    def __init__(self, freq: np.ndarray, dx: np.ndarray, dy: np.ndarray,
+                 check: Optional[Callable[[], None]] = None) -> None:
+        self.freq = np.asarray(freq, dtype=float)
+        self.f2 = self.freq * self.freq
+        self.data = np.asarray(dx, dtype=float) + 1j * np.asarray(dy, dtype=float)
+        self.num = len(self.freq)
+        self.check = check
+        self._params: Optional[Tuple[float, float, float]] = None
+        self._w: Optional[np.ndarray] = None
+        self._z: Optional[np.ndarray] = None
+
+    def evaluate(self, params: Sequence[float]) -> np.ndarray:
+        """
+        Complex model X + iY at `params` = (f0, q, a)
+        """
+        f0, q, a = params
+        key = (float(f0), float(q), float(a))
+        z = self._z
+        if key != self._params or z is None:
+            self._w = self.freq * (f0 / q) + 1j * (self.f2 - f0 * f0)
+            z = self._z = a / self._w
+            self._params = key
+        return z
+
+    def residuals(self, params: Sequence[float]) -> np.ndarray:
+        """
+        Stacked real residuals [X - dx, Y - dy]
+        """
+        if self.check is not None:
+            self.check()
+        diff = self.evaluate(params) - self.data
+        return np.concatenate((diff.real, diff.imag))
+
+    def jacobian(self, params: Sequence[float]) -> np.ndarray:
+        """
+        Analytic Jacobian of `residuals` with respect to (f0, q, a)
+        """
+        f0, q, a = params
+        z = self.evaluate(params)
+        zw = z / self._w  # a / W^2
+        jac = np.empty((2 * self.num, 3))
+        d_f0 = -zw * (self.freq / q - 2j * f0)
+        d_q = zw * (self.freq * (f0 / (q * q)))
+        d_a = z / a
+        for col, der in enumerate((d_f0, d_q, d_a)):
+            jac[:self.num, col] = der.real
+            jac[self.num:, col] = der.imag
+        return jac
+
+
+def fit_resonance(freq: np.ndarray, dx: np.ndarray, dy: np.ndarray, p0: Sequence[float],
+                  max_nfev: int = 10000, tol: float = 0.00005, check: Optional[Callable[[], None]] = None) -> FitResult:
+    """
+    Joint fit of dX and dY with the resonance curve.
+    :param freq: frequency array
+    :param dx: X - fitX
+    :param dy: Y - fitY
+    :param p0: initial guess (f0, q, a)
+    :param max_nfev: maximum number of model evaluations
+    :param tol: relative tolerance for the cost and the parameters
+    :param check: called on every evaluation, its exception stops the fit, e.g. `TaskCancelled`
+    :return result: FitResult
+    """
+    from scipy.optimize import least_squares  # loaded on the first fit, not at the start of the app
+    with stage("fit_resonance", len(freq)) as record:
+        model = ResonanceModel(freq, dx, dy, check)
+        res = least_squares(model.residuals, np.asarray(p0, dtype=float), jac=model.jacobian, method="lm",
+                            x_scale="jac", ftol=tol, xtol=tol, max_nfev=max_nfev)
+        record.update(nfev=int(res.nfev), success=bool(res.success))
+    app_log.debug(f"Resonance fit: {res.message}, nfev = {res.nfev}")
+    return FitResult(float(res.x[0]), float(res.x[1]), float(res.x[2]), int(res.nfev), bool(res.success),
+                     float(res.cost))
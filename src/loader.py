@@ -0,0 +1,146 @@
+import os
+import warnings
+from itertools import islice
+from typing import Callable, Iterator, Optional, Tuple
+import numpy as np
+from logger import log_settings
+from timing import stage
+
+#logger
+app_log = log_settings()
+
+# Record layout of the lockin .dat files: Time, Frequency, X, Y, Amplitude, id
+column_names: Tuple[str, ...] = ("uni_time", "frequency", "X", "Y", "amplitude", "id")
+kerneldt = np.dtype({"names": list(column_names), "formats": [np.longlong, int, float, float, float, int]})
+n_cols = len(column_names)
+# Labview time of the lockin divided by this factor is the UTC timestamp
+date_convert = 2.324243143792273
+
+
+def to_records(values: np.ndarray) -> np.ndarray:
+    """
+    Converts a 2-D float table into the structured `kerneldt` array.
+    :param values: array of shape (N, 6) in the .dat column order
+    :return data: structured array of N records
+    """
+    data = np.empty(len(values), dtype=kerneldt)
+    for idx, name in enumerate(column_names):
+        data[name] = values[:, idx]
+    return data
+
+
+def strip_header(text: str) -> str:
+    """
+    Removes the `#` comment lines. The header is normally only at the top of the file,
+    so the lines are filtered one by one only if a comment is found in the body.
+    :param text: content of the .dat file
+    :return body: numbers only
+    """
+    start = 0
+    while text.startswith("#", start):
+        stop = text.find("\n", start)
+        if stop < 0:
+            return ""
+        start = stop + 1
+    body = text[start:]
+    if "\n#" in body:
+        body = "\n".join(line for line in body.splitlines() if not line.startswith("#"))
+    return body
+
+
+def check_lines(body: str, size: int) -> None:
+    """
+    Every line must have `n_cols` values, the flat parse would shift the next lines into wrong columns.
+    The values of every line are counted at once on the bytes: a value starts where a blank (a byte up
+    to the space) is followed by other character.
+    :param body: numbers only
+    :param size: number of parsed values
+    :raise: ValueError with the first broken line
+    """
+    raw = np.frombuffer(body.encode("ascii", "replace"), dtype=np.uint8)
+    blank = raw <= ord(" ")
+    starts = np.flatnonzero(blank[:-1] & ~blank[1:]) + 1
+    if len(raw) and not blank[0]:
+        starts = np.concatenate(([0], starts))
+    newlines = np.flatnonzero(raw == ord("\n"))
+    # number of values before every newline, the differences are the values of the lines
+    bounds = np.concatenate(([0], np.searchsorted(starts, newlines), [len(starts)]))
+    counts = np.diff(bounds)
+    broken = np.flatnonzero((counts != 0) & (counts != n_cols))
+    if len(broken):
+        num = int(broken[0])
+        line = body.split("\n", num + 1)[num]
+        raise ValueError(f"Line {num + 1} of data has {counts[num]} values instead of {n_cols}: {line[:80]}")
+    if len(starts) != size:
+        raise ValueError(f"Number of values {size} does not match {len(starts)} values of the lines")
+
+
+def parse_text(text: str) -> np.ndarray:
+    """
+    Parse the content of a .dat file in one vectorized pass.
+    :param text: content of the .dat file
+    :return data: structured `kerneldt` array
+    :raise: ValueError, also for a line with missing or extra values
+    """
+    body = strip_header(text)
+    with warnings.catch_warnings():
+        # old numpy only warns and returns a truncated array on a bad token
+        warnings.simplefilter("error", DeprecationWarning)
+        try:
+            values = np.fromstring(body, dtype=float, sep=" ")
+        except DeprecationWarning as ex:
+            raise ValueError(f"File contains not a numerical data: {ex}")
+    if values.size == 0:
+        raise ValueError("File does not contain an appropriate data or empty")
+    check_lines(body, values.size)
+    return to_records(values.reshape(-1, n_cols))
+
+
+def load_sweep(path: str, progress: Optional[Callable[[float, str], None]] = None,
+               chunk_rows: int = 200_000) -> np.ndarray:
+    """
+    Read a wide or short sweep .dat file without any GUI.
+    :param path: path to the .dat file
+    :param progress: optional callback with the read fraction of the file, the file is read by chunks then
+    :param chunk_rows: number of lines in a chunk for `progress`
+    :return data: structured `kerneldt` array
+    :raise: ValueError
+    """
+    with stage("parse") as record:
+        if progress is None:
+            with open(path, "r") as f:
+                data = parse_text(f.read())
+        else:
+            chunks = list(iter_chunks(path, chunk_rows, progress))
+            if not chunks:
+                raise ValueError("File does not contain an appropriate data or empty")
+            data = np.concatenate(chunks)
+        record["points"] = len(data)
+    app_log.debug(f"Shape of array is {np.shape(data)}")
+    return data
+
+
+def iter_chunks(path: str, chunk_rows: int = 1_000_000,
+                progress: Optional[Callable[[float, str], None]] = None) -> Iterator[np.ndarray]:
+    """
+    Reads a .dat file larger than memory by chunks of records.
+    :param path: path to the .dat file
+    :param chunk_rows: maximum number of lines in a chunk
+    :param progress: optional callback with the read fraction of the file
+    :return: iterator over structured `kerneldt` arrays
+    :raise: ValueError
+    """
+    size = max(os.path.getsize(path), 1)
+    done = 0
+    with open(path, "r") as f:
+        while True:
+            lines = list(islice(f, chunk_rows))
+            if not lines:
+                break
+            text = "".join(lines)
+            done += len(text)
+            if progress is not None:
+                progress(min(done / size, 1.0), "reading")
+            body = strip_header(text)
+            if body.strip():
+                yield parse_text(body)
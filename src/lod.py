@@ -0,0 +1,160 @@
+"""
+Level of detail for plots of large sweeps. Every level keeps the minimum and the maximum of
+each bucket of points, so peaks and jumps stay visible while only about two points per
+screen pixel are drawn.
+"""
+from typing import List, Optional
+import numpy as np
+
+from timing import stage
+
+
+class DecimationPyramid(object):
+    """
+    Min/max preserving decimation of y(x) with buckets of base**level points.
+    :param x: independent variable, e.g. Frequency
+    :param y: channel values
+    :param base: ratio of bucket sizes of two neighbour levels
+    :param min_points: levels are built until less than this number of points remain
+    """
+    def __init__(self, x: np.ndarray, y: np.ndarray, base: int = 4, min_points: int = 1000) -> None:
+        x = np.asarray(x)
+        y = np.asarray(y)
+        if len(x) > 1 and np.any(x[1:] < x[:-1]):
+            self.order: Optional[np.ndarray] = np.argsort(x, kind="mergesort")
+            self.x = x[self.order]
+            y = y[self.order]
+        else:
+            self.order = None
+            self.x = x
+        self.num = len(self.x)
+        self.sizes: List[int] = []
+        self.levels: List[np.ndarray] = []
+        size = base
+        while self.num // size * 2 >= min_points:
+            self.sizes.append(size)
+            self.levels.append(self.min_max(y, size))
+            size *= base
+
+    @staticmethod
+    def min_max(y: np.ndarray, size: int) -> np.ndarray:
+        """
+        Indices of the minimum and the maximum of every bucket of `size` points in their x order
+        """
+        full = len(y) // size
+        blocks = y[:full * size].reshape(full, size)
+        start = np.arange(full) * size
+        i_min = start + np.argmin(blocks, axis=1)
+        i_max = start + np.argmax(blocks, axis=1)
+        if full * size < len(y):
+            tail = y[full * size:]
+            i_min = np.append(i_min, full * size + np.argmin(tail))
+            i_max = np.append(i_max, full * size + np.argmax(tail))
+        pairs = np.column_stack((np.minimum(i_min, i_max), np.maximum(i_min, i_max)))
+        return pairs.ravel()
+
+    def query(self, x_min: float, x_max: float, pixels: int) -> np.ndarray:
+        """
+        Indices of the points to draw in the visible range [x_min, x_max]
+        :param pixels: width of the axes in pixels
+        :return idx: indices into the original x, y
+        """
+        i0 = int(np.searchsorted(self.x, x_min, side="left"))
+        i1 = int(np.searchsorted(self.x, x_max, side="right"))
+        i0 = max(i0 - 1, 0)
+        i1 = min(i1 + 1, self.num)
+        idx: np.ndarray = np.arange(i0, i1)
+        for size, level in zip(self.sizes, self.levels):
+            if (i1 - i0) * 2 <= 4 * pixels:
+                break
+            idx = level[2 * (i0 // size):2 * -(-i1 // size)]
+            if len(idx) <= 4 * pixels:
+                break
+        if self.order is not None:
+            idx = self.order[idx]
+        return idx
+
+
+class LodScatter(object):
+    """
+    Scatter artist which shows the decimated data of the visible range of its axes.
+    The offsets are recomputed when the x-limits of the axes change, e.g. zoom of the toolbar.
+    :param axes: matplotlib axes
+    :param scat: PathCollection created by axes.scatter
+    :param x: x-values
+    :param y: y-values
+    :param pyramid: precomputed DecimationPyramid of (x, y)
+    :param mask: optional bool mask of points to show
+    """
+    def __init__(self, axes, scat, x: np.ndarray, y: np.ndarray, pyramid: Optional[DecimationPyramid] = None,
+                 mask: Optional[np.ndarray] = None) -> None:
+        self.axes = axes
+        self.scat = scat
+        self.x = x
+        self.y = y
+        self.pyramid = pyramid if pyramid is not None else DecimationPyramid(x, y)
+        self.mask = mask
+        self._cid = axes.callbacks.connect("xlim_changed", self.on_xlim)
+
+    def on_xlim(self, axes) -> None:
+        self.refresh()
+
+    def offsets(self) -> np.ndarray:
+        x_min, x_max = sorted(self.axes.get_xlim())
+        pixels = max(int(self.axes.bbox.width), 100)
+        idx = self.pyramid.query(x_min, x_max, pixels)
+        if self.mask is not None:
+            idx = idx[self.mask[idx]]
+        return np.column_stack((self.x[idx], self.y[idx]))
+
+    def refresh(self) -> None:
+        """
+        Updates the points of the artist; the caller draws the canvas
+        """
+        self.scat.set_offsets(self.offsets())
+
+    def disconnect(self) -> None:
+        self.axes.callbacks.disconnect(self._cid)
+
+
+class BlitUpdater(object):
+    """
+    Redraws only the changed artists on top of the cached background of the figure.
+    The artists are animated: a full draw caches the figure without them and then draws them.
+    :param canvas: figure canvas
+    :param axes: matplotlib axes of the artists
+    :param artists: artists updated in place, e.g. scatter of LodScatter
+    """
+    def __init__(self, canvas, axes, artists: List) -> None:
+        self.canvas = canvas
+        self.axes = axes
+        self.artists = artists
+        self.background = None
+        for artist in artists:
+            artist.set_animated(True)
+        self._cid = canvas.mpl_connect("draw_event", self.on_draw)
+
+    def on_draw(self, event) -> None:
+        self.background = self.canvas.copy_from_bbox(self.canvas.figure.bbox)
+        self.draw_artists()
+
+    def draw_artists(self) -> None:
+        for artist in self.artists:
+            self.axes.draw_artist(artist)
+
+    def update(self) -> None:
+        """
+        Blits the artists. The first call makes a full draw to cache the background.
+        """
+        if self.background is None:
+            with stage("draw", blit=True):
+                self.canvas.draw()
+            return
+        self.canvas.restore_region(self.background)
+        self.draw_artists()
+        self.canvas.blit(self.canvas.figure.bbox)
+
+    def disconnect(self) -> None:
+        self.canvas.mpl_disconnect(self._cid)
+        for artist in self.artists:
+            artist.set_animated(False)
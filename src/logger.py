@@ -1,25 +1,133 @@
+import atexit
 import logging
-from logging.handlers import RotatingFileHandler
+import os
+import queue
+import sys
+import threading
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Dict, List, Optional
 
 
 class Logger():
     logfile = "app.log"
     logname = "ForksFT"
+    timingfile = "timings.jsonl"
+    timingname = "ForksFT.timing"
+    # one listener thread per process writes the queued records to the files and the console
+    listener: Optional[QueueListener] = None
+    lock = threading.Lock()
 
 
-def log_settings():
-    #  Logger definitions
-    log_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(funcName)s - line: %(lineno)d - %(message)s')
-    logFile = "app.log"
-    my_handler = RotatingFileHandler(logFile, mode="a", maxBytes=2*1024*1024, backupCount=2, encoding=None, delay=False)
+log_format = '%(asctime)s - %(levelname)s - %(funcName)s - line: %(lineno)d - %(message)s'
+
+# number of calls of every key of `sampled` since its last logged call
+_samples: Dict[str, int] = dict()
+
+
+class ThreadQueueHandler(QueueHandler):
+    """
+    QueueHandler for the listener thread of the same process. The record is queued without formatting
+    and copying, the listener formats it; only the arguments of a %-style message are merged at once.
+    """
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+
+def make_handlers() -> List[logging.Handler]:
+    """
+    Handlers of the listener: rotating app.log, console and rotating timings.jsonl
+    """
+    log_formatter = logging.Formatter(log_format)
+    my_handler = RotatingFileHandler(Logger.logfile, mode="a", maxBytes=2*1024*1024, backupCount=2, encoding=None,
+                                     delay=False)
     my_handler.setFormatter(log_formatter)
     my_handler.setLevel(logging.DEBUG)
     console_handler = logging.StreamHandler()
     console_handler.setFormatter(log_formatter)
     console_handler.setLevel(logging.INFO)
-    app_log = logging.getLogger("ForksFT")
-    app_log.setLevel(logging.INFO)
-    if len(app_log.handlers) < 2:
-        app_log.addHandler(my_handler)
-        app_log.addHandler(console_handler)
-    return app_log
+    timing_handler = RotatingFileHandler(Logger.timingfile, mode="a", maxBytes=2*1024*1024, backupCount=2, delay=True)
+    timing_handler.setFormatter(logging.Formatter("%(message)s"))
+    for handler in (my_handler, console_handler):
+        handler.addFilter(lambda record: record.name != Logger.timingname)
+    timing_handler.addFilter(logging.Filter(Logger.timingname))
+    return [my_handler, console_handler, timing_handler]
+
+
+def start_logging() -> None:
+    """
+    Routes "ForksFT" and its timing logger through a queue to the listener thread, so a log call
+    in the GUI or in a fit only puts the record into the queue. Called once per process.
+    """
+    records: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    Logger.listener = QueueListener(records, *make_handlers(), respect_handler_level=True)
+    Logger.listener.start()
+    for name, propagate in ((Logger.logname, True), (Logger.timingname, False)):
+        log = logging.getLogger(name)
+        log.setLevel(logging.INFO)
+        log.propagate = propagate
+        for handler in [handler for handler in log.handlers if isinstance(handler, QueueHandler)]:
+            log.removeHandler(handler)
+        log.addHandler(ThreadQueueHandler(records))
+    # processes of multiprocessing exit without atexit, their finalizers flush the queue instead
+    util = sys.modules.get("multiprocessing.util")
+    if util is not None:
+        util.Finalize(None, stop_logging, exitpriority=100)
+
+
+def stop_logging() -> None:
+    """
+    Writes the queued records and closes the handlers, e.g. at exit
+    """
+    with Logger.lock:
+        if Logger.listener is None:
+            return
+        Logger.listener.stop()
+        for handler in Logger.listener.handlers:
+            handler.close()
+        Logger.listener = None
+
+
+def restart_in_child() -> None:
+    # the listener thread of the parent does not exist in a forked process
+    Logger.lock = threading.Lock()
+    Logger.listener = None
+    _samples.clear()
+    start_logging()
+
+
+def log_settings():
+    #  Logger definitions. The first call of the process sets the queue up, the next ones return the same logger.
+    with Logger.lock:
+        if Logger.listener is None:
+            start_logging()
+    return logging.getLogger(Logger.logname)
+
+
+def timing_settings():
+    #  Stage timings: one JSON record per line next to app.log, not shown in the console
+    log_settings()
+    return logging.getLogger(Logger.timingname)
+
+
+def sampled(key: str, every: int = 100) -> int:
+    """
+    Sampling of the log lines of hot callbacks, e.g. the sliders. Returns the number of calls of `key`
+    since its last logged call on the first call and then on every `every`-th call, 0 otherwise:
+        count = sampled("slider")
+        if count:
+            app_log.info(f"... ({count} calls)")
+    """
+    count = _samples.get(key, 0) + 1
+    if count >= every or key not in _samples:
+        _samples[key] = 0
+        return count
+    _samples[key] = count
+    return 0
+
+
+atexit.register(stop_logging)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=restart_in_child)
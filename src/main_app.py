@@ -3,9 +3,7 @@ from tkinter import filedialog
 from tkinter import ttk
 from tkinter import messagebox
 import datetime
-import matplotlib as mpl
-mpl.use("TKAgg")
-from typing import Dict, Tuple, Optional
+from typing import Callable, Dict, Set, Tuple, Optional
 import matplotlib as mpl
 mpl.use("TKAgg")
 from matplotlib.backends.backend_tkagg import (
@@ -13,21 +11,22 @@ from matplotlib.backends.backend_tkagg import (
 from matplotlib.backend_bases import key_press_handler
 from matplotlib.figure import Figure
 import numpy as np
-import scipy.signal as sci
-from scipy.optimize import curve_fit
 
-from logger import log_settings
-from misc import SweepData, FigEnv, FigureGroup, FitParams, Mediator, Base, TextsMan
+from logger import log_settings, sampled
+from cache import load_cached
+from loader import date_convert
+import pipeline
+from fitting import fit_resonance, FitResult
+from tasks import Progress, TaskRunner
+from session import Session
+from misc import SweepData, FigEnv, FigureGroup, FitParams, Mediator, Base, TextsMan, LazyDict
+from lod import DecimationPyramid, LodScatter, BlitUpdater
+from timing import stage, timed
 
 #  Logger definitions
 app_log = log_settings()
 
 # Variables
-poly_x = 3
-poly_y = 4
-fits = FitParams()
-long_sd = SweepData()
-short_sd = SweepData()
 fig_r_X = "figure 1"
 fig_r_Y = "figure 2"
 figure_fit_X = "figure 3"
@@ -57,21 +56,80 @@ class ForksGUI(Base):
         self.master = master  # main
         self.slide1 = tkinter.IntVar()
         self.slide2 = tkinter.IntVar()
+        self.slider_job: Optional[str] = None  # pending redraw after slider moves
         tkinter.Grid.rowconfigure(master, 0, weight=1)
         tkinter.Grid.columnconfigure(master, 0, weight=1)
         master.title("Fork feedthrough calculation")
-        self.date_convert: float = 2.324243143792273  # convert time from Labview ???
-        self.figures_dict: Dict = dict()  # contains object for all figures
+        self.date_convert: float = date_convert  # convert time from Labview ???
+        # wide and short sweeps with their fit parameters, many sessions can live in one process
+        self.session = Session("gui")
+        # contains object for all figures, the tab of a figure is built on its first access
+        self.figures_dict: Dict = LazyDict(lambda key: self.build_tab(self.figure_tabs[key]))
         self.label = tkinter.Label(master, text="Fork Feedthrough parameters calculation")
         self.label.pack()
         self.nb = ttk.Notebook(master)
-
-        # first tab buttons/figures is long sweep raw
+        self.nb.pack(expand=1, fill="both")
+        # empty tabs, contents are created on the first selection
         self.tab1 = ttk.Frame(self.nb)
         self.nb.add(self.tab1, text="Wide sweep")
-        self.nb.pack(expand=1, fill="both")
+        self.tab3 = ttk.Frame(self.nb)
+        self.nb.add(self.tab3, text="Substraction of the wide sweep")
+        self.tab4 = ttk.Frame(self.nb)
+        self.nb.add(self.tab4, text="Short sweep")
+        self.tab5 = ttk.Frame(self.nb)
+        self.nb.add(self.tab5, text="Short sweep substr")
+        self.tab6 = ttk.Frame(self.nb)
+        self.nb.add(self.tab6, text=" Circle X vs Y")
+        self.tab7 = ttk.Frame(self.nb)
+        self.nb.add(self.tab7, text="Fit parameters")
+        self.tab_builders: Dict[ttk.Frame, Callable[[], None]] = {
+            self.tab1: self.build_tab1, self.tab3: self.build_tab3, self.tab4: self.build_tab4,
+            self.tab5: self.build_tab5, self.tab6: self.build_tab6, self.tab7: self.build_tab7}
+        self.figure_tabs: Dict[str, ttk.Frame] = {
+            fig_r_X: self.tab1, fig_r_Y: self.tab1, fig_d_X: self.tab3, fig_d_Y: self.tab3,
+            fig_sh_sw_X: self.tab4, fig_sh_sw_Y: self.tab4, fig_sh_d_X: self.tab5, fig_sh_d_Y: self.tab5,
+            fig_theory_x: self.tab6}
+        self.built_tabs: Set[ttk.Frame] = set()
+        self.nb.bind("<<NotebookTabChanged>>", self.on_tab_changed)
+
+        self.close_button = tkinter.Button(master, text="Close", command=master.quit)
+        self.close_button.pack(anchor='center')
+        self.tasks = TaskRunner(master, self.show_progress)
+        self.status = tkinter.Label(master, text="")
+        self.status.pack(side=tkinter.LEFT)
+        self.progress = ttk.Progressbar(master, mode="determinate", maximum=1.0, length=200)
+        self.progress.pack(side=tkinter.LEFT)
+        self.cancel_button = tkinter.Button(master, text="Cancel", command=self.tasks.cancel)
+        self.cancel_button.pack(side=tkinter.LEFT)
+
+        # first tab is visible at start
+        self.build_tab(self.tab1)
+        app_log.info("All tabs were initialized")
+        messagebox.showinfo("Manual", TextsMan.manual)
+
+    def on_tab_changed(self, event) -> None:
+        """
+        Builds the selected tab on its first selection
+        """
+        self.build_tab(self.nb.nametowidget(self.nb.select()))
+
+    def build_tab(self, tab: ttk.Frame) -> None:
+        """
+        Creates buttons and figures of the tab once
+        """
+        if tab not in self.built_tabs and tab in self.tab_builders:
+            self.built_tabs.add(tab)
+            self.tab_builders[tab]()
+            app_log.info(f"Tab `{self.nb.tab(tab, 'text')}` was built")
+
+    def build_tab1(self) -> None:
+        """
+        first tab buttons/figures is long sweep raw
+        """
         self.fit_button = tkinter.Button(self.tab1, text="Fit the Wide Sweep", command=self.fit_wide_sweep)
         self.fit_button.pack(side=tkinter.BOTTOM)
+        self.auto_button = tkinter.Button(self.tab1, text="Fit with auto exclusion", command=self.fit_wide_auto)
+        self.auto_button.pack(side=tkinter.BOTTOM)
         self.greet_button = tkinter.Button(self.tab1, text="Open Wide Sweep", command=self.open_wide_sweep)
         self.greet_button.pack(side=tkinter.BOTTOM)
         self.figure_tab1(self.tab1, fig_r_X)
@@ -86,13 +144,11 @@ class ForksGUI(Base):
         self.figure_tab1(self.tab1, fig_r_Y)
         self.figures_dict[fig_r_Y].Xtype = "Frequency [Hz]"
         self.figures_dict[fig_r_Y].Ytype = "Y [mV]"
-        self.close_button = tkinter.Button(master, text="Close", command=master.quit)
-        self.close_button.pack(anchor='center')
 
-        # third tab. Long sweep subtract
-        self.tab3 = ttk.Frame(self.nb)
-        self.nb.add(self.tab3, text="Substraction of the wide sweep")
-        self.nb.pack(expand=1, fill="both")
+    def build_tab3(self) -> None:
+        """
+        third tab. Long sweep subtract
+        """
         self.figure_tab1(self.tab3, fig_d_X)
         self.figures_dict[fig_d_X].Xtype = "Frequency [Hz]"
         self.figures_dict[fig_d_X].Ytype = "X - fitX [mV]"
@@ -100,13 +156,13 @@ class ForksGUI(Base):
         self.figures_dict[fig_d_Y].Xtype = "Frequency [Hz]"
         self.figures_dict[fig_d_Y].Ytype = "Y - fitY [mV]"
 
-        # fourth tab buttons/figures. Short sweep raw
-        self.tab4 = ttk.Frame(self.nb)
-        self.nb.add(self.tab4, text="Short sweep")
-        self.nb.pack(expand=1, fill="both")
+    def build_tab4(self) -> None:
+        """
+        fourth tab buttons/figures. Short sweep raw
+        """
         self.oss_button = tkinter.Button(self.tab4, text="Open Short Sweep", command=self.open_short_sweep)
         self.oss_button.pack(side=tkinter.BOTTOM)
-        self.refr_button = tkinter.Button(self.tab4, text="Refresh", command=lambda: self.plot_subtr(short_sd))
+        self.refr_button = tkinter.Button(self.tab4, text="Refresh", command=lambda: self.plot_subtr(self.session.short_sd))
         self.refr_button.pack(side=tkinter.BOTTOM)
         self.ytail_button = tkinter.Button(self.tab4, text="Fix Y tail", command=self.fix_y_tail)
         self.ytail_button.pack(side=tkinter.BOTTOM)
@@ -117,10 +173,10 @@ class ForksGUI(Base):
         self.figures_dict[fig_sh_sw_Y].Xtype = "Frequency [Hz]"
         self.figures_dict[fig_sh_sw_Y].Ytype = "Y [mV]"
 
-        # fifth tab buttons/figures. Short sweep subtract
-        self.tab5 = ttk.Frame(self.nb)
-        self.nb.add(self.tab5, text="Short sweep substr")
-        self.nb.pack(expand=1, fill="both")
+    def build_tab5(self) -> None:
+        """
+        fifth tab buttons/figures. Short sweep subtract
+        """
         self.fixx_button = tkinter.Button(self.tab5, text="Slope X", command=self.fix_slope_x)
         self.fixx_button.pack(side=tkinter.BOTTOM)
         self.interx_button = tkinter.Button(self.tab5, text="Intersect X", command=self.fix_intesect_x)
@@ -129,6 +185,11 @@ class ForksGUI(Base):
         self.intery_button.pack(side=tkinter.BOTTOM)
         self.fitall_button = tkinter.Button(self.tab5, text="Fit both channels", command=self.fit_both_curves)
         self.fitall_button.pack(side=tkinter.BOTTOM)
+        self.fix_tail = tkinter.BooleanVar(value=False)
+        self.fixall_button = tkinter.Button(self.tab5, text="All corrections", command=self.fix_all)
+        self.fixall_button.pack(side=tkinter.BOTTOM)
+        self.tail_check = tkinter.Checkbutton(self.tab5, text="with Y tail", variable=self.fix_tail)
+        self.tail_check.pack(side=tkinter.BOTTOM)
         self.figure_tab1(self.tab5, fig_sh_d_X)
         self.figures_dict[fig_sh_d_X].Xtype = "Frequency [Hz]"
         self.figures_dict[fig_sh_d_X].Ytype = "X [mV]"
@@ -136,74 +197,77 @@ class ForksGUI(Base):
         self.figures_dict[fig_sh_d_Y].Xtype = "Frequency [Hz]"
         self.figures_dict[fig_sh_d_Y].Ytype = "Y [mV]"
 
-        # sixth tab. Circle X vs Y
-        self.tab6 = ttk.Frame(self.nb)
-        self.nb.add(self.tab6, text=" Circle X vs Y")
-        self.nb.pack(expand=1, fill="both")
+    def build_tab6(self) -> None:
+        """
+        sixth tab. Circle X vs Y
+        """
         self.figure_tab2(self.tab6, fig_theory_x, 1, 1)
         self.figures_dict[fig_theory_x].Xtype = "X [mV]"
         self.figures_dict[fig_theory_x].Ytype = "Y [mV]"
 
-        # seventh tab. Text with fit parameters
-        self.tab7 = ttk.Frame(self.nb)
-        self.nb.add(self.tab7, text="Fit parameters")
-        self.nb.pack(expand=1, fill="both")
+    def build_tab7(self) -> None:
+        """
+        seventh tab. Text with fit parameters
+        """
         self.fit_text = tkinter.Text(self.tab7, height=12, width=60)
         self.fit_text.pack(side=tkinter.TOP)
         self.fit_text.insert(tkinter.END, "\n".join(fit_str))
 
-        app_log.info("All tabs were initialized")
-        messagebox.showinfo("Manual", TextsMan.manual)
-
     @staticmethod
-    def open_file(sweep: str) -> np.ndarray:
-        """
-        Open wide or short sweep data. Parse and save to DataSweep object.
-        :param sweep:
-        :return data: An np.array with parsed data
-        :raise: ValueError
-        """
-        file1 = filedialog.askopenfilename(title="Open " + sweep + " file",
-                                           filetypes=(("dat files", "*.dat"),
-                                                      ("all files", "*.*")))
-        kerneldt = np.dtype({"names": ["uni_time", "frequency", "X", "Y", "amplitude", "id"],
-                             "formats": [np.longlong, np.int, float, float, float, np.int]})
-        first_data = True
-        try:
-            with open(file1, "r") as f:
-                for line in f:
-                    if line[0] != "#":  # skip header
-                        parse: Tuple = tuple([float(x) for x in line.split()])
-                        if first_data:
-                            data = np.array([parse], dtype=kerneldt)
-                            first_data = False
-                        else:
-                            row = np.array([parse], dtype=kerneldt)
-                            data = np.concatenate((data, row))
-                app_log.debug(f"Shape of array is {np.shape(data)}")
-        except AttributeError:
-            app_log.critical(f"File does not contain an appropriate data or empty")
-            messagebox.showerror("Error", "File does not contain an appropriate data or empty")
-            raise ValueError("No data file was created. Check the file")
-        except Exception as ex:
+    def ask_file(sweep: str) -> str:
+        """
+        Dialog to choose the wide or short sweep file
+        :param sweep: "wide" or "short"
+        :return file1: path or empty string if cancelled
+        """
+        return filedialog.askopenfilename(title="Open " + sweep + " file",
+                                          filetypes=(("dat files", "*.dat"),
+                                                     ("binary sweeps", "*.swp"),
+                                                     ("all files", "*.*")))
+
+    def open_file(self, sweep: str, on_done: Callable[[np.ndarray], None]) -> None:
+        """
+        Open wide or short sweep data. The file is parsed in a worker thread,
+        `on_done` gets the parsed np.array on the Tk thread.
+        :param sweep: "wide" or "short"
+        :param on_done: callback with the parsed data
+        """
+        file1 = self.ask_file(sweep)
+        if not file1:
+            return
+
+        def done(data: np.ndarray) -> None:
+            app_log.info(f"File: {file1} was parsed")
+            on_done(data)
+
+        def failed(ex: Exception) -> None:
             app_log.error(f"File can NOT be opened: {ex}")
             messagebox.showerror("Error", f"File can NOT be opened: {ex}")
-            raise ValueError("No data was created")
-        else:
-            app_log.info(f"File: {file1} was parsed")
-            return data
+
+        self.tasks.submit(f"open {sweep}", lambda progress: load_cached(file1, progress), done, failed)
 
     def open_wide_sweep(self) -> None:
         """
         Open wide sweep data. Parse and save to DataSweep object
         :return:
         """
+        self.open_file("wide", self.show_wide_sweep)
+
+    def show_wide_sweep(self, data: np.ndarray) -> None:
+        """
+        Save the parsed wide sweep to DataSweep object and plot it
+        """
+        long_sd = self.session.long_sd
         try:
-            data = self.open_file("wide")
             long_sd.create_data(data)
-            self.plot_fig_tab1(long_sd.Frequency, long_sd.X, fig_r_X)
-            self.plot_fig_tab1(long_sd.Frequency, long_sd.Y, fig_r_Y)
             long_sd.create_mask()
+            freq = long_sd.require("Frequency")
+            self.plot_fig_tab1(freq, long_sd.require("X"), fig_r_X, long_sd.get_lod("X"), long_sd.mask)
+            self.plot_fig_tab1(freq, long_sd.require("Y"), fig_r_Y, long_sd.get_lod("Y"), long_sd.mask)
+            for figure_key in (fig_r_X, fig_r_Y):
+                self.figures_dict[figure_key].blit = BlitUpdater(self.figures_dict[figure_key].canvas,
+                                                                 self.figures_dict[figure_key].axes,
+                                                                 [self.figures_dict[figure_key].scat])
             long_sd.group = "wide"
             self.sc1.configure(to=long_sd.max_slider)
             self.sc2.configure(to=long_sd.max_slider)
@@ -219,19 +283,40 @@ class ForksGUI(Base):
         Open short sweep data. Parse and save to DataSweep object
         :return:
         """
+        self.open_file("short", self.show_short_sweep)
+
+    def show_short_sweep(self, data: np.ndarray) -> None:
+        """
+        Save the parsed short sweep to DataSweep object, plot it and subtract the wide sweep fit
+        """
+        short_sd = self.session.short_sd
         try:
-            data = self.open_file("short")
             short_sd.create_data(data)
-            self.plot_fig_tab1(short_sd.Frequency, short_sd.X, fig_sh_sw_X)
-            self.plot_fig_tab1(short_sd.Frequency, short_sd.Y, fig_sh_sw_Y)
+            freq = short_sd.require("Frequency")
+            self.plot_fig_tab1(freq, short_sd.require("X"), fig_sh_sw_X, short_sd.get_lod("X"))
+            self.plot_fig_tab1(freq, short_sd.require("Y"), fig_sh_sw_Y, short_sd.get_lod("Y"))
             short_sd.create_mask()
             short_sd.group = "short"
             self.plot_subtr(short_sd)
         except Exception as ex:
-            app_log.warning(f"Open of wide sweep fails cause of: {ex}")
+            app_log.warning(f"Open of short sweep fails cause of: {ex}")
         else:
             app_log.info("Short sweep is opened and parsed")
 
+    def show_progress(self, name: str, fraction: float, text: str) -> None:
+        """
+        Progress of background tasks in the status bar
+        """
+        self.progress["value"] = fraction
+        self.status.configure(text=f"{name}: {text}" if fraction < 1.0 else f"{name}: {text or 'done'}")
+
+    def draw(self, figure_key: str) -> None:
+        """
+        Full redraw of the canvas of the figure, timed as the stage "draw"
+        """
+        with stage("draw", figure=figure_key):
+            self.figures_dict[figure_key].canvas.draw()
+
     def figure_tab1(self, area: ttk.Frame, figure_key: str) -> None:
         """
         Creates an empty figure in matplotlib
@@ -243,41 +328,66 @@ class ForksGUI(Base):
             self.figures_dict.update({figure_key: FigEnv()})
             self.figures_dict[figure_key].figure = Figure(figsize=(3, 3), dpi=100)
             self.figures_dict[figure_key].axes = self.figures_dict[figure_key].figure.add_subplot(111)
-            self.figures_dict[figure_key].canvas = FigureCanvasTkAgg(self.figures_dict[figure_key].figure, master=area)
-            self.figures_dict[figure_key].canvas.get_tk_widget().pack(side=tkinter.TOP, fill=tkinter.BOTH, expand=1)
-            self.figures_dict[figure_key].canvas.draw()
+            frame = ttk.Frame(area)
+            frame.pack(side=tkinter.TOP, fill=tkinter.BOTH, expand=1)
+            self.add_canvas(frame, figure_key)
             app_log.info(f"`{figure_key}` canvas was successfully created")
         except Exception as ex:
             messagebox.showerror("Error", f"Figure {figure_key} can NOT be created: {ex}")
             app_log.error(f"`{figure_key}` was not created due to {ex}")
 
-    def plot_fig_tab1(self, x: np.ndarray, y: np.ndarray, figure_key: str) -> None:
+    def plot_fig_tab1(self, x: np.ndarray, y: np.ndarray, figure_key: str,
+                      pyramid: Optional[DecimationPyramid] = None, mask: Optional[np.ndarray] = None) -> None:
         """
         Plots figure in canvas. Also sets main `axes` properties for each figure
+        Only the decimated points of the visible range are drawn.
         :param x: X - array to plot
         :param y: Y - array to plot
         :param figure_key: key of figure took from the very top of this file
+        :param pyramid: decimation pyramid of (x, y)
+        :param mask: points to show
         """
+        long_sd = self.session.long_sd
         try:
             if long_sd.Time is not None:
                 utctotime = datetime.datetime.utcfromtimestamp(long_sd.Time[0] / self.date_convert)
                 date1 = str(utctotime.date())
             else:
                 date1 = ""
+            self.figures_dict[figure_key].blit = None
             self.figures_dict[figure_key].axes.clear()
-            self.figures_dict[figure_key].scat = self.figures_dict[figure_key].axes.scatter(x, y, s=5)
+            self.figures_dict[figure_key].lod_scat = None
+            self.figures_dict[figure_key].lod_pltt = None
+            self.figures_dict[figure_key].pltt = None
+            self.figures_dict[figure_key].scat = self.figures_dict[figure_key].axes.scatter([], [], s=5)
             self.figures_dict[figure_key].axes.set_title(f" {figure_key}: Wide sweep at {date1}")
             self.figures_dict[figure_key].axes.set_xlabel(self.figures_dict[figure_key].Xtype)
             self.figures_dict[figure_key].axes.set_ylabel(self.figures_dict[figure_key].Ytype)
-            self.figures_dict[figure_key].axes.set_xlim(min(x), max(x))
-            self.figures_dict[figure_key].axes.set_ylim(min(y), max(y))
+            self.figures_dict[figure_key].axes.set_xlim(np.min(x), np.max(x))
+            self.figures_dict[figure_key].axes.set_ylim(np.min(y), np.max(y))
+            self.figures_dict[figure_key].lod_scat = LodScatter(self.figures_dict[figure_key].axes,
+                                                                self.figures_dict[figure_key].scat, x, y, pyramid, mask)
+            self.figures_dict[figure_key].lod_scat.refresh()
             self.figures_dict[figure_key].axes.grid()
-            self.figures_dict[figure_key].canvas.draw()
+            self.draw(figure_key)
             app_log.info(f"`{figure_key}` raw data were plotted")
         except Exception as ex:
             app_log.error(f"`{figure_key}` was not updated due to: {ex}")
             messagebox.showerror("Error", f"Figure {figure_key} can NOT be Updated: {ex}")
 
+    def add_canvas(self, frame: ttk.Frame, figure_key: str) -> None:
+        """
+        Canvas of the figure with its navigation toolbar below it. A zoom or pan of the toolbar changes
+        the x-limits, so LodScatter shows the decimated points of the new range.
+        :param frame: own frame of the figure
+        :param figure_key: figure key in dictionary figure list
+        """
+        self.figures_dict[figure_key].canvas = FigureCanvasTkAgg(self.figures_dict[figure_key].figure, master=frame)
+        # the toolbar packs itself at the bottom of the frame, it is created first to stay visible on resize
+        self.figures_dict[figure_key].toolbar = NavigationToolbar2Tk(self.figures_dict[figure_key].canvas, frame)
+        self.figures_dict[figure_key].toolbar.update()
+        self.figures_dict[figure_key].canvas.get_tk_widget().pack(side=tkinter.TOP, fill=tkinter.BOTH, expand=1)
+
     def figure_tab2(self, area: ttk.Frame, figure_key: str, row: int, col: int) -> None:
         """
         figure in matplotlib
@@ -293,9 +403,9 @@ class ForksGUI(Base):
             self.figures_dict[figure_key].figure = Figure(figsize=(6, 6), dpi=100)
             self.figures_dict[figure_key].axes = self.figures_dict[figure_key].figure.add_subplot(111)
             self.figures_dict[figure_key].axes.set_title(f" {figure_key}: X vs Y")
-            self.figures_dict[figure_key].canvas = FigureCanvasTkAgg(self.figures_dict[figure_key].figure, master=area)
-            self.figures_dict[figure_key].canvas.get_tk_widget().grid(row=row, column=col, sticky="nsew")
-            self.figures_dict[figure_key].canvas.draw()
+            frame = ttk.Frame(area)
+            frame.grid(row=row, column=col, sticky="nsew")
+            self.add_canvas(frame, figure_key)
             app_log.info(f"`{figure_key}` canvas was successfully created")
         except Exception as ex:
             messagebox.showerror("Error", f"Figure {figure_key} can NOT be created: {ex}")
@@ -304,7 +414,17 @@ class ForksGUI(Base):
     def update_slider_tab1(self, value) -> None:
         """
         Initiates upon updating of scales/sliders on the tab1, i.e. Open wide sweep
+        Slider events are coalesced: at most one redraw per frame.
         """
+        if self.slider_job is None:
+            self.slider_job = self.master.after(16, self.redraw_slider_tab1)
+
+    def redraw_slider_tab1(self) -> None:
+        """
+        Updates the mask by the last slider positions and blits the wide sweep points
+        """
+        long_sd = self.session.long_sd
+        self.slider_job = None
         var1 = self.slide1.get()
         var2 = self.slide2.get()
         try:
@@ -316,59 +436,122 @@ class ForksGUI(Base):
                     long_sd.mask[var1:var2] = False
                 else:
                     long_sd.mask[0:-1] = True
-                self.figures_dict[fig_r_X].scat.remove()
-                self.figures_dict[fig_r_Y].scat.remove()
-                self.figures_dict[fig_r_X].scat = \
-                    self.figures_dict[fig_r_X].axes.scatter(long_sd.Frequency[long_sd.mask],
-                                                            long_sd.X[long_sd.mask], s=10, c="blue")
-                self.figures_dict[fig_r_Y].scat = \
-                    self.figures_dict[fig_r_Y].axes.scatter(long_sd.Frequency[long_sd.mask],
-                                                            long_sd.Y[long_sd.mask], s=10, c="blue")
-                self.figures_dict[fig_r_X].canvas.draw()
-                self.figures_dict[fig_r_Y].canvas.draw()
+                for figure_key in (fig_r_X, fig_r_Y):
+                    self.figures_dict[figure_key].lod_scat.mask = long_sd.mask
+                    self.figures_dict[figure_key].lod_scat.refresh()
+                    if self.figures_dict[figure_key].blit is not None:
+                        self.figures_dict[figure_key].blit.update()
+                    else:
+                        self.figures_dict[figure_key].canvas.draw_idle()
         except Exception as ex:
-            app_log.error(f"Update slider fails: {ex}")
+            # the callback runs on every frame of a slider move, a broken one logs every 100th failure
+            count = sampled("slider")
+            if count:
+                app_log.error(f"Update slider fails: {ex} ({count} times)")
 
     def fit_wide_sweep(self) -> None:
         """
         Fit the wide sweep. X with poly of 3, Y with poly of 4. Using mask
         """
+        long_sd = self.session.long_sd
+        if long_sd.Frequency is not None and long_sd.mask is not None \
+                and long_sd.X is not None and long_sd.Y is not None:
+            snapshot = long_sd.snapshot(("X", "Y"))
+            frequency = long_sd.Frequency
+
+            def work(progress: Progress) -> Tuple[np.ndarray, np.ndarray]:
+                progress(0.0, "fitting")
+                return pipeline.wide_coefficients(snapshot, self.session.deg_x, self.session.deg_y,
+                                                  check=progress.check)
+
+            self.tasks.submit("fit wide", work, lambda coefs: self.show_wide_fit(coefs, frequency), self.fit_failed)
+
+    def fit_wide_auto(self) -> None:
+        """
+        Fit the wide sweep with the resonance excluded by sigma clipping instead of the sliders
+        """
+        long_sd = self.session.long_sd
+        if long_sd.Frequency is not None and long_sd.X is not None and long_sd.Y is not None:
+            snapshot = long_sd.snapshot(("X", "Y"))
+            frequency = long_sd.Frequency
+
+            def work(progress: Progress) -> pipeline.WideFit:
+                progress(0.0, "robust fitting")
+                return pipeline.robust_coefficients(snapshot, self.session.deg_x, self.session.deg_y, "clip",
+                                                    check=progress.check)
+
+            self.tasks.submit("fit wide", work, lambda res: self.show_wide_auto(res, frequency), self.fit_failed)
+
+    def check_wide_fit(self, frequency: Optional[np.ndarray]) -> None:
+        """
+        :param frequency: Frequency array of the wide sweep when its fit was started
+        :raise: ValueError if the wide sweep was opened again during the fit
+        """
+        if frequency is None or self.session.long_sd.Frequency is not frequency:
+            raise ValueError("wide sweep was opened again during the fit")
+
+    def show_wide_auto(self, res: pipeline.WideFit, frequency: Optional[np.ndarray]) -> None:
+        """
+        Shows the automatic mask of the wide sweep and its fit
+        :param res: robust fit from the worker
+        :param frequency: Frequency array of the fitted wide sweep
+        """
+        long_sd = self.session.long_sd
         try:
-            if long_sd.Frequency is not None and long_sd.mask is not None \
-                    and long_sd.X is not None and long_sd.Y is not None:
+            self.check_wide_fit(frequency)
+            long_sd.mask = res.mask
+            for figure_key in (fig_r_X, fig_r_Y):
+                if self.figures_dict[figure_key].lod_scat is not None:
+                    self.figures_dict[figure_key].lod_scat.mask = long_sd.mask
+                    self.figures_dict[figure_key].lod_scat.refresh()
+            app_log.info(f"{int(np.count_nonzero(~res.mask))} points of wide sweep are excluded automatically")
+        except Exception as ex:
+            self.fit_failed(ex)
+            return
+        self.show_wide_fit((res.fitx, res.fity), frequency)
 
-                fits.fitx = np.polyfit(long_sd.Frequency[long_sd.mask],
-                                       long_sd.X[long_sd.mask], poly_x)
-                fits.fity = np.polyfit(long_sd.Frequency[long_sd.mask],
-                                       long_sd.Y[long_sd.mask], poly_y)
+    def show_wide_fit(self, coefs: Tuple[np.ndarray, np.ndarray], frequency: Optional[np.ndarray]) -> None:
+        """
+        Stores the polynomials of the wide sweep and plots them with the subtraction
+        :param coefs: X and Y polynomials from the worker
+        :param frequency: Frequency array of the fitted wide sweep
+        """
+        long_sd = self.session.long_sd
+        fits = self.session.fits
+        try:
+            self.check_wide_fit(frequency)
+            if long_sd.Frequency is not None:
+                self.session.set_background(*coefs)
                 r_fit_x = np.poly1d(fits.fitx)
                 r_fit_y = np.poly1d(fits.fity)
-                if self.figures_dict[fig_r_X].pltt:
-                    self.figures_dict[fig_r_X].pltt.remove()
-                self.figures_dict[fig_r_X].pltt = \
-                    self.figures_dict[fig_r_X].axes.scatter(long_sd.Frequency,
-                                                            r_fit_x(long_sd.Frequency), c="red", s=1)
-                self.figures_dict[fig_r_X].axes.set_ylim(min(r_fit_x(long_sd.Frequency)),
-                                                         max(r_fit_x(long_sd.Frequency)))
-                self.figures_dict[fig_r_X].canvas.draw()
-                if self.figures_dict[fig_r_Y].pltt:
-                    self.figures_dict[fig_r_Y].pltt.remove()
-                self.figures_dict[fig_r_Y].pltt = \
-                    self.figures_dict[fig_r_Y].axes.scatter(long_sd.Frequency,
-                                                            r_fit_y(long_sd.Frequency), c="red", s=1)
-                self.figures_dict[fig_r_Y].axes.set_ylim(min(r_fit_y(long_sd.Frequency)),
-                                                         max(r_fit_y(long_sd.Frequency)))
-                self.figures_dict[fig_r_Y].canvas.draw()
+                for figure_key, r_fit in ((fig_r_X, r_fit_x), (fig_r_Y, r_fit_y)):
+                    fit_vals = r_fit(long_sd.Frequency)
+                    if self.figures_dict[figure_key].pltt:
+                        self.figures_dict[figure_key].pltt.remove()
+                    self.figures_dict[figure_key].pltt = \
+                        self.figures_dict[figure_key].axes.scatter([], [], c="red", s=1)
+                    self.figures_dict[figure_key].lod_pltt = LodScatter(self.figures_dict[figure_key].axes,
+                                                                        self.figures_dict[figure_key].pltt,
+                                                                        long_sd.Frequency, fit_vals)
+                    self.figures_dict[figure_key].axes.set_ylim(np.min(fit_vals), np.max(fit_vals))
+                    self.figures_dict[figure_key].lod_pltt.refresh()
+                    self.draw(figure_key)
                 self.plot_subtr(long_sd)
                 app_log.info("Fit of wide sweep was done")
         except Exception as ex:
-            messagebox.showerror("Error", f"Fails to fit the wide sweep: {ex}")
-            app_log.error(f"Fail to fit: {ex}")
+            self.fit_failed(ex)
+
+    @staticmethod
+    def fit_failed(ex: Exception) -> None:
+        messagebox.showerror("Error", f"Fails to fit the wide sweep: {ex}")
+        app_log.error(f"Fail to fit: {ex}")
 
+    @timed("plot_subtr", lambda self, sweep: None if sweep.Frequency is None else len(sweep.Frequency))
     def plot_subtr(self, sweep: SweepData) -> None:
         """
         Plot subtraction after import wide sweep and fitting the graphs
         """
+        fits = self.session.fits
         try:
             if sweep.group is not None:
                 if sweep.group == fig_wide.name:
@@ -382,44 +565,30 @@ class ForksGUI(Base):
                     raise ValueError("Wide or short sweep does not found or names do not match.")
             if (sweep.X is not None) and (sweep.Y is not None) \
                     and (sweep.Frequency is not None):
-                r_fit_x = np.poly1d(fits.fitx)
-                r_fit_y = np.poly1d(fits.fity)
-                dx = np.subtract(sweep.X, r_fit_x(sweep.Frequency))
-                dy = np.subtract(sweep.Y, r_fit_y(sweep.Frequency))
-                sweep.update_deltax(dx)
-                sweep.update_deltay(dy)
-                if self.figures_dict[fig_namex].scat is None:
-                    self.figures_dict[fig_namex].axes.clear()
-                    self.figures_dict[fig_namex].axes.set_title(f"{fig_namex}: Subtract of X for {sweep.group} sweep ")
-                    self.figures_dict[fig_namex].axes.set_xlim(min(sweep.Frequency), max(sweep.Frequency))
-                    self.figures_dict[fig_namex].axes.set_xlabel(self.figures_dict[fig_namex].Xtype)
-                    self.figures_dict[fig_namex].axes.set_ylabel(self.figures_dict[fig_namex].Ytype)
-                    self.figures_dict[fig_namex].axes.grid()
-                else:
-                    self.figures_dict[fig_namex].scat.remove()
-                if sweep.dx is not None:
-                    self.figures_dict[fig_namex].axes.set_ylim(min(sweep.dx), max(sweep.dx))
-                    self.figures_dict[fig_namex].scat = self.figures_dict[fig_namex].axes.scatter(sweep.Frequency,
-                                                                                                  sweep.dx,
-                                                                                                  s=5, c="green")
-                self.figures_dict[fig_namex].canvas.draw()
-                app_log.info(f"`{fig_namex}` subtract data were plotted")
-                if self.figures_dict[fig_namey].scat is None:
-                    self.figures_dict[fig_namey].axes.clear()
-                    self.figures_dict[fig_namey].axes.set_title(f"{fig_namey}: Subtract of Y for {sweep.group} sweep ")
-                    self.figures_dict[fig_namey].axes.set_xlabel(self.figures_dict[fig_namey].Xtype)
-                    self.figures_dict[fig_namey].axes.set_ylabel(self.figures_dict[fig_namey].Ytype)
-                    self.figures_dict[fig_namey].axes.set_xlim(min(sweep.Frequency), max(sweep.Frequency))
-                    self.figures_dict[fig_namey].axes.grid()
-                else:
-                    self.figures_dict[fig_namey].scat.remove()
-                if sweep.dy is not None:
-                    self.figures_dict[fig_namey].axes.set_ylim(min(sweep.dy), max(sweep.dy))
-                    self.figures_dict[fig_namey].scat = self.figures_dict[fig_namey].axes.scatter(sweep.Frequency,
-                                                                                                  sweep.dy,
-                                                                                                  s=5, c="green")
-                self.figures_dict[fig_namey].canvas.draw()
-                app_log.info(f"`{fig_namey}` subtract data were plotted")
+                pipeline.subtract(sweep, fits)
+                for fig_name, channel, name in ((fig_namex, "dx", "X"), (fig_namey, "dy", "Y")):
+                    values = getattr(sweep, channel)
+                    if self.figures_dict[fig_name].scat is None:
+                        self.figures_dict[fig_name].axes.clear()
+                        self.figures_dict[fig_name].axes.set_title(f"{fig_name}: Subtract of {name} for "
+                                                                   f"{sweep.group} sweep ")
+                        self.figures_dict[fig_name].axes.set_xlim(np.min(sweep.Frequency), np.max(sweep.Frequency))
+                        self.figures_dict[fig_name].axes.set_xlabel(self.figures_dict[fig_name].Xtype)
+                        self.figures_dict[fig_name].axes.set_ylabel(self.figures_dict[fig_name].Ytype)
+                        self.figures_dict[fig_name].axes.grid()
+                    else:
+                        self.figures_dict[fig_name].scat.remove()
+                    if values is not None:
+                        self.figures_dict[fig_name].axes.set_ylim(np.min(values), np.max(values))
+                        self.figures_dict[fig_name].scat = self.figures_dict[fig_name].axes.scatter([], [], s=5,
+                                                                                                    c="green")
+                        self.figures_dict[fig_name].lod_scat = LodScatter(self.figures_dict[fig_name].axes,
+                                                                          self.figures_dict[fig_name].scat,
+                                                                          sweep.Frequency, values,
+                                                                          sweep.get_lod(channel))
+                        self.figures_dict[fig_name].lod_scat.refresh()
+                    self.draw(fig_name)
+                    app_log.info(f"`{fig_name}` subtract data were plotted")
         except AttributeError:
             app_log.error(f"Short sweep opens before fit of the wide sweep")
             messagebox.showerror("File opens before fit", "You open a file before perform a fit of the wide sweep. "
@@ -431,25 +600,13 @@ class ForksGUI(Base):
     def fix_slope_x(self) -> None:
         """
         Fix the slope for X component.
-        nums: number of points for mean function
+        nums: number of points for mean function, proportional to the sweep length
         """
-        nums = 100
+        short_sd = self.session.short_sd
+        fits = self.session.fits
         try:
             if (short_sd.dx is not None) and (short_sd.Frequency is not None):
-                id0 = np.argmax(short_sd.dx)
-                short_sd.ind_max = id0
-                d1 = len(short_sd.dx) - id0
-                shift = np.minimum(id0, d1)
-                part1 = short_sd.dx[(id0-shift):(id0-shift)+nums]
-                part2 = short_sd.dx[(id0+shift)-nums:(id0+shift)]
-                arg1 = short_sd.Frequency[(id0-shift):(id0-shift)+nums]
-                arg2 = short_sd.Frequency[(id0+shift)-nums:(id0+shift)]
-                p1 = np.mean(part1)
-                p2 = np.mean(part2)
-                x1 = np.mean(arg1)
-                x2 = np.mean(arg2)
-                k = (p2-p1)/(x2-x1)
-                fits.update_slope_x(k)
+                fits.update_slope_x(pipeline.slope_x(short_sd))
                 self.plot_subtr(short_sd)
         except Exception as ex:
             app_log.error(f"Slope of X can not be fixed: {ex}")
@@ -460,16 +617,13 @@ class ForksGUI(Base):
     def fix_intesect_x(self) -> None:
         """
         Change the intersect of X in order to move the whole graph up or down under the X-axis
-        :num: Number of points from the begin and end to cut and analyze
+        :num: Number of points from the begin and end to cut and analyze, proportional to the sweep length
         """
-        num = 100
+        short_sd = self.session.short_sd
+        fits = self.session.fits
         try:
             if (short_sd.X is not None) and (short_sd.dx is not None):
-                part1 = short_sd.dx[0:num]
-                part2 = short_sd.dx[-num:-1]
-                subtr = np.minimum(np.mean(part1), np.mean(part2))
-                add = np.maximum(np.std(part1), np.std(part2))
-                fits.update_intersect_x(subtr-add)
+                fits.update_intersect_x(pipeline.intersect_x(short_sd))
                 self.plot_subtr(short_sd)
         except Exception as ex:
             app_log.error(f"Intersect of X can NOT be changed: {ex}")
@@ -482,44 +636,62 @@ class ForksGUI(Base):
         Fix the jump on the short sweep in Y channel.
         :num: is used for cutting +-
         :wind:poly: window and poly value for Savitsky-Golay filtering
+        num and wind are proportional to the sweep length
         """
-        num = 10
-        wind = 21
-        poly = 1
+        short_sd = self.session.short_sd
         try:
             if (short_sd.Y is not None) and (short_sd.Frequency is not None):
-                id0 = np.argmax(short_sd.Y)
-                part1 = short_sd.Y[0:id0]
-                dif_y = sci.savgol_filter(part1, wind, poly, deriv=1)
-                prob = np.argmax(np.abs(dif_y))
-                y1 = np.mean(part1[prob - 2*num: prob - num])
-                y2 = np.mean(part1[prob + num: prob + 2*num])
-                delta = y2-y1
-                short_sd.update_y_tail(prob, delta)
-                if self.figures_dict[fig_sh_sw_Y].scat is not None:
-                    self.figures_dict[fig_sh_sw_Y].scat.remove()
-                self.figures_dict[fig_sh_sw_Y].scat = self.figures_dict[fig_sh_sw_Y].axes.scatter(short_sd.Frequency,
-                                                                                                  short_sd.Y, s=10,
-                                                                                                  c="blue")
-                self.figures_dict[fig_sh_sw_Y].canvas.draw()
+                pipeline.y_tail(short_sd)
+                self.plot_short_y()
         except Exception as ex:
             app_log.error(f"Y-tail can NOT be fixed {ex}")
             messagebox.showerror("Error", f"Y-tail was NOT updated: {ex}")
         else:
             app_log.info("Y-tail is fixed")
 
+    def plot_short_y(self) -> None:
+        """
+        Replots Y of the short sweep after the fix of its tail
+        """
+        short_sd = self.session.short_sd
+        if self.figures_dict[fig_sh_sw_Y].scat is not None:
+            self.figures_dict[fig_sh_sw_Y].scat.remove()
+        self.figures_dict[fig_sh_sw_Y].scat = self.figures_dict[fig_sh_sw_Y].axes.scatter([], [], s=10,
+                                                                                          c="blue")
+        self.figures_dict[fig_sh_sw_Y].lod_scat = LodScatter(self.figures_dict[fig_sh_sw_Y].axes,
+                                                             self.figures_dict[fig_sh_sw_Y].scat,
+                                                             short_sd.require("Frequency"), short_sd.require("Y"),
+                                                             short_sd.get_lod("Y"))
+        self.figures_dict[fig_sh_sw_Y].lod_scat.refresh()
+        self.draw(fig_sh_sw_Y)
+
+    def fix_all(self) -> None:
+        """
+        Slope X, Intersect X and Intersect Y (and Y tail if checked) in one pass with one redraw
+        """
+        short_sd = self.session.short_sd
+        fits = self.session.fits
+        try:
+            if (short_sd.X is not None) and (short_sd.Y is not None) and (short_sd.Frequency is not None):
+                pipeline.correct(short_sd, fits, self.fix_tail.get())
+                if self.fix_tail.get():
+                    self.plot_short_y()
+                self.plot_subtr(short_sd)
+        except Exception as ex:
+            app_log.error(f"Corrections can NOT be applied: {ex}")
+            messagebox.showerror("Error", f"Corrections were NOT applied: {ex}")
+        else:
+            app_log.info("All corrections are applied")
+
     def fix_intersect_y(self) -> None:
         """
         Fixes an interface of the dY signal
         """
+        short_sd = self.session.short_sd
+        fits = self.session.fits
         try:
             if (short_sd.dy is not None) and (short_sd.Frequency is not None):
-                id0 = np.argmax(short_sd.dy)
-                max_y = short_sd.dy[id0]
-                id1 = np.argmin(short_sd.dy)
-                min_y = short_sd.dy[id1]
-                val = (max_y + min_y)/2
-                fits.update_intersect_y(val)
+                fits.update_intersect_y(pipeline.intersect_y(short_sd))
                 self.plot_subtr(short_sd)
         except Exception as ex:
             app_log.error(f"Y-intersect can NOT be fixed: {ex}")
@@ -529,35 +701,46 @@ class ForksGUI(Base):
 
     def fit_both_curves(self):
         """
-        Performs the fit of dX and dY
+        Performs the joint fit of dX and dY
         """
+        short_sd = self.session.short_sd
         a = 10000
         q = 30.0
+        if (short_sd.dy is not None) and (short_sd.Frequency is not None) and (short_sd.dx is not None):
+            p0 = pipeline.initial_guess(short_sd, a, q)
+            # copies: the Tk thread may change the block of the sweep while the worker fits
+            freq, dx, dy = short_sd.Frequency.copy(), short_sd.dx.copy(), short_sd.dy.copy()
+
+            def work(progress: Progress) -> FitResult:
+                progress(0.0, "fitting")
+                return fit_resonance(freq, dx, dy, p0, max_nfev=10000, tol=0.00005, check=progress.check)
+
+            def failed(ex: Exception) -> None:
+                app_log.error(f"Can not fit: {ex}")
+                messagebox.showerror("Error", f"The Short sweep fit fails: {ex}")
+
+            self.tasks.submit("fit short", work, self.show_short_fit, failed)
+
+    def show_short_fit(self, res: FitResult) -> None:
+        """
+        Stores the resonance fit of the worker and plots the theory curves and the circle
+        """
+        short_sd = self.session.short_sd
+        fits = self.session.fits
         try:
             if (short_sd.dy is not None) and (short_sd.Frequency is not None) and (short_sd.dx is not None):
-                if short_sd.ind_max is not None:
-                    f0 = short_sd.Frequency[short_sd.ind_max]
-                else:
-                    f0 = 32000
-                p0 = [f0, q, a]
-                popt, pcov = curve_fit(short_sd.fun_fit_x, short_sd.Frequency, short_sd.dx, p0, maxfev=10000,
-                                       ftol=0.00005, xtol=0.00005)
-                short_sd.gen_fit_x(popt[0], popt[1], popt[2])
-                short_sd.gen_fit_y(popt[0], popt[1], popt[2])
-                if self.figures_dict[fig_sh_d_X].pltt is not None:
-                    self.figures_dict[fig_sh_d_X].pltt.remove()
-                self.figures_dict[fig_sh_d_X].pltt = self.figures_dict[fig_sh_d_X].axes.scatter(short_sd.Frequency,
-                                                                                                short_sd.dx_fit,
-                                                                                                s=4, c="red")
-                self.figures_dict[fig_sh_d_X].canvas.draw()
-                if self.figures_dict[fig_sh_d_Y].pltt is not None:
-                    self.figures_dict[fig_sh_d_Y].pltt.remove()
-                self.figures_dict[fig_sh_d_Y].pltt = self.figures_dict[fig_sh_d_Y].axes.scatter(short_sd.Frequency,
-                                                                                                short_sd.dy_fit,
-                                                                                                s=4, c="red")
-                self.figures_dict[fig_sh_d_Y].canvas.draw()
-                fits.f0 = popt[0]
-                fits.q = popt[1]
+                pipeline.apply_fit(short_sd, fits, res)
+                for figure_key, channel in ((fig_sh_d_X, "dx_fit"), (fig_sh_d_Y, "dy_fit")):
+                    if self.figures_dict[figure_key].pltt is not None:
+                        self.figures_dict[figure_key].pltt.remove()
+                    self.figures_dict[figure_key].pltt = \
+                        self.figures_dict[figure_key].axes.scatter([], [], s=4, c="red")
+                    self.figures_dict[figure_key].lod_pltt = LodScatter(self.figures_dict[figure_key].axes,
+                                                                        self.figures_dict[figure_key].pltt,
+                                                                        short_sd.require("Frequency"),
+                                                                        short_sd.require(channel))
+                    self.figures_dict[figure_key].lod_pltt.refresh()
+                    self.draw(figure_key)
                 fits.k = self.find_k()
                 self.plot_circle(fig_theory_x)
         except Exception as ex:
@@ -570,6 +753,7 @@ class ForksGUI(Base):
         """
         Plot X vs Y as well as fitted X vs Y
         """
+        short_sd = self.session.short_sd
         try:
             if (short_sd.dx is not None) and (short_sd.dy is not None) and (short_sd.dx_fit is not None) and \
                (short_sd.dy_fit is not None):
@@ -585,7 +769,7 @@ class ForksGUI(Base):
                 self.figures_dict[figure_key].axes.set_xlim(min(short_sd.dx), max(short_sd.dx))
                 self.figures_dict[figure_key].axes.set_ylim(min(short_sd.dy), max(short_sd.dy))
                 self.figures_dict[figure_key].axes.grid()
-                self.figures_dict[figure_key].canvas.draw()
+                self.draw(figure_key)
         except Exception as ex:
             app_log.error(f"`{figure_key}` was not updated due to: {ex}")
             messagebox.showerror("Error", f"Circle plot was not plotted: {ex}")
@@ -593,13 +777,15 @@ class ForksGUI(Base):
             app_log.info(f"Circle in {figure_key} was plotted")
 
     def change_text(self):
+        fits = self.session.fits
         try:
+            self.build_tab(self.tab7)
             if fits.fitx is None:
-                x_params = np.empty(poly_x+1, dtype=str)
+                x_params = np.empty(self.session.deg_x+1, dtype=str)
             else:
                 x_params = np.flip(fits.fitx)
             if fits.fity is None:
-                y_params = np.empty(poly_y+1, dtype=str)
+                y_params = np.empty(self.session.deg_y+1, dtype=str)
             else:
                 y_params = np.flip(fits.fity)
             if fits.f0 is None:
@@ -629,15 +815,10 @@ class ForksGUI(Base):
         Find a K - coefficient to calibrate sensitivity of locking. r = sqrt(x^2 + y^2) at resonant frequency
         r_max == drive voltage
         """
+        short_sd = self.session.short_sd
+        fits = self.session.fits
         try:
-            if (short_sd.dx_fit is not None) and (short_sd.dy_fit is not None) and (fits.q is not None):
-                x_m = short_sd.dx_fit.max()
-                y_m = short_sd.dy_fit.max()
-                val = np.sqrt(x_m**2 + y_m**2)
-                val1 = fits.q*0.1/val
-                k = val1[0]
-            else:
-                k = None
+            k = pipeline.find_k(short_sd, fits)
         except Exception as ex:
             app_log.error(f"Can not find K: {ex}")
             messagebox.showerror("Error", f"Can not calculate `k`: {ex}")
@@ -669,6 +850,6 @@ if __name__ == "__main__":
     app_log.info("Application has started")
     root = tkinter.Tk()
     my_gui = ForksGUI(root)
-    media = ConcreteMedia(my_gui, fits)
+    media = ConcreteMedia(my_gui, my_gui.session.fits)
     root.mainloop()
     app_log.info("Application has finished")
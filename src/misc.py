@@ -1,14 +1,17 @@
+from __future__ import annotations
 import numpy as np
 from abc import ABC
-import matplotlib as mpl
-mpl.use("TKAgg")
-from typing import Set, Dict, Tuple, List, Optional, NamedTuple, Iterable
-from matplotlib.backends.backend_tkagg import (
-    FigureCanvasTkAgg, NavigationToolbar2Tk)
-from matplotlib.backend_bases import key_press_handler
-from matplotlib.figure import Figure
-from matplotlib.collections import PathCollection
+from typing import Set, Dict, Tuple, Optional, NamedTuple, Iterable, Callable, Sequence, TYPE_CHECKING
 from logger import log_settings
+import models
+from lod import DecimationPyramid, LodScatter, BlitUpdater
+from background import grid_key
+from timing import timed
+if TYPE_CHECKING:
+    # only for annotations of FigEnv, the data classes are used without matplotlib and Tk
+    from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
+    from matplotlib.figure import Figure
+    from matplotlib.collections import PathCollection
 
 #logger
 app_log = log_settings()
@@ -40,28 +43,63 @@ class Base:
         self._mediator = mediator
 
 
+# rows of the column block of SweepData
+sweep_channels = ("X", "Y", "Amplitude", "dx", "dy", "dx_fit", "dy_fit")
+
+
+def _same_view(values: np.ndarray, target: np.ndarray) -> bool:
+    return isinstance(values, np.ndarray) and values.dtype == target.dtype and values.shape == target.shape \
+        and values.strides == target.strides and values.ctypes.data == target.ctypes.data
+
+
+def _channel(name: str) -> property:
+    """
+    Row `name` of the column block of SweepData, None until it is set
+    """
+    row = sweep_channels.index(name)
+
+    def get(self: SweepData) -> Optional[np.ndarray]:
+        return self.block[row] if self.block is not None and name in self.filled else None
+
+    def put(self: SweepData, values: Optional[np.ndarray]) -> None:
+        if values is None:
+            self.filled.discard(name)
+            return
+        if self.block is None or self.block.shape[1] != len(values):
+            raise ValueError(f"{name} of {len(values)} points does not match the sweep")
+        target = self.block[row]
+        # the row itself is not copied (e.g. `sweep.dx = sweep.dx`); np.copyto handles the other overlaps,
+        # e.g. `sweep.X = sweep.X[::-1]`
+        if not _same_view(values, target):
+            np.copyto(target, values, casting="unsafe")
+        self.filled.add(name)
+    return property(get, put, doc=f"{name} row of the column block")
+
+
 class SweepData(object):
     """
     class contains and transforms data from .dat file into np.arrays
+    The lockin channels and the computed curves are rows of one preallocated block, so the
+    corrections write in place and a sweep costs one allocation. Time and Frequency keep their types.
 
     :param X: X [mV] - value from lockin
     :param Y: Y [mV] - value from lockin
     :param Amplitude: X*X + Y*Y  - value from lockin
     :param Frequency: fr [Hz] - value from lockin
     :param Time: UTC time from Labview. really strange. has to apply a conversion factor
+    :param dtype: storage type of the channels, np.float32 halves the memory of a sweep
     """
-    def __init__(self):
-        self.X: Optional[np.ndarray] = None
-        self.Y: Optional[np.ndarray] = None
-        self.Amplitude: Optional[np.ndarray] = None
+    channels = sweep_channels
+    __slots__ = ("dtype", "block", "filled", "Frequency", "Time", "mask", "slider1", "slider2", "max_slider",
+                 "group", "ind_max", "fit_params", "lod", "_grid")
+
+    def __init__(self, dtype: type = np.float64):
+        self.dtype = np.dtype(dtype)
+        self.block: Optional[np.ndarray] = None
+        self.filled: Set[str] = set()
         self.Frequency: Optional[np.ndarray] = None
         self.Time: Optional[np.ndarray] = None
-        self.pid: Optional[np.ndarray] = None
         self.mask: Optional[np.ndarray] = None
-        self.dx: Optional[np.ndarray] = None
-        self.dy: Optional[np.ndarray] = None
-        self.dx_fit: Optional[np.ndarray] = None
-        self.dy_fit: Optional[np.ndarray] = None
         # app_log = log_settings()
         self.slider1: int = 0
         self.slider2: int = 1
@@ -69,37 +107,103 @@ class SweepData(object):
         self.group: Optional[str] = None
         self.ind_max: Optional[int] = None
         self.fit_params: Optional[Tuple] = None
+        self.lod: Dict[str, DecimationPyramid] = dict()
+        self._grid: Optional[str] = None
 
+    @timed("create_data", lambda self, data: len(data))
     def create_data(self, data: np.ndarray) -> None:
         """
         Parse the main data array into separate coordinates.
-        :param data: Data array (Time, Frequency, X, Y, Amplitude, id)
-        """
-        first = True
-        for idx, item in enumerate(data):
-            if first:
-                self.Time = np.array(item[0])
-                self.Frequency = np.array(item[1])
-                self.X = np.array(item[2])
-                self.Y = np.array(item[3])
-                self.Amplitude = np.array(item[4])
-                self.pid = np.array(idx)
-                first = False
-            else:
-                self.Time = np.append(self.Time, item[0])
-                self. Frequency = np.append(self.Frequency, item[1])
-                self.X = np.append(self.X, item[2])
-                self.Y = np.append(self.Y, item[3])
-                self.Amplitude = np.append(self.Amplitude, item[4])
-                self.pid = np.append(self.pid, idx)
-        else:
-            app_log.info("Sweep data were created")
+        The channels are copied into the block, so `data` (e.g. a memory map of the cache) is not kept.
+        :param data: Structured data array (Time, Frequency, X, Y, Amplitude, id) or columns of a binary sweep
+        """
+        self.block = np.empty((len(self.channels), len(data)), dtype=self.dtype)
+        self.filled = set()
+        self.Time = np.array(data["uni_time"])
+        self.Frequency = np.array(data["frequency"])
+        self.X = data["X"]
+        self.Y = data["Y"]
+        self.Amplitude = data["amplitude"]
+        self.lod.clear()
+        self._grid = None
+        app_log.info("Sweep data were created")
+
+    def snapshot(self, channels: Sequence[str] = sweep_channels) -> "SweepData":
+        """
+        Copy of the channels, the frequency and the mask for a worker thread: the Tk thread changes them in place,
+        e.g. by `Slope X`, while the worker runs
+        :param channels: rows of the block to copy, the other rows are not set
+        """
+        copy = SweepData(self.dtype.type)
+        if self.block is not None:
+            copy.block = np.empty_like(self.block)
+            for name in self.filled.intersection(channels):
+                row = sweep_channels.index(name)
+                copy.block[row] = self.block[row]
+                copy.filled.add(name)
+        copy.Frequency = None if self.Frequency is None else self.Frequency.copy()
+        copy.Time = self.Time
+        copy.mask = None if self.mask is None else self.mask.copy()
+        copy.group = self.group
+        return copy
+
+    def require(self, name: str) -> np.ndarray:
+        """
+        Channel, Frequency or mask which must be set already, e.g. `sweep.require("dx")`
+        :raise: AttributeError if it is not set yet
+        """
+        values = getattr(self, name)
+        if values is None:
+            raise AttributeError(f"{name} of the {self.group or ''} sweep is not set")
+        return values
+
+    X = _channel("X")
+    Y = _channel("Y")
+    Amplitude = _channel("Amplitude")
+    dx = _channel("dx")
+    dy = _channel("dy")
+    dx_fit = _channel("dx_fit")
+    dy_fit = _channel("dy_fit")
+
+    @property
+    def pid(self) -> Optional[np.ndarray]:
+        """
+        Point numbers, made on request
+        """
+        return None if self.Frequency is None else np.arange(len(self.Frequency))
+
+    @property
+    def grid_key(self) -> str:
+        """
+        Identity of the frequency grid for the cache of baselines, computed once per data
+        """
+        if self._grid is None:
+            self._grid = grid_key(self.require("Frequency"))
+        return self._grid
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Memory of the arrays of the sweep
+        """
+        return sum(arr.nbytes for arr in (self.block, self.Frequency, self.Time, self.mask) if arr is not None)
 
     def update_deltax(self, delta: np.ndarray):
         self.dx = delta
+        self.lod.pop("dx", None)
 
     def update_deltay(self, delta: np.ndarray):
         self.dy = delta
+        self.lod.pop("dy", None)
+
+    def get_lod(self, channel: str) -> DecimationPyramid:
+        """
+        Decimation pyramid of the channel ("X", "Y", "dx", "dy") vs Frequency for plots.
+        Built once and dropped when the channel changes.
+        """
+        if channel not in self.lod:
+            self.lod[channel] = DecimationPyramid(self.require("Frequency"), self.require(channel))
+        return self.lod[channel]
 
     def create_mask(self) -> None:
         """
@@ -114,61 +218,54 @@ class SweepData(object):
         else:
             app_log.warning("You should import a data file first")
 
-    def update_y_tail(self, idm: np.ndarray, delta: float) -> None:
+    def update_y_tail(self, idm: int, delta: float) -> None:
         """
-        FIxes the Y tail and updates whole Y array
+        FIxes the Y tail in place
         :param idm: Index of the jump value
         :param delta: Jump of the Y value
-        :num: points to cut around jump
         """
-        num = 10
         if (self.Y is not None) and (self.Frequency is not None):
             try:
-                part1 = np.add(self.Y[0:idm], delta)
-                self.Y = np.concatenate((part1, self.Y[idm:]))
+                self.Y[0:idm] += delta
+                self.lod.pop("Y", None)
             except Exception as ex:
                 app_log.error(f"y-tail fails: {ex}")
             else:
-                app_log.info(f"ytail concentrated {len(self.Frequency)} vs {len(self.Y)}")
+                app_log.info(f"ytail is fixed at {idm} of {len(self.Y)} points")
 
     @staticmethod
-    def chan_x(f: np.float, f0: np.float, q: np.float, a: np.float) -> np.float:
+    def chan_x(f: np.ndarray, f0: float, q: float, a: float) -> np.ndarray:
         """
         The theory curve of X-channel on resonant curve
-        :param f: independent var in this case - frequency
+        :param f: independent var in this case - frequency, scalar or array
         :param f0: resonant frequency
         :param q: q-factor of the resonance curve
         :param a: amplitude
         :return res: the value obtained on X channel
         """
-        f = np.float(f)
-        f0 = np.float(f0)
-        q = np.float(q)
-        a = np.float(a)
-        top = a*f*f0/q
-        bot1 = (f**2 - f0**2)**2
-        bot2 = f**2 * f0**2/q**2
-        res = top/(bot1+bot2)
-        return np.float(res)
+        return models.chan_x(f, f0, q, a)
 
     @staticmethod
-    def chan_y(f: float, f0: float, q: float, a: float) -> float:
+    def chan_y(f: np.ndarray, f0: float, q: float, a: float) -> np.ndarray:
         """
         The theory curve of Y-channel on resonant curve
-        :param f: independent var in this case - frequency
+        :param f: independent var in this case - frequency, scalar or array
         :param f0: resonant frequency
         :param q: q-factor of the resonance curve
         :param a: amplitude
         :return y: the value obtained on Y channel
         """
-        return -a*((f*f - f0*f0)/((f*f - f0*f0)**2+(f*f*f0*f0/(q*q))))
+        return models.chan_y(f, f0, q, a)
 
     def gen_fit_x(self, f0: float, q: float, a: float) -> None:
         """
         Generate the theory X values
         """
         if (self.dx is not None) and (self.Frequency is not None):
-            self.dx_fit = np.array([self.chan_x(ii, f0, q, a) for ii in self.Frequency])
+            # float32 rows are filled from a float64 result, (f^2 - f0^2) needs the double precision
+            out = self.block[self.channels.index("dx_fit")] \
+                if self.block is not None and self.dtype == np.float64 else None
+            self.dx_fit = models.chan_x(self.Frequency, f0, q, a, out=out)
         else:
             app_log.warning(f"Short sweep or fit of wide sweep is not performed")
 
@@ -177,15 +274,18 @@ class SweepData(object):
         Generate the theory Y values
         """
         if (self.dy is not None) and (self.Frequency is not None):
-            self.dy_fit = np.array([self.chan_y(ii, f0, q, a) for ii in self.Frequency])
+            out = self.block[self.channels.index("dy_fit")] \
+                if self.block is not None and self.dtype == np.float64 else None
+            self.dy_fit = models.chan_y(self.Frequency, f0, q, a, out=out)
         else:
             app_log.warning(f"Short sweep or fit of wide sweep is not performed")
 
     def fun_fit_x(self, x: np.ndarray, f0: float, q: float, a: float) -> np.ndarray:
         """
-        Fitting function for X-channel
+        Fitting function for X-channel.
+        Returns a new array each call: curve_fit keeps the previous result for finite differences.
         """
-        return np.array([self.chan_x(ii, f0, q, a) for ii in x])
+        return models.chan_x(x, f0, q, a)
 
     def set_fit_params(self, popt: Iterable):
         """
@@ -209,6 +309,10 @@ class FigEnv(object):
     :param __scat: scatter object for plot (raw)
     :param __pltt: plot object for plot (fit)
     :param __polk: group attribute, Wide, Short, maybe fit. etc
+    :param __lod_scat: decimated data of `scat`
+    :param __lod_pltt: decimated data of `pltt`
+    :param __blit: blitting of the artists changed by sliders
+    :param __toolbar: navigation toolbar of the canvas
     """
     def __init__(self):
         self.__canvas: Optional[FigureCanvasTkAgg] = None
@@ -220,6 +324,10 @@ class FigEnv(object):
         self.__py: int = 4
         self.__scat: Optional[PathCollection] = None
         self.__pltt: Optional[PathCollection] = None
+        self.__lod_scat: Optional[LodScatter] = None
+        self.__lod_pltt: Optional[LodScatter] = None
+        self.__blit: Optional[BlitUpdater] = None
+        self.__toolbar: Optional[NavigationToolbar2Tk] = None
 
     @property
     def canvas(self) -> FigureCanvasTkAgg:
@@ -293,6 +401,58 @@ class FigEnv(object):
     def pltt(self, pltt: PathCollection) -> None:
         self.__pltt = pltt
 
+    @property
+    def lod_scat(self) -> Optional[LodScatter]:
+        return self.__lod_scat
+
+    @lod_scat.setter
+    def lod_scat(self, lod: Optional[LodScatter]) -> None:
+        if self.__lod_scat is not None:
+            self.__lod_scat.disconnect()
+        self.__lod_scat = lod
+
+    @property
+    def lod_pltt(self) -> Optional[LodScatter]:
+        return self.__lod_pltt
+
+    @lod_pltt.setter
+    def lod_pltt(self, lod: Optional[LodScatter]) -> None:
+        if self.__lod_pltt is not None:
+            self.__lod_pltt.disconnect()
+        self.__lod_pltt = lod
+
+    @property
+    def blit(self) -> Optional[BlitUpdater]:
+        return self.__blit
+
+    @blit.setter
+    def blit(self, blit: Optional[BlitUpdater]) -> None:
+        if self.__blit is not None:
+            self.__blit.disconnect()
+        self.__blit = blit
+
+    @property
+    def toolbar(self) -> Optional[NavigationToolbar2Tk]:
+        return self.__toolbar
+
+    @toolbar.setter
+    def toolbar(self, toolbar: Optional[NavigationToolbar2Tk]) -> None:
+        self.__toolbar = toolbar
+
+
+class LazyDict(dict):
+    """
+    Dictionary which creates a missing value on the first access.
+    :param factory: called with the missing key, must insert it into the dictionary
+    """
+    def __init__(self, factory: Callable[[str], None]) -> None:
+        super().__init__()
+        self.factory = factory
+
+    def __missing__(self, key: str):
+        self.factory(key)
+        return dict.__getitem__(self, key)
+
 
 class FigureGroup(NamedTuple):
     """
@@ -432,7 +592,7 @@ class FitParams(Base):
         return self.__k
 
     @k.setter
-    def k(self, vals: float) -> None:
+    def k(self, vals: Optional[float]) -> None:
         try:
             self.__k = np.array([vals])
         except Exception as ex:
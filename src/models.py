@@ -0,0 +1,67 @@
+"""
+Array-native resonance curves of the fork. All functions work on the whole frequency vector
+and can write into preallocated buffers `out` and `work` of the same shape as `f`.
+"""
+from typing import Optional
+import numpy as np
+
+
+def _buffers(f: np.ndarray, out: Optional[np.ndarray], work: Optional[np.ndarray]):
+    f = np.asarray(f, dtype=float)
+    if out is None:
+        out = np.empty_like(f)
+    if work is None:
+        work = np.empty_like(f)
+    return f, out, work
+
+
+def denominator(f: np.ndarray, f0: float, q: float, out: np.ndarray, work: np.ndarray) -> np.ndarray:
+    """
+    (f^2 - f0^2)^2 + f^2*f0^2/q^2 written into `out`. `work` is overwritten.
+    """
+    np.multiply(f, f, out=work)
+    np.subtract(work, f0*f0, out=out)
+    np.square(out, out=out)
+    work *= f0*f0/(q*q)
+    out += work
+    return out
+
+
+def chan_x(f: np.ndarray, f0: float, q: float, a: float,
+           out: Optional[np.ndarray] = None, work: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    The theory curve of X-channel on resonant curve
+    :param f: independent var in this case - frequency
+    :param f0: resonant frequency
+    :param q: q-factor of the resonance curve
+    :param a: amplitude
+    :param out: optional buffer for the result
+    :param work: optional buffer for intermediate values
+    :return out: the values obtained on X channel
+    """
+    f, out, work = _buffers(f, out, work)
+    denominator(f, f0, q, out, work)
+    np.divide(f, out, out=out)
+    out *= a*f0/q
+    return out
+
+
+def chan_y(f: np.ndarray, f0: float, q: float, a: float,
+           out: Optional[np.ndarray] = None, work: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    The theory curve of Y-channel on resonant curve
+    :param f: independent var in this case - frequency
+    :param f0: resonant frequency
+    :param q: q-factor of the resonance curve
+    :param a: amplitude
+    :param out: optional buffer for the result
+    :param work: optional buffer for intermediate values
+    :return out: the values obtained on Y channel
+    """
+    f, out, work = _buffers(f, out, work)
+    denominator(f, f0, q, out, work)
+    np.multiply(f, f, out=work)
+    work -= f0*f0
+    np.divide(work, out, out=out)
+    out *= -a
+    return out
@@ -0,0 +1,471 @@
+"""
+Computation steps of the feedthrough calculation without GUI.
+The same steps are called from the buttons of ForksGUI and from the batch processing.
+"""
+from typing import Callable, Dict, NamedTuple, Optional, Sequence, Tuple, cast
+import numpy as np
+
+from logger import log_settings
+from loader import load_sweep, iter_chunks
+from cache import load_cached
+import sweepfile
+from misc import SweepData, FitParams
+from fitting import fit_resonance, FitResult
+import corrections
+from background import background_cache
+from timing import stage, timed
+
+#logger
+app_log = log_settings()
+
+poly_x = 3
+poly_y = 4
+# robust fit of the wide sweep: residuals over clip_sigma are clipped, over huber_k are down-weighted
+clip_sigma = 3.0
+huber_k = 1.345
+
+
+class WideFit(NamedTuple):
+    """
+    Robust fit of the wide sweep
+    Attributes:
+        :param fitx: polynomial of X, highest power first
+        :param fity: polynomial of Y, highest power first
+        :param mask: points which are not outliers, i.e. outside of the resonance
+        :param iterations: number of reweighting iterations
+    """
+    fitx: np.ndarray
+    fity: np.ndarray
+    mask: np.ndarray
+    iterations: int
+
+
+def open_sweep(path: str, group: str, cached: bool = True, dtype: type = np.float64) -> SweepData:
+    """
+    Reads the .dat file into a new SweepData
+    :param path: path to the .dat file or to the binary sweep
+    :param group: "wide" or "short"
+    :param cached: use the binary cache of parsed .dat files
+    :param dtype: storage type of the channels, np.float32 for many open sweeps
+    """
+    sweep = SweepData(dtype)
+    sweep.create_data(load_cached(path) if cached or sweepfile.is_sweep_file(path) else load_sweep(path))
+    sweep.create_mask()
+    sweep.group = group
+    return sweep
+
+
+def exclude_range(sweep: SweepData, f_min: float, f_max: float) -> None:
+    """
+    Excludes the frequency region [f_min, f_max] (resonance) from the fit of the wide sweep.
+    Headless analog of the sliders on the first tab.
+    """
+    freq = sweep.require("Frequency")
+    sweep.mask = (freq < f_min) | (freq > f_max)
+
+
+def fit_wide(sweep: SweepData, fits: FitParams, deg_x: int = poly_x, deg_y: int = poly_y) -> None:
+    """
+    Fit the wide sweep. X with poly of 3, Y with poly of 4. Using mask
+    """
+    fits.fitx, fits.fity = wide_coefficients(sweep, deg_x, deg_y)
+
+
+def wide_coefficients(sweep: SweepData, deg_x: int = poly_x, deg_y: int = poly_y,
+                      mask: Optional[np.ndarray] = None,
+                      check: Optional[Callable[[], None]] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Polynomials of the wide sweep without changing FitParams, e.g. in a worker thread.
+    :param mask: points to fit, the mask of the sweep by default
+    :param check: called before the fit of each channel, its exception stops the fit, e.g. `TaskCancelled`
+    """
+    mask = sweep.require("mask") if mask is None else mask
+    freq = sweep.require("Frequency")[mask]
+    with stage("fit_wide", int(np.count_nonzero(mask))):
+        coefs = []
+        for channel, deg in (("X", deg_x), ("Y", deg_y)):
+            if check is not None:
+                check()
+            coefs.append(scaled_polyfit(freq, sweep.require(channel)[mask], deg))
+        return coefs[0], coefs[1]
+
+
+def fit_wide_robust(sweep: SweepData, fits: FitParams, method: str = "clip", deg_x: int = poly_x,
+                    deg_y: int = poly_y) -> WideFit:
+    """
+    Fit of the wide sweep with the automatic exclusion of the resonance.
+    Points already excluded by the mask stay excluded; the mask is replaced by the found inliers.
+    """
+    res = robust_coefficients(sweep, deg_x, deg_y, method, sweep.mask)
+    fits.fitx, fits.fity = res.fitx, res.fity
+    sweep.mask = res.mask
+    app_log.info(f"Robust fit ({method}) of wide sweep: {int(np.count_nonzero(~res.mask))} points excluded "
+                 f"after {res.iterations} iterations")
+    return res
+
+
+@timed("fit_wide_robust", lambda sweep, *args, **kwargs: len(sweep.Frequency),
+       lambda res: {"iterations": res.iterations})
+def robust_coefficients(sweep: SweepData, deg_x: int = poly_x, deg_y: int = poly_y, method: str = "clip",
+                        mask: Optional[np.ndarray] = None, max_iter: int = 30,
+                        check: Optional[Callable[[], None]] = None) -> WideFit:
+    """
+    Polynomials of the wide sweep which ignore the resonance without the sliders.
+    "clip": iterative sigma clipping, points with |residual| > clip_sigma * sigma in X or in Y are excluded.
+    "huber": iteratively reweighted least squares with the Huber weights min(1, huber_k * sigma / |residual|).
+    sigma is estimated by the median absolute deviation, so the resonance does not inflate it.
+    :param method: "clip" or "huber"
+    :param mask: points to fit at most, all points by default
+    :param max_iter: maximum number of iterations
+    :param check: called before every polynomial fit, its exception stops the fit, e.g. `TaskCancelled`
+    :raise: ValueError
+    """
+    if method not in ("clip", "huber"):
+        raise ValueError(f"Unknown robust method `{method}`")
+    freq = np.asarray(sweep.Frequency, dtype=float)
+    base = np.ones(len(freq), dtype=bool) if mask is None else np.asarray(mask, dtype=bool)
+    channels = ((np.asarray(sweep.X, dtype=float), deg_x), (np.asarray(sweep.Y, dtype=float), deg_y))
+    inliers = base.copy()
+    weights = [base.astype(float), base.astype(float)]
+    coefs = [np.zeros(deg_x + 1), np.zeros(deg_y + 1)]
+    iterations = 0
+    for iterations in range(1, max_iter + 1):
+        if np.count_nonzero(inliers) <= max(deg_x, deg_y):
+            raise ValueError("Robust fit excludes all points of the wide sweep")
+        new_inliers = base.copy()
+        converged = True
+        for idx, (values, deg) in enumerate(channels):
+            if check is not None:
+                check()
+            if method == "clip":
+                coef = scaled_polyfit(freq[inliers], values[inliers], deg)
+            else:
+                used = weights[idx] > 0
+                coef = scaled_polyfit(freq[used], values[used], deg, np.sqrt(weights[idx][used]))
+            resid = values - np.polyval(coef, freq)
+            sigma = robust_sigma(resid[base])
+            dev = np.abs(resid)
+            new_inliers &= dev <= clip_sigma * sigma
+            if method == "huber":
+                limit = huber_k * sigma
+                weights[idx] = np.where(dev <= limit, 1.0, limit / np.maximum(dev, limit)) * base
+                # the curve changes less than 1e-6 of the noise
+                shift = np.max(np.abs(np.polyval(coef - coefs[idx], freq[base])))
+                converged &= bool(shift <= 1e-6 * sigma)
+            coefs[idx] = coef
+        if method == "clip":
+            converged = np.array_equal(new_inliers, inliers)
+        inliers = new_inliers
+        if converged:
+            break
+    else:
+        app_log.warning(f"Robust fit ({method}) of wide sweep does not converge after {max_iter} iterations")
+    return WideFit(coefs[0], coefs[1], inliers, iterations)
+
+
+def robust_sigma(resid: np.ndarray) -> float:
+    """
+    Standard deviation of the normal noise estimated by the median absolute deviation
+    """
+    sigma = 1.4826 * float(np.median(np.abs(resid - np.median(resid))))
+    return sigma if sigma > 0 else float(np.std(resid))
+
+
+class PolyAccumulator(object):
+    """
+    Least squares polynomial fit updated chunk by chunk with a bounded memory.
+    Keeps only the triangular factor R of the QR decomposition of [Vandermonde | y].
+    Frequency is centered and scaled as t = (f - center)/scale for a better conditioning.
+    :param deg: degree of the polynomial
+    :param center: center of the frequency range
+    :param scale: half width of the frequency range
+    """
+    def __init__(self, deg: int, center: float, scale: float) -> None:
+        self.deg = deg
+        self.center = center
+        self.scale = scale if scale > 0 else 1.0
+        self.r: Optional[np.ndarray] = None
+        self.count = 0
+
+    def update(self, f: np.ndarray, y: np.ndarray) -> None:
+        """
+        Adds the points of a chunk
+        """
+        t = (np.asarray(f, dtype=float) - self.center) / self.scale
+        block = np.column_stack((np.vander(t, self.deg + 1), y))
+        if self.r is not None:
+            block = np.vstack((self.r, block))
+        # mode "r" returns only the array R, not the (Q, R) result of the stubs
+        self.r = cast(np.ndarray, np.linalg.qr(block, mode="r"))
+        self.count += len(t)
+
+    def solve(self) -> np.ndarray:
+        """
+        Coefficients of the polynomial in f, highest power first as np.polyfit
+        """
+        if self.r is None or self.count <= self.deg:
+            raise ValueError(f"Not enough points for the polynomial of degree {self.deg}")
+        num = self.deg + 1
+        coef_t = np.linalg.solve(self.r[:num, :num], self.r[:num, num])
+        return unscale_poly(coef_t, self.center, self.scale)
+
+
+def unscale_poly(coef: np.ndarray, center: float, scale: float) -> np.ndarray:
+    """
+    Converts the polynomial in t = (f - center)/scale into the polynomial in f
+    """
+    return np.poly1d(coef)(np.poly1d([1.0 / scale, -center / scale])).coeffs
+
+
+def scaled_polyfit(f: np.ndarray, y: np.ndarray, deg: int, weights: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    np.polyfit on the centered and scaled frequency t = (f - center)/scale.
+    Powers of raw frequencies of 32 kHz make the Vandermonde matrix ill-conditioned.
+    :param weights: optional weights of the residuals as in np.polyfit
+    :return coef: polynomial in f, highest power first as FitParams.fitx/fity
+    """
+    f = np.asarray(f, dtype=float)
+    f_min, f_max = float(np.min(f)), float(np.max(f))
+    center = (f_max + f_min) / 2
+    scale = (f_max - f_min) / 2 if f_max > f_min else 1.0
+    coef_t = np.polyfit((f - center) / scale, y, deg, w=weights)
+    return unscale_poly(coef_t, center, scale)
+
+
+def frequency_range(path: str, chunk_rows: int = 1_000_000) -> Tuple[float, float]:
+    """
+    Minimum and maximum frequency of a sweep file without loading it. A binary sweep has them in its header,
+    a .dat file is read once by chunks.
+    :raise: ValueError if the file does not contain data
+    """
+    if sweepfile.is_sweep_file(path):
+        header = sweepfile.read_header(path)
+        return header.f_min, header.f_max
+    f_min, f_max = np.inf, -np.inf
+    for chunk in iter_chunks(path, chunk_rows):
+        f_min = min(f_min, float(chunk["frequency"].min()))
+        f_max = max(f_max, float(chunk["frequency"].max()))
+    if f_min > f_max:
+        raise ValueError(f"File {path} does not contain data")
+    return f_min, f_max
+
+
+def fit_wide_stream(path: str, fits: FitParams, exclude: Optional[Sequence[float]] = None,
+                    chunk_rows: int = 1_000_000, deg_x: int = poly_x, deg_y: int = poly_y) -> int:
+    """
+    Fit of the wide sweep file read by chunks, for files larger than memory.
+    The frequency is scaled by the range of the whole file, a chunk of a chronological file may cover
+    a few frequencies only. A .dat file is therefore read twice, a binary sweep once.
+    :param path: .dat file or binary sweep of the wide sweep
+    :param fits: FitParams to store the polynomials
+    :param exclude: frequency region (f_min, f_max) excluded from the fit
+    :param chunk_rows: number of records in memory
+    :return count: number of fitted points
+    """
+    f_min, f_max = frequency_range(path, chunk_rows)
+    acc_x = PolyAccumulator(deg_x, (f_max + f_min) / 2, (f_max - f_min) / 2)
+    acc_y = PolyAccumulator(deg_y, (f_max + f_min) / 2, (f_max - f_min) / 2)
+    chunks = sweepfile.iter_records(path, chunk_rows) if sweepfile.is_sweep_file(path) else iter_chunks(path, chunk_rows)
+    for chunk in chunks:
+        freq = chunk["frequency"]
+        mask = np.ones(len(chunk), dtype=bool) if exclude is None \
+            else (freq < exclude[0]) | (freq > exclude[1])
+        acc_x.update(freq[mask], chunk["X"][mask])
+        acc_y.update(freq[mask], chunk["Y"][mask])
+    fits.fitx = acc_x.solve()
+    fits.fity = acc_y.solve()
+    app_log.info(f"Wide sweep {path} was fitted by chunks: {acc_x.count} points")
+    return acc_x.count
+
+
+def subtract(sweep: SweepData, fits: FitParams) -> None:
+    """
+    Subtracts the background of the wide sweep from X and Y
+    :raise: AttributeError if the wide sweep is not fitted yet
+    """
+    if fits.fitx is None or fits.fity is None:
+        raise AttributeError("Fit of the wide sweep is not performed")
+    freq = sweep.require("Frequency")
+    with stage("subtract", len(freq)):
+        sweep.update_deltax(np.subtract(sweep.require("X"), background_cache.evaluate(fits.fitx, freq, sweep.grid_key)))
+        sweep.update_deltay(np.subtract(sweep.require("Y"), background_cache.evaluate(fits.fity, freq, sweep.grid_key)))
+
+
+def slope_x(sweep: SweepData, nums: Optional[int] = None) -> float:
+    """
+    Slope of dX between both sides of the resonance.
+    nums: number of points for mean function, proportional to the sweep length by default
+    """
+    dx = sweep.require("dx")
+    nums = corrections.scaled_windows(len(dx)).mean if nums is None else nums
+    val, sweep.ind_max = corrections.slope(sweep.require("Frequency"), dx, nums)
+    return val
+
+
+def intersect_x(sweep: SweepData, num: Optional[int] = None) -> float:
+    """
+    Shift of dX to move the whole graph under the X-axis.
+    :num: Number of points from the begin and end to cut and analyze, proportional to the sweep length by default
+    """
+    num = corrections.scaled_windows(len(sweep.dx)).mean if num is None else num
+    return corrections.intersect_x(sweep.dx, num)
+
+
+def intersect_y(sweep: SweepData) -> float:
+    """
+    Shift of dY to center it between its maximum and minimum
+    """
+    return corrections.intersect_y(sweep.dy)
+
+
+def y_tail(sweep: SweepData, num: Optional[int] = None, wind: Optional[int] = None,
+           poly: int = corrections.savgol_poly) -> Tuple[int, float]:
+    """
+    Fix the jump on the short sweep in Y channel.
+    :num: is used for cutting +-
+    :wind:poly: window and poly value for Savitsky-Golay filtering
+    num and wind are proportional to the sweep length by default
+    :return: index and value of the jump
+    """
+    win = corrections.scaled_windows(len(sweep.Y))
+    prob, delta = corrections.tail_jump(sweep.Y, win.cut if num is None else num,
+                                        win.savgol if wind is None else wind, poly)
+    sweep.update_y_tail(prob, delta)
+    return prob, delta
+
+
+def correct(sweep: SweepData, fits: FitParams, fix_tail: bool = False) -> corrections.Corrections:
+    """
+    Y tail, Slope X, Intersect X and Intersect Y in one pass. The results are stored
+    into the sweep and the polynomials, the caller redraws once.
+    :raise: AttributeError if the wide sweep is not fitted yet
+    """
+    if fits.fitx is None or fits.fity is None:
+        raise AttributeError("Fit of the wide sweep is not performed")
+    freq = sweep.require("Frequency")
+    with stage("correct", len(freq), fix_tail=fix_tail):
+        res = corrections.correct_short(freq, sweep.require("X"), sweep.require("Y"), fits.fitx, fits.fity, fix_tail,
+                                        base_x=background_cache.evaluate(fits.fitx, freq, sweep.grid_key),
+                                        base_y=background_cache.evaluate(fits.fity, freq, sweep.grid_key))
+    if res.tail is not None:
+        sweep.update_y_tail(res.tail[0], res.tail[1])
+    fits.update_slope_x(res.slope_x)
+    fits.update_intersect_x(res.intersect_x)
+    fits.update_intersect_y(res.intersect_y)
+    sweep.ind_max = res.ind_max
+    sweep.update_deltax(res.dx)
+    sweep.update_deltay(res.dy)
+    return res
+
+
+def fit_short(sweep: SweepData, fits: FitParams, a: float = 10000, q: float = 30.0) -> FitResult:
+    """
+    Performs the joint fit of dX and dY and generates the theory curves
+    """
+    res = fit_resonance(sweep.require("Frequency"), sweep.require("dx"), sweep.require("dy"),
+                        initial_guess(sweep, a, q), max_nfev=10000, tol=0.00005)
+    apply_fit(sweep, fits, res)
+    return res
+
+
+def fit_short_warm(sweep: SweepData, fits: FitParams, p0: Optional[Sequence[float]] = None) -> FitResult:
+    """
+    Joint fit started from (f0, q, a) of the previous sweep, e.g. along a temperature ramp.
+    A diverged warm start is repeated from the cold guess of `fit_short`; nfev counts both fits.
+    :param p0: result of the previous sweep, cold start if None
+    """
+    if p0 is not None:
+        warm = fit_resonance(sweep.require("Frequency"), sweep.require("dx"), sweep.require("dy"), p0,
+                             max_nfev=10000, tol=0.00005)
+        if not diverged(sweep, warm):
+            apply_fit(sweep, fits, warm)
+            return warm._replace(warm=True)
+        app_log.info(f"Warm start from {tuple(p0)} diverges, the fit is repeated from the cold start")
+        res = fit_short(sweep, fits)
+        return res._replace(nfev=res.nfev + warm.nfev)
+    return fit_short(sweep, fits)
+
+
+def diverged(sweep: SweepData, res: FitResult) -> bool:
+    """
+    True if the fit does not converge or its resonance is outside of the sweep
+    """
+    freq = sweep.require("Frequency")
+    return not res.success or res.q <= 0 or not np.isfinite(res.cost) \
+        or not (np.min(freq) <= res.f0 <= np.max(freq))
+
+
+def initial_guess(sweep: SweepData, a: float = 10000, q: float = 30.0) -> Tuple[float, float, float]:
+    """
+    Initial (f0, q, a) of the resonance fit. f0 from the maximum of dX found by `slope_x`
+    """
+    if sweep.ind_max is not None:
+        f0 = sweep.require("Frequency")[sweep.ind_max]
+    else:
+        f0 = 32000
+    return float(f0), q, a
+
+
+def apply_fit(sweep: SweepData, fits: FitParams, res: FitResult) -> None:
+    """
+    Stores the result of the resonance fit and generates the theory curves
+    """
+    if not res.success:
+        app_log.warning(f"Fit does not converge after {res.nfev} evaluations")
+    sweep.set_fit_params((res.f0, res.q, res.a))
+    sweep.gen_fit_x(res.f0, res.q, res.a)
+    sweep.gen_fit_y(res.f0, res.q, res.a)
+    fits.f0 = res.f0
+    fits.q = res.q
+
+
+def find_k(sweep: SweepData, fits: FitParams) -> Optional[float]:
+    """
+    Find a K - coefficient to calibrate sensitivity of locking. r = sqrt(x^2 + y^2) at resonant frequency
+    r_max == drive voltage
+    """
+    if (sweep.dx_fit is not None) and (sweep.dy_fit is not None) and (fits.q is not None):
+        val = np.sqrt(sweep.dx_fit.max()**2 + sweep.dy_fit.max()**2)
+        return (fits.q*0.1/val)[0]
+    return None
+
+
+def copy_background(fits: FitParams) -> FitParams:
+    """
+    New FitParams with a copy of the wide sweep polynomials. The corrections of a short sweep
+    change the coefficients in place, so every short sweep starts from its own copy.
+    """
+    new = FitParams()
+    new.fitx = np.array(fits.fitx, dtype=float)
+    new.fity = np.array(fits.fity, dtype=float)
+    return new
+
+
+def process_short(sweep: SweepData, fits: FitParams, fix_tail: bool = False,
+                  p0: Optional[Sequence[float]] = None) -> FitResult:
+    """
+    All the steps of the short sweep in the order of the GUI buttons:
+    Y tail, Slope X, Intersect X, Intersect Y, Fit both channels, K.
+    :param sweep: short sweep
+    :param fits: background of the wide sweep, changed in place
+    :param fix_tail: fix the jump of the Y channel
+    :param p0: (f0, q, a) of the previous sweep to warm start the fit
+    """
+    correct(sweep, fits, fix_tail)
+    res = fit_short_warm(sweep, fits, p0)
+    fits.k = find_k(sweep, fits)
+    return res
+
+
+def fit_table(fits: FitParams) -> Dict[str, float]:
+    """
+    Fit parameters as in the "Fit parameters" tab: x0..x3, y0..y4, f0, Q, K
+    """
+    row: Dict[str, float] = dict()
+    if fits.fitx is not None:
+        row.update({f"x{idx}": float(val) for idx, val in enumerate(np.flip(fits.fitx))})
+    if fits.fity is not None:
+        row.update({f"y{idx}": float(val) for idx, val in enumerate(np.flip(fits.fity))})
+    for name, val in (("f0", fits.f0), ("Q", fits.q), ("K", fits.k)):
+        row[name] = float(val[0]) if val is not None and val[0] is not None else float("nan")
+    return row
@@ -0,0 +1,246 @@
+"""
+Local HTTP/JSON service of the feedthrough fit for the measurement software. Example:
+    python server.py --port 8765 --jobs 4
+    curl -d '{"wide": "wide.dat", "short": "short.dat"}' http://127.0.0.1:8765/fit
+The server listens on the loopback interface only.
+"""
+import argparse
+import json
+import math
+import os
+import socket
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+from logger import log_settings
+from loader import kerneldt
+from session import Session
+
+#logger
+app_log = log_settings()
+
+loopback = ("127.0.0.1", "localhost", "::1")
+
+
+class ThreadingHTTPServer6(ThreadingHTTPServer):
+    address_family = socket.AF_INET6
+
+
+def to_json(value: Any) -> Any:
+    """
+    Replaces NaN and infinities, e.g. K of a failed fit, by None: bare NaN is not valid JSON
+    """
+    if isinstance(value, dict):
+        return {key: to_json(val) for key, val in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_json(val) for val in value]
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+
+def to_records(payload: Dict) -> np.ndarray:
+    """
+    Structured `kerneldt` array of the raw arrays of a request: "frequency", "X", "Y" and optional "time"
+    :raise: ValueError
+    """
+    freq = np.asarray(payload["frequency"], dtype=float)
+    x = np.asarray(payload["X"], dtype=float)
+    y = np.asarray(payload["Y"], dtype=float)
+    if freq.ndim != 1 or len(freq) != len(x) or len(freq) != len(y):
+        raise ValueError("frequency, X and Y must be arrays of the same length")
+    data = np.zeros(len(freq), dtype=kerneldt)
+    data["frequency"] = freq
+    data["X"] = x
+    data["Y"] = y
+    data["amplitude"] = x * x + y * y
+    data["id"] = np.arange(len(freq))
+    if "time" in payload:
+        data["uni_time"] = np.asarray(payload["time"], dtype=np.int64)
+    return data
+
+
+def fit_short(fitx: np.ndarray, fity: np.ndarray, request: Dict) -> Dict:
+    """
+    Short sweep steps of one request, runs in a worker process.
+    :param request: "short" path or raw arrays, optional "fix_tail" and "p0" = (f0, Q, A)
+    :return row: convergence, start, time and the fit parameters
+    """
+    start = time.perf_counter()
+    session = Session.from_background(fitx, fity, request.get("short", "payload"))
+    if "short" in request:
+        session.open_short(request["short"])
+    else:
+        session.set_short(to_records(request))
+    res = session.process_short(bool(request.get("fix_tail", False)), request.get("p0"))
+    row = {"success": res.success, "nfev": res.nfev, "start": "warm" if res.warm else "cold"}
+    row.update(session.table())
+    row["A"] = res.a
+    row["seconds"] = time.perf_counter() - start
+    return row
+
+
+class FitService(object):
+    """
+    Fits of the wide sweeps cached by file and options, the short sweeps go to a pool of processes.
+    :param jobs: number of worker processes, 1 to fit in the thread of the request
+    :param max_backgrounds: number of wide sweep fits in memory, the least recently used are dropped
+    """
+    def __init__(self, jobs: int = 1, max_backgrounds: int = 256) -> None:
+        self.jobs = jobs
+        self.max_backgrounds = max_backgrounds
+        self.pool: Optional[ProcessPoolExecutor] = ProcessPoolExecutor(max_workers=jobs) if jobs > 1 else None
+        self.backgrounds: "OrderedDict[Tuple, Tuple[np.ndarray, np.ndarray]]" = OrderedDict()
+        # one lock per wide sweep: a fit of one wide sweep does not block the requests of the others
+        self.key_locks: Dict[Tuple, threading.Lock] = dict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def background_key(path: str, exclude: Optional[Sequence[float]], robust: Optional[str]) -> Tuple:
+        """
+        A changed file (size or mtime) is fitted again
+        """
+        stat = os.stat(path)
+        return (os.path.abspath(path), stat.st_size, stat.st_mtime_ns,
+                tuple(exclude) if exclude is not None else None, robust)
+
+    def background(self, path: str, exclude: Optional[Sequence[float]] = None,
+                   robust: Optional[str] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Polynomials of the wide sweep, fitted on the first request. Concurrent first requests of the same
+        wide sweep wait for one fit. A fit dropped from memory is taken from the background cache of the session.
+        """
+        key = self.background_key(path, exclude, robust)
+        with self.lock:
+            coefs = self.backgrounds.get(key)
+            if coefs is not None:
+                self.backgrounds.move_to_end(key)
+                return coefs
+            key_lock = self.key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            with self.lock:
+                coefs = self.backgrounds.get(key)
+            if coefs is None:
+                session = Session(path)
+                session.open_wide(path)
+                session.fit_wide(exclude, robust)
+                assert session.background is not None
+                coefs = session.background
+                with self.lock:
+                    self.backgrounds[key] = coefs
+                    while len(self.backgrounds) > self.max_backgrounds:
+                        self.backgrounds.popitem(last=False)
+        with self.lock:
+            # the waiters of this fit hold the lock already, later requests find the fit
+            if self.key_locks.get(key) is key_lock:
+                del self.key_locks[key]
+        return coefs
+
+    def fit(self, request: Dict) -> Dict:
+        """
+        Wide sweep background and the fit of the short sweep of a request
+        :raise: KeyError, ValueError, OSError
+        """
+        fitx, fity = self.background(request["wide"], request.get("exclude"), request.get("robust"))
+        if self.pool is not None:
+            row = self.pool.submit(fit_short, fitx, fity, request).result()
+        else:
+            row = fit_short(fitx, fity, request)
+        row.update({"wide": request["wide"]})
+        return row
+
+    def close(self) -> None:
+        if self.pool is not None:
+            self.pool.shutdown()
+
+
+class FitHandler(BaseHTTPRequestHandler):
+    """
+    POST /fit       {"wide": path, "short": path or "frequency", "X", "Y" arrays,
+                     optional "exclude": [f_min, f_max], "robust": "clip", "fix_tail": true, "p0": [f0, Q, A]}
+    POST /background {"wide": path, optional "exclude", "robust"}
+    GET /health
+    """
+    service: FitService
+
+    def do_GET(self) -> None:
+        if self.path == "/health":
+            self.reply(200, {"status": "ok", "backgrounds": len(self.service.backgrounds)})
+        else:
+            self.reply(404, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self) -> None:
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length).decode("utf-8"))
+            if self.path == "/fit":
+                self.reply(200, self.service.fit(request))
+            elif self.path == "/background":
+                fitx, fity = self.service.background(request["wide"], request.get("exclude"), request.get("robust"))
+                self.reply(200, {"fitx": fitx.tolist(), "fity": fity.tolist()})
+            else:
+                self.reply(404, {"error": f"Unknown path {self.path}"})
+        except (KeyError, ValueError, TypeError, OSError, AttributeError) as ex:
+            app_log.error(f"Request {self.path} fails: {ex!r}")
+            self.reply(400, {"error": repr(ex)})
+        except Exception as ex:
+            app_log.error(f"Request {self.path} fails: {ex!r}")
+            self.reply(500, {"error": repr(ex)})
+
+    def reply(self, code: int, body: Dict) -> None:
+        data = json.dumps(to_json(body), allow_nan=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format: str, *args) -> None:
+        app_log.debug(f"{self.address_string()} {format % args}")
+
+
+def make_server(port: int = 8765, jobs: int = 1, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """
+    HTTP server of a new FitService, `port` 0 takes a free port
+    :raise: ValueError if `host` is not the loopback interface
+    """
+    if host not in loopback:
+        raise ValueError(f"The fit service listens on the loopback interface only, not {host}")
+    handler = type("Handler", (FitHandler,), {"service": FitService(jobs)})
+    server_class = ThreadingHTTPServer6 if ":" in host else ThreadingHTTPServer
+    return server_class((host, port), handler)
+
+
+def parse_args(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Fork feedthrough fit service on localhost")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--host", default="127.0.0.1", choices=loopback)
+    parser.add_argument("-j", "--jobs", type=int, default=0,
+                        help="number of worker processes, 0 for all cores, 1 to fit in the request thread")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    args = parse_args(argv)
+    jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+    server = make_server(args.port, jobs, args.host)
+    app_log.info(f"Fit service listens on {args.host}:{server.server_address[1]} with {jobs} processes")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.RequestHandlerClass.service.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
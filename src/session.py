@@ -0,0 +1,138 @@
+"""
+State of one analysis: the wide sweep, the short sweep and their fit parameters.
+Sessions are independent, so one process can analyze several forks, e.g. the GUI, a batch worker
+or a server with a session per request.
+"""
+import threading
+from typing import Dict, Optional, Sequence, Tuple
+import numpy as np
+
+from logger import log_settings
+from misc import SweepData, FitParams
+from fitting import FitResult
+import pipeline
+from background import background_cache
+
+#logger
+app_log = log_settings()
+
+
+class Session(object):
+    """
+    Owns a SweepData pair and FitParams. The steps are the functions of `pipeline`.
+    The polynomials of the wide sweep fit are kept as `background`, every short sweep processed
+    by `process_short` starts from a copy of them.
+    :param name: name of the session for the log, e.g. the fork
+    :param deg_x: degree of the X polynomial of the wide sweep
+    :param deg_y: degree of the Y polynomial of the wide sweep
+    :param dtype: storage type of the channels of the sweeps
+    """
+    def __init__(self, name: str = "", deg_x: int = pipeline.poly_x, deg_y: int = pipeline.poly_y,
+                 dtype: type = np.float64) -> None:
+        self.name = name
+        self.deg_x = deg_x
+        self.deg_y = deg_y
+        self.dtype = dtype
+        self.fits = FitParams()
+        self.long_sd = SweepData(dtype)
+        self.short_sd = SweepData(dtype)
+        self.long_sd.group = "wide"
+        self.short_sd.group = "short"
+        self.background: Optional[Tuple[np.ndarray, np.ndarray]] = None
+        self.wide_path: Optional[str] = None
+        # steps of one session are not thread safe, callers from several threads take the lock
+        self.lock = threading.RLock()
+
+    @classmethod
+    def from_background(cls, fitx: np.ndarray, fity: np.ndarray, name: str = "") -> "Session":
+        """
+        Session with a fitted wide sweep, e.g. in a batch worker
+        """
+        session = cls(name, len(fitx) - 1, len(fity) - 1)
+        session.set_background(fitx, fity)
+        return session
+
+    def open_wide(self, path: str, cached: bool = True) -> SweepData:
+        self.long_sd = pipeline.open_sweep(path, "wide", cached, self.dtype)
+        self.wide_path = path
+        return self.long_sd
+
+    def open_short(self, path: str, cached: bool = True) -> SweepData:
+        self.short_sd = pipeline.open_sweep(path, "short", cached, self.dtype)
+        return self.short_sd
+
+    def set_short(self, data: np.ndarray) -> SweepData:
+        """
+        Short sweep from a structured `kerneldt` array, e.g. sent by the measurement software
+        """
+        self.short_sd = SweepData(self.dtype)
+        self.short_sd.create_data(data)
+        self.short_sd.create_mask()
+        self.short_sd.group = "short"
+        return self.short_sd
+
+    def set_background(self, fitx: np.ndarray, fity: np.ndarray) -> None:
+        """
+        Stores the polynomials of the wide sweep and sets them to FitParams
+        """
+        self.background = (np.array(fitx, dtype=float), np.array(fity, dtype=float))
+        self.reset_background()
+
+    def reset_background(self) -> None:
+        """
+        Drops the corrections of the short sweep from the polynomials
+        :raise: AttributeError if the wide sweep is not fitted yet
+        """
+        if self.background is None:
+            raise AttributeError("Fit of the wide sweep is not performed")
+        self.fits.fitx = self.background[0].copy()
+        self.fits.fity = self.background[1].copy()
+
+    def fit_wide(self, exclude: Optional[Sequence[float]] = None, robust: Optional[str] = None) -> None:
+        """
+        Fit of the opened wide sweep
+        :param exclude: frequency region (f_min, f_max) excluded from the fit
+        :param robust: "clip" or "huber" to exclude the resonance automatically
+        The polynomials of a wide sweep file are taken from the background cache if it was fitted before,
+        a robust fit also restores its mask from there.
+        """
+        if exclude is not None:
+            pipeline.exclude_range(self.long_sd, exclude[0], exclude[1])
+        key = None
+        if self.wide_path is not None:
+            key = background_cache.key(self.wide_path, self.long_sd.mask, self.deg_x, self.deg_y, robust or "polyfit")
+            coefs = background_cache.get(key)
+            mask = None
+            if coefs is not None and robust:
+                mask = background_cache.get_mask(key, len(self.long_sd.require("Frequency")))
+            if coefs is not None and (mask is not None or not robust):
+                if mask is not None:
+                    self.long_sd.mask = mask
+                self.set_background(*coefs)
+                app_log.info(f"Session `{self.name}`: fit of wide sweep is taken from the cache")
+                return
+        mask = None
+        if robust:
+            res = pipeline.fit_wide_robust(self.long_sd, self.fits, robust, self.deg_x, self.deg_y)
+            self.set_background(res.fitx, res.fity)
+            mask = res.mask
+        else:
+            self.set_background(*pipeline.wide_coefficients(self.long_sd, self.deg_x, self.deg_y))
+        if key is not None and self.background is not None:
+            background_cache.put(key, self.background[0], self.background[1], mask)
+        app_log.info(f"Session `{self.name}`: fit of wide sweep was done")
+
+    def process_short(self, fix_tail: bool = False, p0: Optional[Sequence[float]] = None) -> FitResult:
+        """
+        All the steps of the opened short sweep from the polynomials of the wide sweep
+        :param fix_tail: fix the jump of the Y channel
+        :param p0: (f0, q, a) of the previous sweep to warm start the fit
+        """
+        self.reset_background()
+        return pipeline.process_short(self.short_sd, self.fits, fix_tail, p0)
+
+    def table(self) -> Dict[str, float]:
+        """
+        Fit parameters x0..x3, y0..y4, f0, Q, K
+        """
+        return pipeline.fit_table(self.fits)
@@ -0,0 +1,223 @@
+"""
+Binary sweep files (.swp). A header of 64 bytes with the metadata of the sweep is followed by the
+columns of `kerneldt` as contiguous little-endian blocks, so a sweep is opened as memory maps of its
+columns instead of parsing text. Conversion of .dat files and folders:
+    python sweepfile.py wide.dat short_dir/ --group short -o archive/
+"""
+import argparse
+import datetime
+import os
+import sys
+import threading
+from typing import Dict, Iterator, List, NamedTuple, Optional, Sequence
+import numpy as np
+
+from logger import log_settings
+from loader import column_names, kerneldt, load_sweep, date_convert
+
+#logger
+app_log = log_settings()
+
+extension = ".swp"
+magic = b"FORKSWP1"
+version = 1
+groups = ("", "wide", "short")
+# file types of the columns, in the order of `kerneldt`
+column_types = (("uni_time", "<i8"), ("frequency", "<i8"), ("X", "<f8"), ("Y", "<f8"), ("amplitude", "<f8"),
+                ("id", "<i8"))
+header_dt = np.dtype([("magic", "S8"), ("version", "<u2"), ("group", "<u2"), ("n_cols", "<u4"), ("count", "<u8"),
+                      ("start", "<f8"), ("date_convert", "<f8"), ("f_min", "<f8"), ("f_max", "<f8"),
+                      ("reserved", "S8")])
+header_size = header_dt.itemsize
+
+
+class SweepHeader(NamedTuple):
+    """
+    Metadata of a binary sweep
+    Attributes:
+        :param group: "wide", "short" or "" if unknown
+        :param points: number of points
+        :param start: UTC timestamp of the first point, Labview time divided by `date_convert`
+        :param f_min: minimum frequency
+        :param f_max: maximum frequency
+    """
+    group: str
+    points: int
+    start: float
+    f_min: float
+    f_max: float
+
+    @property
+    def date(self) -> datetime.datetime:
+        return datetime.datetime.utcfromtimestamp(self.start)
+
+
+class SweepColumns(object):
+    """
+    Columns of a binary sweep as read-only memory maps. Used like the `kerneldt` array by
+    `SweepData.create_data`: `columns["X"]`, `len(columns)`.
+    """
+    def __init__(self, header: SweepHeader, columns: Dict[str, np.ndarray]) -> None:
+        self.header = header
+        self.columns = columns
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.columns[name]
+
+    def __len__(self) -> int:
+        return self.header.points
+
+    def to_records(self) -> np.ndarray:
+        """
+        Copy as the structured `kerneldt` array
+        """
+        data = np.empty(self.header.points, dtype=kerneldt)
+        for name in column_names:
+            data[name] = self.columns[name]
+        return data
+
+
+def is_sweep_file(path: str) -> bool:
+    return path.lower().endswith(extension)
+
+
+def write_sweep(path: str, data: np.ndarray, group: str = "") -> SweepHeader:
+    """
+    Writes the `kerneldt` array as a binary sweep. The file is replaced at once when it is complete.
+    :param group: "wide", "short" or "" if unknown
+    :raise: ValueError for an empty sweep or an unknown group
+    """
+    if group not in groups:
+        raise ValueError(f"Unknown group of sweep `{group}`")
+    if len(data) == 0:
+        raise ValueError("Sweep does not contain data")
+    header = SweepHeader(group, len(data), float(data["uni_time"][0]) / date_convert,
+                         float(np.min(data["frequency"])), float(np.max(data["frequency"])))
+    head = np.zeros(1, dtype=header_dt)
+    head["magic"] = magic
+    head["version"] = version
+    head["group"] = groups.index(group)
+    head["n_cols"] = len(column_types)
+    head["count"] = header.points
+    head["start"] = header.start
+    head["date_convert"] = date_convert
+    head["f_min"] = header.f_min
+    head["f_max"] = header.f_max
+    # own temporary file of every writer, two processes may convert the same sweep
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    f = open(tmp, "xb")
+    try:
+        with f:
+            f.write(head.tobytes())
+            for name, ftype in column_types:
+                np.ascontiguousarray(data[name], dtype=ftype).tofile(f)
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+    return header
+
+
+def read_header(path: str) -> SweepHeader:
+    """
+    Header of a binary sweep
+    :raise: ValueError if the file is not a complete binary sweep of this version
+    """
+    with open(path, "rb") as f:
+        raw = f.read(header_size)
+    if len(raw) < header_size:
+        raise ValueError(f"{path} is not a binary sweep: too short")
+    head = np.frombuffer(raw, dtype=header_dt)[0]
+    if bytes(head["magic"]) != magic:
+        raise ValueError(f"{path} is not a binary sweep")
+    if int(head["version"]) != version or int(head["n_cols"]) != len(column_types):
+        raise ValueError(f"{path}: unsupported version {int(head['version'])} of binary sweep")
+    count = int(head["count"])
+    expected = header_size + count * sum(np.dtype(ftype).itemsize for _, ftype in column_types)
+    if os.path.getsize(path) != expected:
+        raise ValueError(f"{path} is truncated: {os.path.getsize(path)} bytes instead of {expected}")
+    # the start is converted by the factor of the file, the factor may be corrected later
+    start = float(head["start"]) * float(head["date_convert"]) / date_convert
+    return SweepHeader(groups[int(head["group"])] if int(head["group"]) < len(groups) else "", count, start,
+                       float(head["f_min"]), float(head["f_max"]))
+
+
+def read_columns(path: str) -> SweepColumns:
+    """
+    Memory maps of the columns of a binary sweep
+    :raise: ValueError
+    """
+    header = read_header(path)
+    columns: Dict[str, np.ndarray] = dict()
+    offset = header_size
+    for name, ftype in column_types:
+        columns[name] = np.memmap(path, dtype=ftype, mode="r", offset=offset, shape=(header.points,))
+        offset += header.points * np.dtype(ftype).itemsize
+    return SweepColumns(header, columns)
+
+
+def iter_records(path: str, chunk_rows: int = 1_000_000) -> Iterator[np.ndarray]:
+    """
+    Binary sweep by chunks of `kerneldt` records, analog of `loader.iter_chunks`
+    """
+    sweep = read_columns(path)
+    for start in range(0, len(sweep), chunk_rows):
+        chunk = np.empty(min(chunk_rows, len(sweep) - start), dtype=kerneldt)
+        for name in column_names:
+            chunk[name] = sweep[name][start:start + len(chunk)]
+        yield chunk
+
+
+def convert(path: str, output: Optional[str] = None, group: str = "") -> str:
+    """
+    Converts a .dat file into a binary sweep
+    :param output: file or folder of the binary sweep, next to the .dat file by default
+    :return: path of the binary sweep
+    """
+    target = os.path.splitext(path)[0] + extension
+    if output is not None:
+        target = os.path.join(output, os.path.basename(target)) if os.path.isdir(output) else output
+    header = write_sweep(target, load_sweep(path), group)
+    app_log.info(f"{path} is converted to {target}: {header.points} points")
+    return target
+
+
+def collect_dat(paths: Sequence[str]) -> List[str]:
+    files: List[str] = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(os.path.join(path, name) for name in os.listdir(path) if name.lower().endswith(".dat")))
+        else:
+            files.append(path)
+    return files
+
+
+def parse_args(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Conversion of .dat sweeps into binary .swp files")
+    parser.add_argument("paths", nargs="+", help=".dat files or folders of them")
+    parser.add_argument("--group", choices=groups[1:], default="", help="group of the sweeps")
+    parser.add_argument("-o", "--output", help="output folder, next to the .dat files by default")
+    parser.add_argument("--force", action="store_true", help="convert again the files with a newer .swp")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    args = parse_args(argv)
+    if args.output is not None:
+        os.makedirs(args.output, exist_ok=True)
+    failed = 0
+    for path in collect_dat(args.paths):
+        folder = args.output if args.output is not None else os.path.dirname(path)
+        target = os.path.join(folder, os.path.splitext(os.path.basename(path))[0] + extension)
+        if not args.force and os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(path):
+            continue
+        try:
+            convert(path, target, args.group)
+        except (OSError, ValueError) as ex:
+            app_log.error(f"{path} can NOT be converted: {ex}")
+            failed += 1
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,162 @@
+"""
+Execution of long loads and fits in worker threads. Results, errors and progress go through a
+queue which is polled by the Tk main loop, so FitParams and figures are changed on the Tk thread only.
+"""
+import queue
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from logger import log_settings
+
+#logger
+app_log = log_settings()
+
+
+class TaskCancelled(Exception):
+    pass
+
+
+class CancelToken(object):
+    """
+    Cancellation flag of a task. The task function checks it at its stages, e.g. in `progress`.
+    """
+    def __init__(self) -> None:
+        self._event = threading.Event()
+
+    def cancel(self) -> None:
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def check(self) -> None:
+        """
+        :raise: TaskCancelled
+        """
+        if self._event.is_set():
+            raise TaskCancelled()
+
+
+class Progress(object):
+    """
+    Progress reporter of a task in the worker thread: `progress(fraction, text)` queues the state,
+    `progress.check()` only raises TaskCancelled, so the inner loops of a fit can stop without flooding the queue.
+    Both raise TaskCancelled after `cancel`.
+    """
+    def __init__(self, results: queue.Queue, name: str, token: CancelToken) -> None:
+        self.results = results
+        self.name = name
+        self.token = token
+
+    def __call__(self, fraction: float, text: str = "") -> None:
+        self.token.check()
+        self.results.put(("progress", self.name, self.token, (fraction, text)))
+
+    def check(self) -> None:
+        self.token.check()
+
+
+class TaskRunner(object):
+    """
+    Runs functions `func(progress)` in daemon threads.
+    `progress(fraction, text)` reports the state and raises TaskCancelled after `cancel`,
+    `progress.check()` raises it without a report.
+    `on_done(result)`, `on_error(exception)` and `on_progress(name, fraction, text)` are called
+    from the Tk thread by polling of the queue with `master.after`.
+    :param master: Tk root
+    :param on_progress: GUI callback of progress
+    :param poll_ms: period of the queue polling
+    """
+    def __init__(self, master, on_progress: Optional[Callable[[str, float, str], None]] = None,
+                 poll_ms: int = 50) -> None:
+        self.master = master
+        self.on_progress = on_progress
+        self.poll_ms = poll_ms
+        self.results: queue.Queue = queue.Queue()
+        self.tokens: Dict[str, CancelToken] = dict()
+        self.callbacks: Dict[CancelToken, Tuple[Callable, Optional[Callable]]] = dict()
+        self._poll_job: Optional[str] = None
+
+    def submit(self, name: str, func: Callable[[Progress], Any],
+               on_done: Callable[[Any], None], on_error: Optional[Callable[[Exception], None]] = None) -> CancelToken:
+        """
+        Starts a task. A running task with the same name is cancelled.
+        :param name: name of the task, e.g. "fit wide"
+        :param func: function of the worker thread, must not touch Tk or FitParams
+        :param on_done: called with the result on the Tk thread
+        :param on_error: called with the exception on the Tk thread
+        """
+        self.cancel(name)
+        token = CancelToken()
+        self.tokens[name] = token
+        progress = Progress(self.results, name, token)
+
+        def run() -> None:
+            try:
+                result = func(progress)
+                token.check()
+            except TaskCancelled:
+                self.results.put(("cancelled", name, token, None))
+            except Exception as ex:
+                self.results.put(("error", name, token, ex))
+            else:
+                self.results.put(("done", name, token, result))
+
+        self.callbacks[token] = (on_done, on_error)
+        threading.Thread(target=run, name=name, daemon=True).start()
+        app_log.info(f"Task `{name}` has started")
+        if self._poll_job is None:
+            self._poll_job = self.master.after(self.poll_ms, self.poll)
+        return token
+
+    def cancel(self, name: Optional[str] = None) -> None:
+        """
+        Cancels the task `name` or all tasks. The late messages of a cancelled task are dropped by `poll`,
+        so its end is reported here.
+        """
+        names = list(self.tokens) if name is None else [name]
+        for key in names:
+            token = self.tokens.pop(key, None)
+            if token is not None:
+                token.cancel()
+                app_log.info(f"Task `{key}` is cancelled")
+                if self.on_progress is not None:
+                    self.on_progress(key, 1.0, "cancelled")
+
+    def poll(self) -> None:
+        """
+        Handles the queued messages of the workers on the Tk thread. The messages of a cancelled task do not
+        call the callbacks: a new task with the same name may be running already.
+        """
+        self._poll_job = None
+        while True:
+            try:
+                kind, name, token, payload = self.results.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "progress":
+                if not token.cancelled and self.on_progress is not None:
+                    self.on_progress(name, payload[0], payload[1])
+                continue
+            on_done, on_error = self.callbacks.pop(token, (None, None))
+            if self.tokens.get(name) is token:
+                del self.tokens[name]
+            if token.cancelled:
+                app_log.debug(f"Task `{name}` has finished after cancel: {kind}")
+                continue
+            if self.on_progress is not None:
+                self.on_progress(name, 1.0, kind)
+            if kind == "done" and on_done is not None:
+                app_log.info(f"Task `{name}` is done")
+                on_done(payload)
+            elif kind == "error":
+                app_log.error(f"Task `{name}` fails: {payload}")
+                if on_error is not None:
+                    on_error(payload)
+        if self.callbacks:
+            self._poll_job = self.master.after(self.poll_ms, self.poll)
+
+    @property
+    def busy(self) -> bool:
+        return bool(self.callbacks)
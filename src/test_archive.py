@@ -0,0 +1,55 @@
+import argparse
+import os
+
+import archive
+import batch
+
+
+def entry(path, group, start, f_min=31500.0, f_max=32500.0, peak=32000.0):
+    return archive.SweepEntry(path, 0, 0, group, start, 1000, f_min, f_max, peak)
+
+
+def make_index(tmp_path):
+    index = archive.SweepIndex(str(tmp_path / "index.sqlite"))
+    index.add([entry("/a/wide.dat", "wide", 100.0, 28000.0, 36000.0),
+               entry("/a/s1.swp", "short", 200.0),
+               entry("/a/s0.dat", "short", 200.0),
+               entry("/a/unknown.dat", "", 150.0),
+               entry("/a/other.dat", "short", 300.0, 40000.0, 41000.0, 40500.0)])
+    return index
+
+
+def paths(entries):
+    return [os.path.basename(item.path) for item in entries]
+
+
+def test_select_group(tmp_path):
+    with make_index(tmp_path) as index:
+        assert paths(index.select(group="short")) == ["s0.dat", "s1.swp", "other.dat"]
+        assert paths(index.select(group="wide")) == ["wide.dat"]
+        assert paths(index.select(group="")) == ["unknown.dat"]
+        assert len(index.select()) == 5
+
+
+def test_select_window(tmp_path):
+    with make_index(tmp_path) as index:
+        assert paths(index.select(since=150, until=250, group="short")) == ["s0.dat", "s1.swp"]
+        assert paths(index.select(freq=(35000, 40100))) == ["wide.dat", "other.dat"]
+        assert paths(index.select(peak=(40000, 41000))) == ["other.dat"]
+        assert paths(index.select(limit=2)) == ["wide.dat", "unknown.dat"]
+
+
+def test_batch_selects_only_short(tmp_path):
+    make_index(tmp_path).close()
+    args = argparse.Namespace(wide="/a/wide.dat", since=None, until=None, freq=(31000, 33000), peak=None)
+    assert batch.select_short(str(tmp_path / "index.sqlite"), args) == ["/a/s0.dat", "/a/s1.swp"]
+
+
+def test_store_fits(tmp_path):
+    with make_index(tmp_path) as index:
+        rows = [{"file": "/a/s0.dat", "success": True, "f0": 32001.0, "Q": 55.0, "K": float("nan")},
+                {"file": "/a/s1.swp", "error": "broken"}]
+        assert index.store_fits(rows) == 1
+        fitted = {item.path: (item.f0, item.q, item.k) for item in index.select(group="short")}
+        assert fitted["/a/s0.dat"] == (32001.0, 55.0, None)
+        assert fitted["/a/s1.swp"] == (None, None, None)
@@ -0,0 +1,53 @@
+import numpy as np
+
+import pipeline
+from background import BackgroundCache
+from benchmarks import synthetic_sweep, write_dat
+from session import Session
+
+
+def test_baselines_are_bounded_by_bytes():
+    cache = BackgroundCache(None, baseline_budget=3 * 8 * 1000)
+    freq = np.linspace(31000, 33000, 1000)
+    for shift in range(5):
+        coef = np.array([1e-6 * (shift + 1), 2e-3, 0.5, 1.0])
+        assert np.allclose(cache.evaluate(coef, freq), np.polyval(coef, freq))
+    assert len(cache.baselines) == 3
+    assert cache.baseline_bytes == 3 * 8 * 1000 == sum(base.nbytes for base in cache.baselines.values())
+    # a baseline above the budget is evaluated without caching
+    big = np.linspace(31000, 33000, 10000)
+    assert np.allclose(cache.evaluate(coef, big), np.polyval(coef, big))
+    assert cache.baseline_bytes == 3 * 8 * 1000
+    cache.clear()
+    assert cache.baseline_bytes == 0 and not cache.baselines
+
+
+def test_corrections_reuse_the_baseline():
+    cache = BackgroundCache(None)
+    freq = np.linspace(31000, 33000, 1000)
+    coef = np.array([1e-9, 1e-6, 2e-3, 0.5])
+    cache.evaluate(coef, freq)
+    corrected = coef.copy()
+    corrected[-2:] += (1e-4, -0.2)
+    assert np.allclose(cache.evaluate(corrected, freq), np.polyval(corrected, freq))
+    assert cache.stats == {"hits": 1, "misses": 1}
+
+
+def test_cached_robust_fit_restores_its_mask(tmp_path, monkeypatch):
+    path = str(tmp_path / "wide.dat")
+    write_dat(path, synthetic_sweep(4000, "wide"))
+    first = Session()
+    first.open_wide(path)
+    first.fit_wide(robust="clip")
+    mask = first.long_sd.require("mask")
+    assert not mask.all()
+
+    def refit(*args, **kwargs):
+        raise AssertionError("the robust fit is not taken from the cache")
+
+    monkeypatch.setattr(pipeline, "fit_wide_robust", refit)
+    second = Session()
+    second.open_wide(path)
+    second.fit_wide(robust="clip")
+    assert np.array_equal(second.long_sd.require("mask"), mask)
+    assert np.array_equal(second.fits.fitx, first.fits.fitx)
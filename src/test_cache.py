@@ -0,0 +1,70 @@
+import glob
+import os
+
+import numpy as np
+import pytest
+
+from benchmarks import synthetic_sweep, write_dat
+from cache import SweepCache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return SweepCache(str(tmp_path / "cache"))
+
+
+def write(path, num, seed=0):
+    data = synthetic_sweep(num, seed=seed)
+    write_dat(str(path), data)
+    return str(path)
+
+
+def entries(cache):
+    return sorted(glob.glob(os.path.join(cache.directory, "*")))
+
+
+def test_second_open_is_memmap(cache, tmp_path):
+    path = write(tmp_path / "short.dat", 500)
+    first = cache.load(path)
+    assert not isinstance(first, np.memmap)
+    second = cache.load(path)
+    assert isinstance(second, np.memmap)
+    assert np.array_equal(first, second)
+    assert entries(cache) == [cache.entry(path)]
+
+
+def test_changed_file_rebuilds_entry(cache, tmp_path):
+    path = write(tmp_path / "short.dat", 500)
+    cache.load(path)
+    old = cache.entry(path)
+    write(path, 600)
+    assert len(cache.load(path)) == 600
+    assert entries(cache) == [cache.entry(path)] != [old]
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert not isinstance(cache.load(path), np.memmap)
+    assert entries(cache) == [cache.entry(path)]
+
+
+def test_broken_entry_is_rebuilt(cache, tmp_path):
+    path = write(tmp_path / "short.dat", 500)
+    data = cache.load(path)
+    with open(cache.entry(path), "wb") as f:
+        f.write(b"broken")
+    assert np.array_equal(cache.load(path), data)
+    assert np.array_equal(cache.load(path), data)
+    assert isinstance(cache.load(path), np.memmap)
+
+
+def test_evict_least_recently_used(cache, tmp_path):
+    paths = [write(tmp_path / f"short{idx}.dat", 500, idx) for idx in range(3)]
+    for path in paths:
+        cache.load(path)
+    # short1 was used first, short2 last
+    for stamp, path in zip((200, 100, 300), paths):
+        os.utime(cache.entry(path), (stamp, stamp))
+    size = os.path.getsize(cache.entry(paths[0]))
+    cache.evict(2 * size)
+    assert entries(cache) == sorted(cache.entry(path) for path in (paths[0], paths[2]))
+    cache.evict(size)
+    assert entries(cache) == [cache.entry(paths[2])]
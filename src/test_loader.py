@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+import loader
+
+header = "# Time\tFrequency\tX\tY\tAmplitude\tid\n"
+rows = ["3693245270 31500 0.01 -0.8 0.64 0", "3693245271 31501 0.02 -0.7 0.49 1", "3693245272 31502 0.03 -0.6 0.36 2"]
+
+
+def test_parse_text():
+    data = loader.parse_text(header + "\n".join(rows) + "\n")
+    assert data.dtype == loader.kerneldt
+    assert list(data["frequency"]) == [31500, 31501, 31502]
+    assert np.allclose(data["Y"], [-0.8, -0.7, -0.6])
+    assert list(data["id"]) == [0, 1, 2]
+
+
+def test_parse_text_blank_lines_and_comments():
+    text = header + rows[0] + "\n\n" + rows[1] + "\r\n# comment\n" + rows[2]
+    assert list(loader.parse_text(text)["id"]) == [0, 1, 2]
+
+
+@pytest.mark.parametrize("broken", ["3693245271 31501 0.02 -0.7 0.49", "3693245271 31501 0.02 -0.7 0.49 1 7"])
+def test_parse_text_rejects_misaligned_rows(broken):
+    # one missing and one extra value keep the total a multiple of the columns
+    if len(broken.split()) == 5:
+        lines = [rows[0], broken, rows[2] + " 9"]
+    else:
+        lines = [rows[0], broken, rows[2][:rows[2].rfind(" ")]]
+    with pytest.raises(ValueError, match="Line 2"):
+        loader.parse_text(header + "\n".join(lines) + "\n")
+
+
+def test_parse_text_rejects_text():
+    with pytest.raises(ValueError):
+        loader.parse_text(header + rows[0] + "\n3693245271 31501 x -0.7 0.49 1\n")
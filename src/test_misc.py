@@ -0,0 +1,41 @@
+import numpy as np
+
+from benchmarks import synthetic_sweep
+from misc import SweepData
+
+
+def make_sweep():
+    sweep = SweepData()
+    sweep.create_data(synthetic_sweep(1000))
+    return sweep
+
+
+def test_channel_assignment_of_overlapping_views():
+    sweep = make_sweep()
+    x = sweep.X.copy()
+    sweep.X = sweep.X[::-1]
+    assert np.array_equal(sweep.X, x[::-1])
+    sweep.Y = sweep.X
+    sweep.X = sweep.X
+    assert np.array_equal(sweep.X, x[::-1]) and np.array_equal(sweep.Y, x[::-1])
+
+
+def test_channels_are_rows_of_the_block():
+    sweep = make_sweep()
+    assert sweep.dx is None
+    sweep.dx = sweep.X - 1.0
+    assert np.shares_memory(sweep.dx, sweep.block)
+    assert np.array_equal(sweep.dx, sweep.X - 1.0)
+    sweep.dx = None
+    assert sweep.dx is None
+
+
+def test_snapshot_is_independent():
+    sweep = make_sweep()
+    sweep.create_mask()
+    snapshot = sweep.snapshot(("X",))
+    x = sweep.X.copy()
+    sweep.X = sweep.X * 2
+    sweep.mask[:] = False
+    assert np.array_equal(snapshot.X, x) and snapshot.Y is None
+    assert snapshot.mask.all()
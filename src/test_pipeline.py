@@ -0,0 +1,123 @@
+import numpy as np
+import pytest
+
+import batch
+import models
+import pipeline
+import sweepfile
+from benchmarks import synthetic_background, synthetic_noise, synthetic_resonance, synthetic_sweep, write_dat
+from loader import kerneldt
+from misc import FitParams, SweepData
+
+
+@pytest.mark.parametrize("name", ["wide.dat", "wide" + sweepfile.extension])
+def test_stream_fit_equals_polyfit(tmp_path, name):
+    data = synthetic_sweep(5000, "wide")
+    # a chronological file: the first chunk has one frequency only
+    data["frequency"][:500] = data["frequency"][0]
+    path = str(tmp_path / name)
+    if sweepfile.is_sweep_file(path):
+        sweepfile.write_sweep(path, data, "wide")
+        data = sweepfile.read_columns(path)
+    else:
+        write_dat(path, data)
+        data = pipeline.load_sweep(path)
+    fits = FitParams()
+    exclude = (31500.0, 32500.0)
+    count = pipeline.fit_wide_stream(path, fits, exclude, chunk_rows=500)
+    freq = np.asarray(data["frequency"], dtype=float)
+    mask = (freq < exclude[0]) | (freq > exclude[1])
+    assert count == np.count_nonzero(mask)
+    assert pipeline.frequency_range(path, 500) == (freq.min(), freq.max())
+    for coef, channel, deg in ((fits.fitx, "X", pipeline.poly_x), (fits.fity, "Y", pipeline.poly_y)):
+        expected = np.polyfit(freq[mask], np.asarray(data[channel], dtype=float)[mask], deg)
+        assert np.allclose(coef, expected, rtol=1e-8, atol=0)
+
+
+def sweep_with_peak(num=20000, seed=0):
+    """
+    Wide sweep of the polynomials of `synthetic_background` with a narrow resonance peak on both channels.
+    The peak of `chan_x` decays as 1/df^2, the 1/df tails of `chan_y` can not be told apart from the background.
+    """
+    rng = np.random.RandomState(seed)
+    f0 = synthetic_resonance[0]
+    freq = np.linspace(f0 - 4000, f0 + 4000, num)
+    peak = models.chan_x(freq, f0, 5000.0, 200.0)
+    data = np.zeros(num, dtype=kerneldt)
+    data["frequency"] = freq
+    for channel, coef in zip(("X", "Y"), synthetic_background):
+        data[channel] = np.polyval(coef, (freq - f0) / 1000) + peak + rng.normal(scale=synthetic_noise, size=num)
+    sweep = SweepData()
+    sweep.create_data(data)
+    expected = [pipeline.unscale_poly(np.array(coef), f0, 1000.0) for coef in synthetic_background]
+    return sweep, expected
+
+
+@pytest.mark.parametrize("method", ["clip", "huber"])
+def test_robust_fit_recovers_background(method):
+    sweep, expected = sweep_with_peak()
+    freq = sweep.require("Frequency")
+    res = pipeline.robust_coefficients(sweep, method=method)
+    plain = pipeline.wide_coefficients(sweep, mask=np.ones(len(freq), dtype=bool))
+    for coef, coef_plain, coef_true in zip((res.fitx, res.fity), plain, expected):
+        error = np.max(np.abs(np.polyval(coef, freq) - np.polyval(coef_true, freq)))
+        assert error < synthetic_noise / 2
+        assert np.max(np.abs(np.polyval(coef_plain, freq) - np.polyval(coef_true, freq))) > 4 * error
+    assert not res.mask[np.argmin(np.abs(freq - synthetic_resonance[0]))]
+    assert res.mask[0] and res.mask[-1]
+
+
+def short_sweep(background):
+    sweep = SweepData()
+    sweep.create_data(synthetic_sweep(2000, "short"))
+    sweep.create_mask()
+    sweep.group = "short"
+    fits = FitParams()
+    fits.fitx, fits.fity = background[0].copy(), background[1].copy()
+    return sweep, fits
+
+
+@pytest.mark.parametrize("fix_tail", [False, True])
+def test_correct_equals_button_sequence(fix_tail):
+    background = [pipeline.unscale_poly(np.array(coef), synthetic_resonance[0], 1000.0) * 1.01
+                  for coef in synthetic_background]
+    steps, fits_steps = short_sweep(background)
+    if fix_tail:
+        pipeline.y_tail(steps)
+    pipeline.subtract(steps, fits_steps)
+    fits_steps.update_slope_x(pipeline.slope_x(steps))
+    pipeline.subtract(steps, fits_steps)
+    fits_steps.update_intersect_x(pipeline.intersect_x(steps))
+    pipeline.subtract(steps, fits_steps)
+    fits_steps.update_intersect_y(pipeline.intersect_y(steps))
+    pipeline.subtract(steps, fits_steps)
+
+    one_pass, fits_one = short_sweep(background)
+    res = pipeline.correct(one_pass, fits_one, fix_tail)
+    assert (res.tail is not None) == fix_tail
+    assert one_pass.ind_max == steps.ind_max
+    assert np.allclose(fits_one.fitx, fits_steps.fitx, rtol=1e-12, atol=0)
+    assert np.allclose(fits_one.fity, fits_steps.fity, rtol=1e-12, atol=0)
+    for name in ("Y", "dx", "dy"):
+        assert np.allclose(one_pass.require(name), steps.require(name), rtol=0, atol=1e-12)
+
+
+def test_diverged_warm_start_falls_back_to_cold(tmp_path):
+    background = [pipeline.unscale_poly(np.array(coef), synthetic_resonance[0], 1000.0)
+                  for coef in synthetic_background]
+    sweep, fits = short_sweep(background)
+    pipeline.correct(sweep, fits, True)
+    far = (40000.0, 30.0, 10000.0)
+    warm = pipeline.fit_resonance(sweep.require("Frequency"), sweep.require("dx"), sweep.require("dy"), far)
+    assert pipeline.diverged(sweep, warm)
+    cold = pipeline.fit_short_warm(sweep, fits, far)
+    assert not cold.warm and not pipeline.diverged(sweep, cold)
+    assert cold.f0 == pytest.approx(synthetic_resonance[0], abs=50)
+    assert cold.nfev > warm.nfev
+
+    path = str(tmp_path / "short.dat")
+    write_dat(path, synthetic_sweep(2000, "short"))
+    wide = FitParams()
+    wide.fitx, wide.fity = background
+    assert batch.process_file(path, wide, True, far)["start"] == "cold"
+    assert batch.process_file(path, wide, True, (cold.f0, cold.q, cold.a))["start"] == "warm"
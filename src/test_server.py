@@ -0,0 +1,95 @@
+import json
+import socket
+import threading
+import urllib.error
+import urllib.request
+
+import numpy as np
+import pytest
+
+import server
+from benchmarks import synthetic_resonance, synthetic_sweep, write_dat
+
+
+def serve(host="127.0.0.1"):
+    httpd = server.make_server(0, 1, host)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
+
+
+def post(url, body):
+    request = urllib.request.Request(url, json.dumps(body).encode("utf-8"), {"Content-Type": "application/json"})
+    with urllib.request.urlopen(request, timeout=60) as response:
+        return response.status, json.loads(response.read().decode("utf-8"), parse_constant=pytest.fail)
+
+
+@pytest.fixture
+def wide(tmp_path):
+    path = str(tmp_path / "wide.dat")
+    write_dat(path, synthetic_sweep(4000, "wide"))
+    return path
+
+
+def test_fit_round_trip(wide, tmp_path):
+    short = synthetic_sweep(1000, "short", seed=1)
+    short_path = str(tmp_path / "short.dat")
+    write_dat(short_path, short)
+    httpd = serve()
+    url = f"http://127.0.0.1:{httpd.server_address[1]}"
+    try:
+        exclude = [31500, 32500]
+        status, by_path = post(url + "/fit", {"wide": wide, "short": short_path, "exclude": exclude})
+        assert status == 200 and by_path["success"]
+        assert by_path["f0"] == pytest.approx(synthetic_resonance[0], abs=50)
+        payload = {"wide": wide, "exclude": exclude, "frequency": short["frequency"].tolist(),
+                   "X": short["X"].tolist(), "Y": short["Y"].tolist()}
+        status, by_arrays = post(url + "/fit", payload)
+        assert status == 200
+        assert by_arrays["f0"] == pytest.approx(by_path["f0"])
+        with urllib.request.urlopen(url + "/health", timeout=10) as response:
+            assert json.loads(response.read().decode("utf-8"))["backgrounds"] == 1
+        with pytest.raises(urllib.error.HTTPError) as err:
+            post(url + "/fit", {"wide": wide})
+        assert err.value.code == 400
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+@pytest.mark.skipif(not socket.has_ipv6, reason="no IPv6")
+def test_ipv6_loopback():
+    try:
+        httpd = serve("::1")
+    except OSError as ex:
+        pytest.skip(f"::1 is not available: {ex}")
+    try:
+        with urllib.request.urlopen(f"http://[::1]:{httpd.server_address[1]}/health", timeout=10) as response:
+            assert json.loads(response.read().decode("utf-8"))["status"] == "ok"
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def test_remote_host_is_refused():
+    with pytest.raises(ValueError):
+        server.make_server(0, 1, "0.0.0.0")
+
+
+def test_nan_is_null():
+    body = server.to_json({"K": float("nan"), "fit": [1.0, np.float64("inf")], "ok": True})
+    assert json.loads(json.dumps(body, allow_nan=False)) == {"K": None, "fit": [1.0, None], "ok": True}
+
+
+def test_backgrounds_are_bounded(tmp_path):
+    service = server.FitService(max_backgrounds=2)
+    paths = []
+    for idx in range(3):
+        path = str(tmp_path / f"wide{idx}.dat")
+        write_dat(path, synthetic_sweep(2000, "wide", seed=idx))
+        paths.append(path)
+    coefs = [service.background(path, [31500, 32500]) for path in paths]
+    assert len(service.backgrounds) == 2 and not service.key_locks
+    assert [key[0] for key in service.backgrounds] == paths[1:]
+    # the first sweep is fitted again, from the background cache of the session
+    assert np.array_equal(service.background(paths[0], [31500, 32500])[0], coefs[0][0])
+    assert [key[0] for key in service.backgrounds] == paths[2:] + paths[:1]
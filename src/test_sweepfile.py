@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+import loader
+import sweepfile
+from benchmarks import synthetic_sweep, write_dat
+
+
+def test_round_trip(tmp_path):
+    data = synthetic_sweep(1000, "short")
+    path = str(tmp_path / "sweep.swp")
+    written = sweepfile.write_sweep(path, data, "short")
+    header = sweepfile.read_header(path)
+    assert header == written
+    assert header.group == "short" and header.points == 1000
+    assert header.start == pytest.approx(data["uni_time"][0] / loader.date_convert)
+    assert (header.f_min, header.f_max) == (data["frequency"].min(), data["frequency"].max())
+    sweep = sweepfile.read_columns(path)
+    assert len(sweep) == 1000
+    assert np.array_equal(sweep.to_records(), data)
+    chunks = list(sweepfile.iter_records(path, chunk_rows=300))
+    assert [len(chunk) for chunk in chunks] == [300, 300, 300, 100]
+    assert np.array_equal(np.concatenate(chunks), data)
+
+
+def test_convert_dat(tmp_path):
+    data = synthetic_sweep(500, "wide")
+    dat = str(tmp_path / "wide.dat")
+    write_dat(dat, data)
+    target = sweepfile.convert(dat, str(tmp_path), "wide")
+    assert target == str(tmp_path / "wide.swp")
+    assert np.array_equal(sweepfile.read_columns(target).to_records(), loader.load_sweep(dat))
+
+
+def test_broken_files(tmp_path):
+    path = str(tmp_path / "sweep.swp")
+    sweepfile.write_sweep(path, synthetic_sweep(100), "short")
+    with open(path, "r+b") as f:
+        f.truncate(sweepfile.header_size + 10)
+    with pytest.raises(ValueError, match="truncated"):
+        sweepfile.read_header(path)
+    with open(path, "wb") as f:
+        f.write(b"not a sweep" * 10)
+    with pytest.raises(ValueError, match="not a binary sweep"):
+        sweepfile.read_columns(path)
+    with pytest.raises(ValueError):
+        sweepfile.write_sweep(path, synthetic_sweep(10), "other")
@@ -0,0 +1,77 @@
+import threading
+import time
+
+import pipeline
+import tasks
+from benchmarks import synthetic_sweep
+from fitting import fit_resonance
+from misc import SweepData
+
+
+class FakeTk(object):
+    def after(self, ms, func):
+        return "job"
+
+
+def wait_results(runner, count, timeout=5.0):
+    end = time.monotonic() + timeout
+    while runner.results.qsize() < count and time.monotonic() < end:
+        time.sleep(0.01)
+
+
+def test_late_result_of_cancelled_task_is_dropped():
+    progress = []
+    done = []
+    runner = tasks.TaskRunner(FakeTk(), lambda *args: progress.append(args))
+    release = threading.Event()
+
+    def slow(report):
+        release.wait(5)
+        return "old"
+
+    runner.submit("fit", slow, done.append)
+    runner.submit("fit", lambda report: "new", done.append)
+    release.set()
+    wait_results(runner, 2)
+    runner.poll()
+    assert done == ["new"]
+    assert progress == [("fit", 1.0, "cancelled"), ("fit", 1.0, "done")]
+    assert not runner.busy
+
+
+def run_cancelled(work, cancel_after):
+    """
+    Runs `work(check)` as a task whose token is cancelled by the `cancel_after`-th check,
+    returns the kind of the result message and the number of checks
+    """
+    runner = tasks.TaskRunner(FakeTk())
+    calls = []
+
+    def func(progress):
+        def check():
+            calls.append(1)
+            if len(calls) == cancel_after:
+                progress.token.cancel()
+            progress.check()
+        return work(check)
+
+    runner.submit("fit", func, lambda result: None)
+    wait_results(runner, 1)
+    kind = runner.results.get_nowait()[0]
+    return kind, len(calls)
+
+
+def test_cancel_stops_resonance_fit():
+    data = synthetic_sweep(5000, "short")
+    freq, dx, dy = data["frequency"], data["X"], data["Y"]
+    # the tolerance never stops the fit, only the cancel does
+    kind, calls = run_cancelled(lambda check: fit_resonance(freq, dx, dy, (31000.0, 10.0, 1000.0), max_nfev=10 ** 6,
+                                                            tol=1e-15, check=check), 3)
+    assert (kind, calls) == ("cancelled", 3)
+
+
+def test_cancel_stops_robust_fit():
+    sweep = SweepData()
+    sweep.create_data(synthetic_sweep(5000, "wide"))
+    kind, calls = run_cancelled(lambda check: pipeline.robust_coefficients(sweep, check=check), 2)
+    assert (kind, calls) == ("cancelled", 2)
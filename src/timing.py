@@ -0,0 +1,151 @@
+"""
+Timing of the processing stages. Every stage writes one JSON record per line into `timings.jsonl`
+next to app.log: the stage, wall time, number of points and e.g. the evaluations of a fit. Report:
+    python timing.py
+    python timing.py timings.jsonl --stage fit_resonance
+"""
+import argparse
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+from logger import Logger, log_settings, timing_settings
+
+#logger
+app_log = log_settings()
+timing_log = timing_settings()
+
+# the last records of this process, e.g. for a status bar
+recent: Deque[Dict] = deque(maxlen=1000)
+
+
+def write(record: Dict) -> None:
+    recent.append(record)
+    timing_log.info(json.dumps(record, default=str))
+
+
+@contextmanager
+def stage(name: str, points: Optional[int] = None, **fields) -> Iterator[Dict]:
+    """
+    Times the block and writes its record. Values known at the end are set to the yielded record:
+        with stage("fit_resonance", len(freq)) as record:
+            res = least_squares(...)
+            record["nfev"] = res.nfev
+    :param name: name of the stage
+    :param points: number of processed points
+    :param fields: other values of the record, e.g. the figure
+    """
+    record: Dict = {"stage": name, "points": None if points is None else int(points)}
+    record.update(fields)
+    start = time.perf_counter()
+    try:
+        yield record
+    except BaseException as ex:
+        record["error"] = type(ex).__name__
+        raise
+    finally:
+        record["seconds"] = time.perf_counter() - start
+        record["time"] = time.time()
+        record["pid"] = os.getpid()
+        record["thread"] = threading.current_thread().name
+        write(record)
+
+
+def timed(name: str, points: Optional[Callable[..., Optional[int]]] = None,
+          fields: Optional[Callable[[Any], Dict]] = None) -> Callable:
+    """
+    Decorator which runs the function as a `stage`
+    :param points: number of points from the arguments of the function
+    :param fields: values of the record from the result, e.g. the iterations of a fit
+    """
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name, points(*args, **kwargs) if points is not None else None) as record:
+                res = func(*args, **kwargs)
+                if fields is not None:
+                    record.update(fields(res))
+                return res
+        return wrapper
+    return decorator
+
+
+def read_records(path: str = Logger.timingfile) -> List[Dict]:
+    """
+    Records of the file and of its rotated copies, oldest first. Broken lines are skipped.
+    """
+    records = []
+    for name in (f"{path}.2", f"{path}.1", path):
+        if not os.path.exists(name):
+            continue
+        with open(name) as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    app_log.debug(f"Broken timing record in {name}: {line[:80]}")
+    return records
+
+
+def summarize(records: Sequence[Dict]) -> List[Dict]:
+    """
+    Statistics of every stage: count, errors, total, median and maximum time, median points and nfev
+    """
+    stages: Dict[str, List[Dict]] = dict()
+    for record in records:
+        stages.setdefault(record["stage"], []).append(record)
+    rows = []
+    for name, items in stages.items():
+        seconds = np.array([item["seconds"] for item in items])
+        points = [item["points"] for item in items if item.get("points") is not None]
+        nfev = [item["nfev"] for item in items if item.get("nfev") is not None]
+        rows.append({"stage": name, "count": len(items), "errors": sum("error" in item for item in items),
+                     "total": float(seconds.sum()), "median": float(np.median(seconds)), "max": float(seconds.max()),
+                     "points": float(np.median(points)) if points else None,
+                     "nfev": float(np.median(nfev)) if nfev else None})
+    return sorted(rows, key=lambda row: -row["total"])
+
+
+def print_report(rows: Sequence[Dict]) -> None:
+    print(f"{'stage':>16} {'count':>6} {'errors':>6} {'total s':>9} {'median s':>9} {'max s':>9} "
+          f"{'points':>10} {'nfev':>6}")
+    for row in rows:
+        points = f"{row['points']:.0f}" if row["points"] is not None else "-"
+        nfev = f"{row['nfev']:.0f}" if row["nfev"] is not None else "-"
+        print(f"{row['stage']:>16} {row['count']:>6d} {row['errors']:>6d} {row['total']:>9.4f} "
+              f"{row['median']:>9.4f} {row['max']:>9.4f} {points:>10} {nfev:>6}")
+
+
+def parse_args(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Report of the stage timings of the fork feedthrough app")
+    parser.add_argument("path", nargs="?", default=Logger.timingfile, help="timing records, timings.jsonl by default")
+    parser.add_argument("--stage", action="append", help="only these stages, may be repeated")
+    parser.add_argument("--last", type=float, help="only the records of the last hours")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    args = parse_args(argv)
+    records = read_records(args.path)
+    if args.stage:
+        records = [record for record in records if record["stage"] in args.stage]
+    if args.last is not None:
+        since = time.time() - args.last * 3600
+        records = [record for record in records if record.get("time", 0) >= since]
+    if not records:
+        print(f"No timing records in {args.path}")
+        return 1
+    print_report(summarize(records))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())